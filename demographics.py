@@ -9,12 +9,16 @@
 
 import os
 import sys
+import atexit
+import shutil
 import time
 import json
+import random
 import argparse
 import logging
 import requests
 import pandas as pd
+from collections import Counter
 from datetime import datetime, timedelta
 from pathlib import Path
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
@@ -109,6 +113,21 @@ DEMOGRAPHIC_METRICS = {
     }
 }
 
+# Metriker vars nycklar är "M.13-17"-format och visas via format_gender_age
+GENDER_AGE_METRICS = frozenset({"page_fans_gender_age", "page_impressions_by_age_gender_unique"})
+
+def _link_latest_log(log_filename, latest_name):
+    """Låt latest_name peka på den datumstämplade loggen (symlänk) i stället för
+    att skriva varje loggrad till två filer. Där symlänkar inte stöds kopieras
+    loggen dit när skriptet avslutas."""
+    try:
+        if os.path.lexists(latest_name):
+            os.remove(latest_name)
+        os.symlink(log_filename, latest_name)
+    except (OSError, NotImplementedError):
+        atexit.register(shutil.copyfile, log_filename, latest_name)
+
+
 # Konfigurera loggning
 def setup_logging():
     """Konfigurera loggning med datumstämplad loggfil"""
@@ -128,10 +147,11 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(log_filename),
-            logging.FileHandler("demographics.log", mode="w"),  # Överskriver tidigare loggfil
             logging.StreamHandler()  # Terminal-utskrift
         ]
     )
+    # demographics.log pekar alltid på senaste körningens logg
+    _link_latest_log(log_filename, "demographics.log")
     
     logger = logging.getLogger(__name__)
     logger.info(f"Startar loggning till fil: {log_filename}")
@@ -141,9 +161,14 @@ def setup_logging():
 # Konfigurera loggning
 logger = setup_logging()
 
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningen (keep-alive) mellan anrop
+_session = requests.Session()
+
 # Räknare för API-anrop
 api_call_count = 0
-start_time = time.time()
+start_time = time.monotonic()
+# Högsta andelen (procent) av appens gräns enligt senaste X-App-Usage-header
+app_usage_percent = 0
 
 def check_token_expiry():
     """Kontrollera om token snart går ut och varna användaren"""
@@ -165,13 +190,13 @@ def check_token_expiry():
 
 def api_request(url, params, retries=MAX_RETRIES):
     """Gör API-förfrågan med återförsök och rate limit-hantering"""
-    global api_call_count
+    global api_call_count, app_usage_percent
     
     for attempt in range(retries):
         try:
             api_call_count += 1
             logger.debug(f"API-anrop {api_call_count}: {url} med parametrar {params}")
-            response = requests.get(url, params=params, timeout=30)
+            response = _session.get(url, params=params, timeout=30)
             
             # Kontrollera X-App-Usage och X-Ad-Account-Usage headers för bättre rate limiting
             app_usage = response.headers.get('X-App-Usage')
@@ -181,6 +206,7 @@ def api_request(url, params, retries=MAX_RETRIES):
                     call_count = usage_data.get('call_count', 0)
                     total_time = usage_data.get('total_time', 0)
                     total_cputime = usage_data.get('total_cputime', 0)
+                    app_usage_percent = max(call_count, total_time, total_cputime)
                     
                     # Om vi närmar oss gränser, vänta
                     if call_count > 80 or total_time > 80 or total_cputime > 80:  # 80% av gränsen
@@ -264,6 +290,16 @@ def api_request(url, params, retries=MAX_RETRIES):
     
     return None
 
+def page_pause_seconds():
+    """Paus mellan sidor utifrån senast rapporterad API-användning.
+
+    Under 50 % av gränsen finns ingen anledning att vänta; därefter en kort,
+    slumpad paus så att anropen sprids ut. Över 80 % väntar api_request själv.
+    """
+    if app_usage_percent < 50:
+        return 0
+    return random.uniform(0, 4)
+
 def validate_token(token):
     """Validera att token är giltig och hämta användarbehörigheter"""
     logger.info("Validerar token...")
@@ -295,11 +331,16 @@ def validate_token(token):
     
     return True
 
+# Page Access Tokens från sidlistningen ({page_id: token})
+page_tokens = {}
+
 def get_page_ids_with_access(token):
     """Hämta alla sidor som token har åtkomst till"""
     logger.info("Hämtar tillgängliga sidor...")
     url = f"https://graph.facebook.com/{API_VERSION}/me/accounts"
-    params = {"access_token": token, "limit": 100, "fields": "id,name,category,fan_count"}
+    # access_token följer med i listningen så att sidornas Page Access Tokens inte
+    # behöver hämtas med ett eget anrop per sida (se get_page_access_token)
+    params = {"access_token": token, "limit": 100, "fields": "id,name,category,fan_count,access_token"}
     
     pages = []
     next_url = url
@@ -324,6 +365,8 @@ def get_page_ids_with_access(token):
         logger.warning("Inga sidor hittades. Token kanske saknar 'pages_show_list'-behörighet.")
         return []
     
+    page_tokens.update((page["id"], page["access_token"]) for page in pages if page.get("access_token"))
+    
     # Sortera sidor efter antal fans (högst först)
     pages.sort(key=lambda p: p.get("fan_count", 0), reverse=True)
     
@@ -345,6 +388,9 @@ def get_page_ids_with_access(token):
 
 def get_page_access_token(page_id, system_token):
     """Konvertera systemanvändartoken till en Page Access Token för en specifik sida"""
+    if page_id in page_tokens:
+        return page_tokens[page_id]
+    
     logger.debug(f"Hämtar Page Access Token för sida {page_id}...")
     url = f"https://graph.facebook.com/{API_VERSION}/{page_id}"
     params = {
@@ -361,6 +407,29 @@ def get_page_access_token(page_id, system_token):
     
     return data["access_token"]
 
+def metric_values_series(values):
+    """Gör om en values-dikt ({nyckel: antal}) till en numerisk Series.
+
+    Icke-numeriska värden blir 0 i stället för att få summeringen att krascha.
+    """
+    if not values:
+        return pd.Series(dtype="int64")
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").fillna(0).astype("int64")
+
+def sum_metric_values(values):
+    """Summera en values-dikt vektoriserat"""
+    return int(metric_values_series(values).sum())
+
+def gender_totals_from_values(values):
+    """Summera page_fans_gender_age-värden ("M.13-17", "F.18-24", ...) per kön"""
+    series = metric_values_series(values)
+    totals = {"M": 0, "F": 0, "U": 0}
+    if not series.empty:
+        by_gender = series.groupby(series.index.str.split(".").str[0]).sum()
+        for gender in totals:
+            totals[gender] = int(by_gender.get(gender, 0))
+    return totals
+
 def get_demographic_data(page_id, page_name, system_token, detailed=False):
     """Hämta demografisk data för en sida med rätt perioder för varje metrik"""
     logger.info(f"Hämtar demografisk data för sida: {page_name} (ID: {page_id})...")
@@ -415,8 +484,8 @@ def get_demographic_data(page_id, page_name, system_token, detailed=False):
                 # För nyare data, använd senaste 28 dagarna
                 end_date = datetime.now()
                 start_date = end_date - timedelta(days=28)
-                params["since"] = start_date.strftime("%Y-%m-%d")
-                params["until"] = end_date.strftime("%Y-%m-%d")
+                params["since"] = start_date.date().isoformat()
+                params["until"] = end_date.date().isoformat()
             
             logger.debug(f"Hämtar {metric_name} för {page_name} med period={period}")
             
@@ -483,8 +552,8 @@ def get_demographic_data(page_id, page_name, system_token, detailed=False):
         logger.warning(f"⚠️ Ingen demografisk data hittades för sida {page_name}")
     else:
         # Beräkna sammanfattande statistik
-        total_fans_by_country = sum(result["data"].get("page_fans_country", {}).get("values", {}).values())
-        total_fans_by_city = sum(result["data"].get("page_fans_city", {}).get("values", {}).values())
+        total_fans_by_country = sum_metric_values(result["data"].get("page_fans_country", {}).get("values", {}))
+        total_fans_by_city = sum_metric_values(result["data"].get("page_fans_city", {}).get("values", {}))
         
         logger.info(f"📊 Sammanfattning för {page_name}:")
         logger.info(f"  - Totalt antal fans från länder: {total_fans_by_country:,}")
@@ -494,11 +563,7 @@ def get_demographic_data(page_id, page_name, system_token, detailed=False):
         gender_age_data = result["data"].get("page_fans_gender_age", {}).get("values", {})
         if gender_age_data:
             # Beräkna totaler per kön
-            gender_totals = {"M": 0, "F": 0, "U": 0}
-            for key, value in gender_age_data.items():
-                gender = key.split(".")[0]  # Format är "M.13-17", "F.18-24", etc.
-                if gender in gender_totals:
-                    gender_totals[gender] += value
+            gender_totals = gender_totals_from_values(gender_age_data)
             
             # Visa könfördelning
             total_with_gender = sum(gender_totals.values())
@@ -536,9 +601,11 @@ def process_pages(pages, output_file, selected_page_ids=None, detailed=False):
         data["fans"] = fans
         results.append(data)
         
-        # Vänta lite mellan anrop för att inte överbelasta API:et
+        # Vänta mellan sidor bara när API-användningen börjar bli hög
         if i < len(pages) - 1:
-            time.sleep(2)
+            pause = page_pause_seconds()
+            if pause:
+                time.sleep(pause)
     
     # Skapa Excel-filen
     create_excel_report(results, output_file, detailed=detailed)
@@ -593,8 +660,8 @@ def create_excel_report(results, output_file, detailed=False):
     if not os.path.exists(csv_dir):
         os.makedirs(csv_dir)
     
-    # Samla all data för CSV-export
-    all_data_rows = []
+    # Samla all data för CSV-export (en DataFrame per sida och metrikgrupp)
+    all_data_frames = []
     
     # Skapa översiktsflik
     overview_data = []
@@ -612,15 +679,16 @@ def create_excel_report(results, output_file, detailed=False):
         locale_fans_count = len(result["data"].get("page_fans_locale", {}).get("values", {}))
         
         # Beräkna totalsumma av fans från olika måttvärden när det är tillgängligt
-        total_country_fans = sum(result["data"].get("page_fans_country", {}).get("values", {}).values())
-        total_city_fans = sum(result["data"].get("page_fans_city", {}).get("values", {}).values())
-        total_gender_age_fans = sum(result["data"].get("page_fans_gender_age", {}).get("values", {}).values())
+        total_country_fans = sum_metric_values(result["data"].get("page_fans_country", {}).get("values", {}))
+        total_city_fans = sum_metric_values(result["data"].get("page_fans_city", {}).get("values", {}))
+        total_gender_age_fans = sum_metric_values(result["data"].get("page_fans_gender_age", {}).get("values", {}))
         
         # Sammanställ könfördelning om tillgänglig
         gender_age_data = result["data"].get("page_fans_gender_age", {}).get("values", {})
-        male_fans = sum(v for k, v in gender_age_data.items() if k.startswith("M."))
-        female_fans = sum(v for k, v in gender_age_data.items() if k.startswith("F."))
-        unknown_gender_fans = sum(v for k, v in gender_age_data.items() if k.startswith("U."))
+        gender_totals = gender_totals_from_values(gender_age_data)
+        male_fans = gender_totals["M"]
+        female_fans = gender_totals["F"]
+        unknown_gender_fans = gender_totals["U"]
         
         # Beräkna procent av könsfördelning
         total_gender = male_fans + female_fans + unknown_gender_fans
@@ -728,6 +796,7 @@ def create_excel_report(results, output_file, detailed=False):
             metric_values = metric_data.get("values", {})
             metric_error = metric_data.get("error", None)
             metric_period = metric_data.get("period", "")
+            is_gender_age = group["metric"] in GENDER_AGE_METRICS
             
             # Skapa titel
             title = f"{group['title']} ({metric_period})" if metric_period else group["title"]
@@ -736,12 +805,14 @@ def create_excel_report(results, output_file, detailed=False):
             row_offset += 1
             
             if metric_values:
-                # Skapa dataframe och sortera efter värde (högst först)
-                df = pd.DataFrame(metric_values.items(), columns=group["columns"])
+                # För gender_age, konvertera till mer läsbara etiketter (en gång –
+                # samma etiketter används både i Excel-fliken och i CSV-exporten)
+                keys = list(metric_values)
+                if is_gender_age:
+                    keys = [format_gender_age(key) for key in keys]
                 
-                # För gender_age, konvertera till mer läsbara etiketter
-                if group["metric"] == "page_fans_gender_age" or group["metric"] == "page_impressions_by_age_gender_unique":
-                    df[group["columns"][0]] = df[group["columns"][0]].apply(lambda x: format_gender_age(x))
+                # Skapa dataframe och sortera efter värde (högst först)
+                df = pd.DataFrame(zip(keys, metric_values.values()), columns=group["columns"])
                 
                 # Sortera efter värde högst först
                 df = df.sort_values(group["columns"][1], ascending=False)
@@ -750,25 +821,23 @@ def create_excel_report(results, output_file, detailed=False):
                 df.to_excel(writer, sheet_name=sheet_name, startrow=row_offset, startcol=0, index=False)
                 
                 # Beräkna totalsumma
-                total = sum(metric_values.values())
+                total = sum_metric_values(metric_values)
                 total_df = pd.DataFrame([["TOTALT", total]], columns=group["columns"])
                 total_df.to_excel(writer, sheet_name=sheet_name, startrow=row_offset+len(df)+1, startcol=0, header=False, index=False)
                 
                 # Uppdatera rad-offset för nästa grupp
                 row_offset += len(df) + 4
                 
-                # Lägg till data för CSV-export
-                for key, value in metric_values.items():
-                    formatted_key = format_gender_age(key) if group["metric"] in ["page_fans_gender_age", "page_impressions_by_age_gender_unique"] else key
-                    all_data_rows.append({
-                        "Page name": page_name,
-                        "Page ID": page_id,
-                        "Dimension": group["metric"],
-                        "Category": group["title"],
-                        "Key": formatted_key,
-                        "Value": value,
-                        "Period": metric_period
-                    })
+                # Lägg till data för CSV-export – kolumnvis, konstanterna broadcastas
+                all_data_frames.append(pd.DataFrame({
+                    "Page name": page_name,
+                    "Page ID": page_id,
+                    "Dimension": group["metric"],
+                    "Category": group["title"],
+                    "Key": keys,
+                    "Value": list(metric_values.values()),
+                    "Period": metric_period
+                }))
             else:
                 # Skapa "ingen data" meddelande
                 no_data_message = f"Ingen data tillgänglig: {metric_error}" if metric_error else "Ingen data tillgänglig"
@@ -787,21 +856,18 @@ def create_excel_report(results, output_file, detailed=False):
     logger.info(f"✅ Excel-rapport sparad till {output_file}")
     
     # Skapa CSV-export
-    if all_data_rows:
+    if all_data_frames:
         csv_path = os.path.join(csv_dir, "demographic_full_export.csv")
-        csv_df = pd.DataFrame(all_data_rows)
+        csv_df = pd.concat(all_data_frames, ignore_index=True)
         csv_df.to_csv(csv_path, index=False, encoding='utf-8')
         logger.info(f"✅ CSV-export sparad till {csv_path}")
         
         # Skapa specifika exports per dimensionstyp
-        for dimension in set(row["Dimension"] for row in all_data_rows):
-            dimension_data = [row for row in all_data_rows if row["Dimension"] == dimension]
-            if dimension_data:
-                clean_dimension = dimension.replace("page_", "").replace("_", "-")
-                dimension_csv_path = os.path.join(csv_dir, f"demographic_{clean_dimension}.csv")
-                dimension_df = pd.DataFrame(dimension_data)
-                dimension_df.to_csv(dimension_csv_path, index=False, encoding='utf-8')
-                logger.info(f"✅ CSV för {clean_dimension} sparad till {dimension_csv_path}")
+        for dimension, dimension_df in csv_df.groupby("Dimension", sort=False):
+            clean_dimension = dimension.replace("page_", "").replace("_", "-")
+            dimension_csv_path = os.path.join(csv_dir, f"demographic_{clean_dimension}.csv")
+            dimension_df.to_csv(dimension_csv_path, index=False, encoding='utf-8')
+            logger.info(f"✅ CSV för {clean_dimension} sparad till {dimension_csv_path}")
 
 def format_gender_age(key):
     """Formatera kön och åldersnycklar till läsbara etiketter"""
@@ -866,7 +932,7 @@ def main():
     results = process_pages(page_list, args.output, selected_page_ids=selected_page_ids, detailed=args.detailed)
     
     # Visa statistik om API-användning
-    elapsed_time = time.time() - start_time
+    elapsed_time = time.monotonic() - start_time
     logger.info(f"⏱️ Total körtid: {elapsed_time:.1f} sekunder")
     logger.info(f"🌐 API-anrop: {api_call_count} ({api_call_count/elapsed_time*3600:.1f}/timme)")
     logger.info(f"✅ Klar! Bearbetade {len(results)} sidor")
@@ -876,7 +942,7 @@ def main():
     logger.info(f"📊 Lyckades hämta data för {successful_pages} av {len(results)} sidor")
     
     # Visa några sammanfattande felorsaker om relevanta
-    error_types = {}
+    error_types = Counter()
     for r in results:
         if r["error"]:
             # Extrahera grundorsak från felmeddelandet
@@ -890,7 +956,7 @@ def main():
             elif "rate limit" in r["error"].lower():
                 error_type = "Rate limit"
             
-            error_types[error_type] = error_types.get(error_type, 0) + 1
+            error_types[error_type] += 1
     
     if error_types:
         logger.info("Vanliga felorsaker:")
@@ -2,6 +2,7 @@
 # Komplett diagnostikskript för Facebook räckviddsmätningar
 
 import csv
+import hashlib
 import json
 import os
 import time
@@ -10,8 +11,11 @@ import logging
 import argparse
 import sys
 import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from calendar import monthrange
+from operator import itemgetter
 from config import (
     ACCESS_TOKEN, TOKEN_LAST_UPDATED, INITIAL_START_YEAR_MONTH,
     API_VERSION, CACHE_FILE, 
@@ -31,9 +35,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningar (keep-alive) mellan anrop.
+# Poolen rymmer en anslutning per parallell sidtråd (BATCH_SIZE).
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(BATCH_SIZE, 10)))
+
 # Räknare för API-anrop
 api_call_count = 0
-start_time = time.time()
+start_time = time.monotonic()
+# Sidorna diagnostiseras i parallella trådar – skyddar api_call_count
+_state_lock = threading.Lock()
+
+# Tokens som API:et svarat med fel 190 (ogiltig token) på under körningen
+invalid_tokens = set()
+
+# Mätvärdeslistor (tuple) vars kombinerade anrop avvisats – t.ex. pga ett utfasat
+# mätvärde. Resten av körningen hämtas de ett i taget direkt.
+rejected_metric_lists = set()
+
+# Diskcache för insights-svar. Avslutade månader ändras inte, så omkörningar
+# (felsökning, återstart efter fel) behöver inte fråga API:et igen.
+RESPONSE_CACHE_DIR = ".fb_api_cache"
+RESPONSE_CACHE_TTL = 3600  # Sekunder för perioder som slutar inom de senaste 30 dagarna
+use_response_cache = True
 
 def check_token_expiry():
     """Kontrollera om token snart går ut och varna användaren"""
@@ -64,22 +88,81 @@ def load_page_cache():
     return {}
 
 def save_page_cache(cache):
-    """Spara cache med sidnamn för framtida körningar"""
+    """Spara cache med sidnamn och Page Access Tokens för framtida körningar"""
+    # Skriv till temporärfil och byt atomärt, så att ett avbrott mitt i
+    # skrivningen inte lämnar en trasig cache
+    tmp_file = CACHE_FILE + ".tmp"
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
+        with open(tmp_file, "w", encoding="utf-8") as f:
             json.dump(cache, f, ensure_ascii=False, indent=2)
-            logger.debug(f"Sparade sid-cache till {CACHE_FILE}")
+        # Cachen innehåller Page Access Tokens – endast läsbar för ägaren
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, CACHE_FILE)
+        logger.debug(f"Sparade sid-cache till {CACHE_FILE}")
     except Exception as e:
         logger.error(f"Kunde inte spara cache: {e}")
 
+def _response_cache_key(url, params):
+    """Cachenyckel för ett anrop – token ingår inte, svaret beror inte på den"""
+    items = sorted((key, str(value)) for key, value in params.items() if key != "access_token")
+    return hashlib.sha1(f"{url}|{items}".encode("utf-8")).hexdigest()
+
+def _is_historical(until):
+    """True om perioden (until = YYYY-MM-DD) slutade för mer än 30 dagar sedan"""
+    try:
+        until_date = datetime.strptime(str(until), "%Y-%m-%d")
+    except ValueError:
+        return False
+    return datetime.now() - until_date > timedelta(days=30)
+
 def api_request(url, params, retries=MAX_RETRIES):
+    """Gör API-förfrågan; svar för tidsperioder (med 'until') cachas på disk.
+
+    Historiska perioder cachas utan utgång, övriga i RESPONSE_CACHE_TTL sekunder.
+    Felsvar och tomma svar cachas aldrig – ett mätvärde utan data nu kan få
+    det senare (samma regel som fetch_viewers.py, som delar katalogen).
+    """
+    if not use_response_cache or "until" not in params:
+        return _api_request_uncached(url, params, retries)
+    
+    cache_path = os.path.join(RESPONSE_CACHE_DIR, _response_cache_key(url, params) + ".json")
+    # Ett os.stat ger både existens och ålder (i stället för exists + getmtime)
+    try:
+        age = time.time() - os.stat(cache_path).st_mtime
+    except OSError:
+        age = None
+    if age is not None:
+        if _is_historical(params["until"]) or age < RESPONSE_CACHE_TTL:
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    logger.debug(f"Svar hämtat från diskcache ({cache_path})")
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError):
+                logger.debug(f"Kunde inte läsa diskcache {cache_path}, hämtar från API")
+    
+    data = _api_request_uncached(url, params, retries)
+    
+    if data is not None and "error" not in data and data.get("data"):
+        try:
+            os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.debug(f"Kunde inte skriva diskcache: {e}")
+    
+    return data
+
+def _api_request_uncached(url, params, retries=MAX_RETRIES):
     """Gör API-förfrågan med återförsök och rate limit-hantering"""
     global api_call_count
     
     # Kontrollera om vi närmar oss rate limit
-    current_time = time.time()
+    current_time = time.monotonic()
     elapsed_hours = (current_time - start_time) / 3600
-    rate = api_call_count / elapsed_hours if elapsed_hours > 0 else 0
+    with _state_lock:
+        rate = api_call_count / elapsed_hours if elapsed_hours > 0 else 0
     
     if rate > MAX_REQUESTS_PER_HOUR * 0.9:  # Om vi använt 90% av rate limit
         wait_time = 3600 / MAX_REQUESTS_PER_HOUR  # Vänta tillräckligt för att hålla oss under gränsen
@@ -88,8 +171,9 @@ def api_request(url, params, retries=MAX_RETRIES):
     
     for attempt in range(retries):
         try:
-            api_call_count += 1
-            response = requests.get(url, params=params, timeout=30)
+            with _state_lock:
+                api_call_count += 1
+            response = _session.get(url, params=params, timeout=30)
             
             # Hantera vanliga HTTP-fel
             if response.status_code == 429:  # Too Many Requests
@@ -119,7 +203,14 @@ def api_request(url, params, retries=MAX_RETRIES):
                         
                     elif error_code == 190:  # Ogiltig token
                         logger.error(f"Access token ogiltig: {error_msg}")
+                        invalid_tokens.add(params.get("access_token"))
                         return None
+                    
+                    elif not data["error"].get("is_transient"):
+                        # Bestående fel (t.ex. ogiltigt mätvärde, saknad behörighet) – ett nytt
+                        # försök ger samma svar, så felet lämnas till anroparen
+                        logger.debug(f"Graph-fel {error_code}: {error_msg}")
+                        return data
                         
             # Om allt ovan misslyckas och responskoden fortfarande är en felsignal
             if response.status_code != 200:
@@ -203,9 +294,14 @@ def get_page_ids_with_access(token):
 
 def get_page_name(page_id, cache):
     """Hämta sidans namn från cache eller API"""
-    if page_id in cache:
-        return cache[page_id]
-    
+    entry = cache.get(page_id)
+    # CACHE_FILE delas med kommentars-/DM-räknarna som sparar {"name": ..., "token": ...}
+    if isinstance(entry, dict):
+        if entry.get("name"):
+            return entry["name"]
+    elif entry:
+        return entry
+
     logger.debug(f"Hämtar namn för sida {page_id}...")
     url = f"https://graph.facebook.com/{API_VERSION}/{page_id}"
     params = {"fields": "name", "access_token": ACCESS_TOKEN}
@@ -218,11 +314,22 @@ def get_page_name(page_id, cache):
         return None
     
     name = data.get("name", f"Page {page_id}")
-    cache[page_id] = name
+    if isinstance(entry, dict):
+        entry["name"] = name
+    else:
+        cache[page_id] = name
     return name
 
-def get_page_access_token(page_id, system_token):
-    """Konvertera systemanvändartoken till en Page Access Token för en specifik sida"""
+def get_page_access_token(page_id, system_token, cache):
+    """Konvertera systemanvändartoken till en Page Access Token för en specifik sida.
+
+    Token sparas i sidcachen (samma {"name": ..., "token": ...}-format som
+    kommentars-/DM-räknarna) och återanvänds tills API:et svarar med fel 190.
+    """
+    entry = cache.get(page_id)
+    if isinstance(entry, dict) and entry.get("token") and entry["token"] not in invalid_tokens:
+        return entry["token"]
+
     logger.debug(f"Hämtar Page Access Token för sida {page_id}...")
     url = f"https://graph.facebook.com/{API_VERSION}/{page_id}"
     params = {
@@ -237,6 +344,9 @@ def get_page_access_token(page_id, system_token):
         logger.warning(f"⚠️ Kunde inte hämta Page Access Token för sida {page_id}: {error_msg}")
         return None
     
+    if not isinstance(entry, dict):
+        entry = cache[page_id] = {"name": entry} if entry else {}
+    entry["token"] = data["access_token"]
     return data["access_token"]
 
 def get_single_metric(page_id, page_token, since, until, metric_name, period="total_over_range"):
@@ -271,6 +381,104 @@ def get_single_metric(page_id, page_token, since, until, metric_name, period="to
     
     return 0
 
+def _get_metrics_one_by_one(page_id, page_token, since, until, metric_names, period):
+    """Ett anrop per mätvärde; avbryter om token visar sig vara ogiltig (fel 190)."""
+    values = {}
+    for metric_name in metric_names:
+        if page_token in invalid_tokens:
+            values[metric_name] = 0
+            continue
+        values[metric_name] = get_single_metric(page_id, page_token, since, until, metric_name, period)
+    return values
+
+def get_metrics(page_id, page_token, since, until, metric_names, period="total_over_range"):
+    """Hämta flera mätvärden i ett enda anrop (metric=a,b,c).
+
+    Ett ogiltigt mätvärde underkänner hela anropet, så om det misslyckas
+    hämtas mätvärdena ett i taget via get_single_metric i stället – vid
+    ogiltigt mätvärde (fel 100) även för alla följande sidor. Vid ogiltig
+    token (fel 190) returneras nollor direkt; anroparen hämtar ny token och
+    försöker igen.
+    """
+    metric_key = tuple(metric_names)
+    if metric_key in rejected_metric_lists:
+        return _get_metrics_one_by_one(page_id, page_token, since, until, metric_names, period)
+    
+    url = f"https://graph.facebook.com/{API_VERSION}/{page_id}/insights"
+    params = {
+        "access_token": page_token,
+        "since": since,
+        "until": until,
+        "period": period,
+        "metric": ",".join(metric_names)
+    }
+    
+    data = api_request(url, params)
+    
+    if not data or "error" in data or "data" not in data:
+        if page_token in invalid_tokens:
+            return {metric_name: 0 for metric_name in metric_names}
+        error = (data or {}).get("error", {})
+        if (error.get("code") == 100 and "valid insights metric" in error.get("message", "")
+                and metric_key not in rejected_metric_lists):
+            # Ogiltigt mätvärde i listan – gäller alla sidor. Övriga fel (timeout,
+            # behörighet på en enskild sida) ger bara reservvägen för den här sidan.
+            rejected_metric_lists.add(metric_key)
+            logger.info("Kombinerat insights-anrop avvisades – mätvärdena hämtas ett i taget resten av körningen")
+        logger.debug(f"Kombinerat insights-anrop misslyckades för sida {page_id}, hämtar mätvärdena ett i taget")
+        return _get_metrics_one_by_one(page_id, page_token, since, until, metric_names, period)
+    
+    values = {metric_name: 0 for metric_name in metric_names}
+    for item in data["data"]:
+        metric_name = item.get("name")
+        if metric_name in values and item.get("values"):
+            values[metric_name] = item["values"][0].get("value", 0)
+    
+    return values
+
+def diagnose_page(index, page_id, page_name, total_pages, cache, start_date, end_date, test_metrics):
+    """Hämta alla testmätvärden för en sida.
+
+    Returnerar (namn, page_id, {mätvärdesnyckel: värde}) eller None om sidan hoppas över.
+    """
+    try:
+        name = page_name or get_page_name(page_id, cache)
+        if not name:
+            logger.warning(f"⚠️ Kunde inte hitta namn för sida {page_id}, hoppar över")
+            return None
+        
+        logger.info(f"📊 Hämtar diagnostikdata för: {name} (ID: {page_id}) [{index}/{total_pages}]")
+        
+        # Hämta page token
+        page_token = get_page_access_token(page_id, ACCESS_TOKEN, cache)
+        if not page_token:
+            logger.warning(f"⚠️ Kunde inte hämta token för sida {page_id}, hoppar över")
+            return None
+        
+        # Hämta alla mätvärden i ett anrop
+        metric_names = [details["api_name"] for details in test_metrics.values()]
+        try:
+            values = get_metrics(page_id, page_token, start_date, end_date, metric_names)
+            if page_token in invalid_tokens:
+                # Cachad token ogiltig – hämta en ny och försök en gång till
+                logger.info(f"🔑 Cachad Page Access Token för sida {page_id} är ogiltig och hämtas på nytt")
+                page_token = get_page_access_token(page_id, ACCESS_TOKEN, cache)
+                if page_token:
+                    values = get_metrics(page_id, page_token, start_date, end_date, metric_names)
+        except Exception as e:
+            logger.warning(f"Kunde inte hämta mätvärden för {name}: {e}")
+            values = {}
+        
+        page_values = {}
+        for metric_key, metric_details in test_metrics.items():
+            page_values[metric_key] = values.get(metric_details["api_name"], 0)
+            logger.debug(f"  - {metric_key}: {page_values[metric_key]}")
+        return name, page_id, page_values
+        
+    except Exception as e:
+        logger.error(f"Fel vid bearbetning av sida {page_id}: {e}")
+        return None
+
 def process_month_diagnostic(year, month, test_metrics):
     """Kör diagnostik för en månad med olika mätvärden"""
     # Sätt datumintervall för månaden
@@ -297,68 +505,49 @@ def process_month_diagnostic(year, month, test_metrics):
     success = 0
     failed = 0
     
-    for i, (page_id, page_name) in enumerate(page_list):
-        try:
-            name = page_name or get_page_name(page_id, cache)
-            if not name:
-                logger.warning(f"⚠️ Kunde inte hitta namn för sida {page_id}, hoppar över")
-                failed += 1
-                continue
-            
-            logger.info(f"📊 Hämtar diagnostikdata för: {name} (ID: {page_id}) [{i+1}/{total_pages}]")
-            
-            # Hämta page token
-            page_token = get_page_access_token(page_id, ACCESS_TOKEN)
-            if not page_token:
-                logger.warning(f"⚠️ Kunde inte hämta token för sida {page_id}, hoppar över")
+    # Sidorna är oberoende av varandra och diagnostiseras parallellt (BATCH_SIZE trådar);
+    # executor.map behåller sidordningen i resultatet
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, total_pages))) as executor:
+        page_results = executor.map(
+            lambda index, page: diagnose_page(index, page[0], page[1], total_pages, cache,
+                                              start_date, end_date, test_metrics),
+            range(1, total_pages + 1), page_list
+        )
+        for i, result in enumerate(page_results, start=1):
+            if result is None:
                 failed += 1
                 continue
             
-            # Testa varje mätvärde separat
-            page_results = {"Page": name, "Page ID": page_id}
-            
-            for metric_key, metric_details in test_metrics.items():
-                metric_name = metric_details["api_name"]
-                try:
-                    value = get_single_metric(page_id, page_token, start_date, end_date, metric_name)
-                    page_results[metric_key] = value
-                    logger.debug(f"  - {metric_key}: {value}")
-                except Exception as e:
-                    logger.warning(f"Kunde inte hämta {metric_key} för {name}: {e}")
-                    page_results[metric_key] = 0
-            
             # Lägg till resultaten i respektive lista
+            name, page_id, values = result
             for metric_key in test_metrics.keys():
                 results_by_metric[metric_key].append({
                     "Page": name,
                     "Page ID": page_id,
-                    "Reach": page_results[metric_key]  # Använd detta mätvärde som "Reach"
+                    "Reach": values[metric_key]  # Använd detta mätvärde som "Reach"
                 })
             
             success += 1
             
             # Visa framsteg
-            progress = (i + 1) / total_pages * 100
+            progress = i / total_pages * 100
             logger.info(f"Framsteg: {progress:.1f}% klar ({success} lyckade, {failed} misslyckade)")
-            
-        except Exception as e:
-            logger.error(f"Fel vid bearbetning av sida {page_id}: {e}")
-            failed += 1
     
     # Spara resultat för varje mätvärde till separata filer
     for metric_key, results in results_by_metric.items():
         if results:
             output_file = f"FB_{year}_{month:02d}_{metric_key}.csv"
             try:
-                # Sortera resultaten efter räckvidd (högst först)
-                sorted_data = sorted(results, key=lambda x: x.get("Reach", 0), reverse=True)
+                # Plocka ut raderna som tupler en gång och sortera efter räckvidd (högst först)
+                rows = [(item["Page"], item["Page ID"], item.get("Reach", 0)) for item in results]
+                rows.sort(key=itemgetter(2), reverse=True)
                 
                 with open(output_file, mode="w", newline="", encoding="utf-8") as f:
-                    writer = csv.DictWriter(f, fieldnames=["Page", "Page ID", "Reach"])
-                    writer.writeheader()
-                    writer.writerows(sorted_data)
+                    writer = csv.writer(f)
+                    writer.writerow(["Page", "Page ID", "Reach"])
+                    writer.writerows(rows)
                     
-                total_reach = sum(item.get("Reach", 0) for item in results)
+                total_reach = sum(row[2] for row in rows)
                 logger.info(f"✅ Sparade data för {metric_key} till {output_file} (Total: {total_reach:,})")
             except Exception as e:
                 logger.error(f"❌ Kunde inte spara data för {metric_key}: {e}")
@@ -390,32 +579,32 @@ def create_comparison_report(year, month, test_metrics, results_by_metric):
             for item in results:
                 name_map[item["Page ID"]] = item["Page"]
         
+        # Indexera räckvidden per sida en gång i stället för att söka igenom
+        # hela resultatlistan för varje sida och mätvärde
+        reach_by_metric = {
+            metric_key: {item["Page ID"]: item["Reach"] for item in results_by_metric[metric_key]}
+            for metric_key in test_metrics.keys()
+        }
+        
         # Skapa jämförelsedata för varje sida
         for page_id in all_page_ids:
             page_data = {"Page": name_map.get(page_id, f"Page {page_id}"), "Page ID": page_id}
             
-            for metric_key in test_metrics.keys():
-                # Hitta räckvidd för denna sida i detta mätvärdes resultat
-                metric_results = results_by_metric[metric_key]
-                matching_results = [item for item in metric_results if item["Page ID"] == page_id]
-                
-                if matching_results:
-                    page_data[metric_key] = matching_results[0]["Reach"]
-                else:
-                    page_data[metric_key] = 0
+            for metric_key, reach_by_page in reach_by_metric.items():
+                page_data[metric_key] = reach_by_page.get(page_id, 0)
             
             comparison_data.append(page_data)
         
-        # Sortera efter det första mätvärdet (högst först)
-        first_metric = next(iter(test_metrics.keys()))
-        sorted_data = sorted(comparison_data, key=lambda x: x.get(first_metric, 0), reverse=True)
+        # Bygg raderna som listor en gång och sortera efter det första mätvärdet (högst först)
+        fieldnames = ["Page", "Page ID"] + list(test_metrics.keys())
+        rows = [[page_data.get(field, 0) for field in fieldnames] for page_data in comparison_data]
+        rows.sort(key=itemgetter(2), reverse=True)
         
         # Spara jämförelsefil
-        fieldnames = ["Page", "Page ID"] + list(test_metrics.keys())
         with open(output_file, mode="w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(sorted_data)
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(rows)
         
         logger.info(f"✅ Sparade jämförelserapport till {output_file}")
         
@@ -439,8 +628,13 @@ def main():
     parser.add_argument("--start", help="Startår-månad (YYYY-MM)")
     parser.add_argument("--month", help="Specifik månad att testa (YYYY-MM)")
     parser.add_argument("--debug", action="store_true", help="Aktivera debug-loggning")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Hämta allt från API:et i stället för diskcachen ({RESPONSE_CACHE_DIR}/)")
     args = parser.parse_args()
     
+    global use_response_cache
+    use_response_cache = not args.no_cache
+    
     # Sätt debug-läge om begärt
     if args.debug:
         logger.setLevel(logging.DEBUG)
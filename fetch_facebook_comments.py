@@ -4,15 +4,21 @@
 # Detta skript räknar kommentarer och replies på Facebook-sidors inlägg
 # och genererar CSV-rapporter per månad.
 
+import atexit
 import csv
 import json
 import os
+import re
+import shutil
 import time
 import requests
 import logging
 import argparse
 import sys
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from datetime import datetime, timedelta
 from calendar import monthrange
 from config import (
@@ -22,6 +28,18 @@ from config import (
     TOKEN_VALID_DAYS
 )
 
+def _link_latest_log(log_filename, latest_name):
+    """Låt latest_name peka på den datumstämplade loggen (symlänk) i stället för
+    att skriva varje loggrad till två filer. Där symlänkar inte stöds kopieras
+    loggen dit när skriptet avslutas."""
+    try:
+        if os.path.lexists(latest_name):
+            os.remove(latest_name)
+        os.symlink(log_filename, latest_name)
+    except (OSError, NotImplementedError):
+        atexit.register(shutil.copyfile, log_filename, latest_name)
+
+
 # Konfigurera loggning
 def setup_logging():
     """Konfigurera loggning med datumstämplad loggfil"""
@@ -38,10 +56,11 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(log_filename),
-            logging.FileHandler("facebook_comments.log"),
             logging.StreamHandler()
         ]
     )
+    # facebook_comments.log pekar alltid på senaste körningens logg
+    _link_latest_log(log_filename, "facebook_comments.log")
     
     logger = logging.getLogger(__name__)
     logger.info(f"Startar loggning till fil: {log_filename}")
@@ -77,11 +96,49 @@ def _unpack_next_url(next_url):
     return clean_url, params
 
 
+def _iter_pages(url, params):
+    """Iterera över sidorna i ett paginerat Graph API-svar.
+
+    Följer paging.cursors.after med samma url och params så länge det finns,
+    och faller tillbaka på paging.next (t.ex. tidsbaserad paginering med
+    since/until, som saknar cursors).
+    """
+    params = dict(params)
+    while True:
+        data = api_request(url, params)
+        if not data:
+            return
+        yield data
+        
+        paging = data.get("paging", {})
+        if "next" not in paging:
+            return
+        after = paging.get("cursors", {}).get("after")
+        if after:
+            params["after"] = after
+        else:
+            url, params = _unpack_next_url(paging["next"])
+
+
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningar (keep-alive) mellan anrop.
+# Poolen rymmer en anslutning per parallell sidtråd (BATCH_SIZE).
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(BATCH_SIZE, 10)))
+
 # API-anropsräknare
 api_call_count = 0
-start_time = time.time()
+start_time = time.monotonic()
 rate_limit_backoff = 1.0
 consecutive_successes = 0
+# Sidor bearbetas i parallella trådar – skyddar räknare, backoff och sidcache
+_state_lock = threading.Lock()
+
+# Sidcache: {page_id: {"name": ..., "token": ...}}. En Page Access Token är
+# stabil under systemtokenens livstid, så den hämtas en gång per sida och körning
+# (och sparas i CACHE_FILE) i stället för en gång per sida och månad.
+page_cache = {}
+# Tokens som API:et svarat med fel 190 (ogiltig/roterad token) på under körningen
+invalid_tokens = set()
 
 def check_token_expiry():
     """Kontrollera om token snart går ut och varna användaren"""
@@ -111,13 +168,15 @@ def api_request(url, params, retry_count=0):
     """
     global api_call_count, start_time, rate_limit_backoff, consecutive_successes
 
-    api_call_count += 1
+    with _state_lock:
+        api_call_count += 1
+        call_number = api_call_count
 
     # Dynamisk rate limiting
-    if api_call_count % 50 == 0:
-        elapsed = time.time() - start_time
-        rate = api_call_count / elapsed * 3600
-        logger.info(f"📊 API-hastighet: {rate:.0f} anrop/timme ({api_call_count} anrop på {elapsed/60:.1f} min)")
+    if call_number % 50 == 0:
+        elapsed = time.monotonic() - start_time
+        rate = call_number / elapsed * 3600
+        logger.info(f"📊 API-hastighet: {rate:.0f} anrop/timme ({call_number} anrop på {elapsed/60:.1f} min)")
 
     # Flytta access_token från query-params till Authorization-header
     safe_params = dict(params)
@@ -126,17 +185,19 @@ def api_request(url, params, retry_count=0):
 
     try:
         time.sleep(0.1 * rate_limit_backoff)
-        response = requests.get(url, params=safe_params, headers=headers, timeout=30)
+        response = _session.get(url, params=safe_params, headers=headers, timeout=30)
 
         if response.status_code == 200:
-            consecutive_successes += 1
-            if consecutive_successes > 10 and rate_limit_backoff > 1.0:
-                rate_limit_backoff = max(1.0, rate_limit_backoff * 0.9)
+            with _state_lock:
+                consecutive_successes += 1
+                if consecutive_successes > 10 and rate_limit_backoff > 1.0:
+                    rate_limit_backoff = max(1.0, rate_limit_backoff * 0.9)
             return response.json()
 
         elif response.status_code == 429 or response.status_code == 17:
-            consecutive_successes = 0
-            rate_limit_backoff = min(5.0, rate_limit_backoff * 1.5)
+            with _state_lock:
+                consecutive_successes = 0
+                rate_limit_backoff = min(5.0, rate_limit_backoff * 1.5)
             logger.warning(f"⚠️ Rate limit träffad. Väntar {RETRY_DELAY * rate_limit_backoff:.1f}s...")
             time.sleep(RETRY_DELAY * rate_limit_backoff)
 
@@ -147,6 +208,14 @@ def api_request(url, params, retry_count=0):
                 return None
 
         else:
+            try:
+                error_code = response.json().get("error", {}).get("code")
+            except ValueError:
+                error_code = None
+            if error_code == 190 and token:
+                # Token ogiltig/roterad – se till att den inte återanvänds från cachen
+                invalid_tokens.add(token)
+                invalidate_page_token(token)
             logger.error(f"❌ HTTP {response.status_code}: {response.text}")
             return None
 
@@ -162,56 +231,93 @@ def api_request(url, params, retry_count=0):
         return None
 
 def load_cache():
-    """Ladda sidnamn från cache"""
+    """Ladda sidcache ({page_id: {"name": ..., "token": ...}}).
+
+    Äldre cachefiler med bara sidnamn ({page_id: namn}) läses in som
+    {"name": namn} utan token.
+    """
     if os.path.exists(CACHE_FILE):
         try:
             with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                cache = json.load(f)
+            return {
+                page_id: entry if isinstance(entry, dict) else {"name": entry}
+                for page_id, entry in cache.items()
+            }
         except Exception as e:
             logger.warning(f"⚠️ Kunde inte ladda cache: {e}")
     return {}
 
 def save_cache(cache):
-    """Spara sidnamn till cache"""
+    """Spara sidcache (namn och Page Access Tokens)"""
+    # Skriv till temporärfil och byt atomärt, så att ett avbrott mitt i
+    # skrivningen inte lämnar en trasig cache
+    tmp_file = CACHE_FILE + ".tmp"
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
+        with _state_lock:
+            snapshot = json.dumps(cache, ensure_ascii=False, indent=2)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        # Cachen innehåller Page Access Tokens – endast läsbar för ägaren
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, CACHE_FILE)
     except Exception as e:
         logger.error(f"❌ Kunde inte spara cache: {e}")
 
+def invalidate_page_token(token):
+    """Ta bort en cachad Page Access Token som API:et svarat med fel 190 på"""
+    with _state_lock:
+        stale = [page_id for page_id, entry in page_cache.items() if entry.get("token") == token]
+        for page_id in stale:
+            del page_cache[page_id]["token"]
+    for page_id in stale:
+        logger.info(f"🔑 Cachad Page Access Token för sida {page_id} är ogiltig och hämtas på nytt")
+
 def get_all_pages():
-    """Hämta alla Facebook-sidor som token har åtkomst till"""
+    """Hämta alla Facebook-sidor som token har åtkomst till (alla pagineringssidor).
+
+    Page Access Token följer med i samma svar och läggs i page_cache, så att
+    sidorna inte behöver ett eget token-anrop var.
+    """
     logger.info("📋 Hämtar lista över Facebook-sidor...")
     
     url = f"https://graph.facebook.com/{API_VERSION}/me/accounts"
-    params = {"access_token": ACCESS_TOKEN, "limit": 100}
+    params = {"access_token": ACCESS_TOKEN, "limit": 100, "fields": "id,name,access_token"}
     
-    data = api_request(url, params)
+    page_ids = []
+    for data in _iter_pages(url, params):
+        if "data" not in data:
+            break
+        for page in data["data"]:
+            page_ids.append((page["id"], page["name"]))
+            if page.get("access_token"):
+                page_cache.setdefault(page["id"], {}).update(name=page["name"], token=page["access_token"])
     
-    if not data or "data" not in data:
+    if not page_ids:
         logger.error("❌ Kunde inte hämta sidor. Kontrollera din token och behörigheter.")
         return []
     
-    pages = data["data"]
-    page_ids = [(page["id"], page["name"]) for page in pages]
     logger.info(f"✅ Hittade {len(page_ids)} sidor")
     
     return page_ids
 
+# Placeholder-sidor heter "Srholder" följt av siffror (t.ex. Srholder12)
+_is_placeholder_name = re.compile(r"Srholder\d+").fullmatch
+
 def filter_placeholder_pages(page_list):
     """Filtrera bort placeholder-sidor (Srholder*)"""
     filtered_pages = []
     filtered_out = []
     
-    for page_id, page_name in page_list:
-        if page_name and page_name.startswith('Srholder') and page_name[8:].isdigit():
-            filtered_out.append((page_id, page_name))
+    for page in page_list:
+        page_name = page[1]
+        if page_name and _is_placeholder_name(page_name):
+            filtered_out.append(page)
         else:
-            filtered_pages.append((page_id, page_name))
+            filtered_pages.append(page)
     
     if filtered_out:
-        placeholder_names = [name for _, name in filtered_out]
-        logger.info(f"🚫 Filtrerade bort {len(filtered_out)} placeholder-sidor: {', '.join(placeholder_names)}")
+        logger.info(f"🚫 Filtrerade bort {len(filtered_out)} placeholder-sidor: {', '.join(name for _, name in filtered_out)}")
     
     logger.info(f"✅ {len(filtered_pages)} sidor kvar efter filtrering")
     return filtered_pages
@@ -290,8 +396,13 @@ def print_filter_list(page_list):
             logger.info(f"    • {name}")
     logger.info("\n" + "=" * 80)
 
-def get_page_access_token(page_id):
-    """Konvertera systemanvändartoken till Page Access Token"""
+def get_page_access_token(page_id, page_name=None):
+    """Konvertera systemanvändartoken till Page Access Token (cachas per sida)"""
+    with _state_lock:
+        entry = page_cache.setdefault(page_id, {})
+        if entry.get("token"):
+            return entry["token"]
+
     url = f"https://graph.facebook.com/{API_VERSION}/{page_id}"
     params = {
         "fields": "access_token",
@@ -305,10 +416,18 @@ def get_page_access_token(page_id):
         logger.warning(f"⚠️ Kunde inte hämta Page Access Token för sida {page_id}: {error_msg}")
         return None
     
+    with _state_lock:
+        if page_name:
+            entry["name"] = page_name
+        entry["token"] = data["access_token"]
     return data["access_token"]
 
 def get_posts_for_month(page_id, page_token, year, month):
-    """Hämta alla posts för en sida under en specifik månad"""
+    """Hämta alla posts för en sida under en specifik månad.
+
+    Varje post får med comments.summary (limit 0) så att antalet kommentarer
+    finns direkt i postlistan utan att kommentarerna själva pagineras.
+    """
     days_in_month = monthrange(year, month)[1]
     since_date = datetime(year, month, 1)
     until_date = datetime(year, month, days_in_month, 23, 59, 59)
@@ -322,25 +441,19 @@ def get_posts_for_month(page_id, page_token, year, month):
         "since": since_timestamp,
         "until": until_timestamp,
         "limit": 100,
-        "fields": "id,created_time"
+        "fields": "id,comments.limit(0).summary(true)"
     }
     
     all_posts = []
     
-    while True:
-        data = api_request(url, params)
-        
-        if not data or "data" not in data:
-            break
-        
-        posts = data["data"]
-        all_posts.extend(posts)
-        
-        # Kolla pagination
-        if "paging" in data and "next" in data["paging"]:
-            url, params = _unpack_next_url(data["paging"]["next"])
-        else:
+    for data in _iter_pages(url, params):
+        if "data" not in data:
             break
+        # Behåll bara id och kommentarsantal – svarsdikten släpps direkt
+        all_posts.extend(
+            {"id": post["id"], "comments": post.get("comments", {})}
+            for post in data["data"]
+        )
     
     return all_posts
 
@@ -362,32 +475,61 @@ def count_comments_on_post(post_id, page_token):
     total_comments = 0
     total_replies = 0
 
-    while True:
-        data = api_request(url, params)
-
-        if not data:
-            break
-
+    for data in _iter_pages(url, params):
         comments = data.get("data", [])
         total_comments += len(comments)
 
         for comment in comments:
             total_replies += comment.get("comment_count") or 0
 
-        # Pagination
-        if "paging" in data and "next" in data["paging"]:
-            url, params = _unpack_next_url(data["paging"]["next"])
-        else:
+    return total_comments, total_replies
+
+def count_comments_for_month(page_id, page_token, year, month):
+    """Räkna kommentarer och replies på en sidas inlägg under en månad.
+
+    Returnerar (antal inlägg, kommentarer, replies). Avbryter tidigt om
+    token visar sig vara ogiltig (fel 190) – anroparen kontrollerar det.
+    """
+    posts = get_posts_for_month(page_id, page_token, year, month)
+    
+    if not posts:
+        return 0, 0, 0
+    
+    logger.info(f"    📊 Hittade {len(posts)} inlägg, räknar kommentarer...")
+    
+    total_comments = 0
+    total_replies = 0
+    skipped_posts = 0
+    
+    # Räkna kommentarer och replies för varje post
+    for i, post in enumerate(posts, 1):
+        if page_token in invalid_tokens:
             break
+        # Inlägg där summary redan visar 0 kommentarer kan inte ha replies heller,
+        # så de behöver inget eget /comments-anrop. Saknas summary räknas som förut.
+        if post.get("comments", {}).get("summary", {}).get("total_count") == 0:
+            skipped_posts += 1
+            continue
 
-    return total_comments, total_replies
+        post_id = post["id"]
+        comments, replies = count_comments_on_post(post_id, page_token)
+        total_comments += comments
+        total_replies += replies
+        
+        if i % 10 == 0:
+            logger.info(f"    ⏳ Bearbetat {i}/{len(posts)} inlägg...")
+    
+    if skipped_posts:
+        logger.debug(f"    {skipped_posts} inlägg utan kommentarer hoppades över")
+    
+    return len(posts), total_comments, total_replies
 
 def process_page_for_month(page_id, page_name, year, month):
     """Bearbeta en sida för en specifik månad och räkna kommentarer"""
     logger.info(f"  📄 Bearbetar: {page_name}")
     
     # Hämta Page Access Token
-    page_token = get_page_access_token(page_id)
+    page_token = get_page_access_token(page_id, page_name)
     if not page_token:
         logger.warning(f"    ⚠️ Kunde inte hämta Page Access Token, hoppar över denna sida")
         return {
@@ -398,10 +540,25 @@ def process_page_for_month(page_id, page_name, year, month):
             "total": 0
         }
     
-    # Hämta alla posts för månaden
-    posts = get_posts_for_month(page_id, page_token, year, month)
+    post_count, total_comments, total_replies = count_comments_for_month(page_id, page_token, year, month)
+    
+    if page_token in invalid_tokens:
+        # Cachad token ogiltig (fel 190) – hämta en ny och försök en gång till
+        page_token = get_page_access_token(page_id, page_name)
+        if page_token:
+            post_count, total_comments, total_replies = count_comments_for_month(page_id, page_token, year, month)
+        if not page_token or page_token in invalid_tokens:
+            # Tomma värden (inte 0) – sidan kunde inte räknas och ska inte se ut som en tyst månad
+            logger.error(f"    ❌ Ogiltig Page Access Token för {page_name} även efter förnyelse – sidan markeras som fel")
+            return {
+                "page_id": page_id,
+                "page_name": page_name,
+                "comments": "",
+                "replies": "",
+                "total": ""
+            }
     
-    if not posts:
+    if not post_count:
         logger.info(f"    ℹ️ Inga inlägg hittades för {year}-{month:02d}")
         return {
             "page_id": page_id,
@@ -411,21 +568,6 @@ def process_page_for_month(page_id, page_name, year, month):
             "total": 0
         }
     
-    logger.info(f"    📊 Hittade {len(posts)} inlägg, räknar kommentarer...")
-    
-    total_comments = 0
-    total_replies = 0
-    
-    # Räkna kommentarer och replies för varje post
-    for i, post in enumerate(posts, 1):
-        post_id = post["id"]
-        comments, replies = count_comments_on_post(post_id, page_token)
-        total_comments += comments
-        total_replies += replies
-        
-        if i % 10 == 0:
-            logger.info(f"    ⏳ Bearbetat {i}/{len(posts)} inlägg...")
-    
     total = total_comments + total_replies
     
     logger.info(f"    ✅ Kommentarer: {total_comments}, Replies: {total_replies}, Total: {total}")
@@ -438,33 +580,48 @@ def process_page_for_month(page_id, page_name, year, month):
         "total": total
     }
 
+# Plockar ut en rads värden i CSV-kolumnordning
+_row_values = itemgetter('page_id', 'page_name', 'comments', 'replies', 'total')
+
 def save_to_csv(data, year, month):
-    """Spara data till CSV-fil"""
+    """Spara data till CSV-fil.
+
+    data kan vara vilken iterator som helst (t.ex. executor.map) – raderna skrivs
+    allteftersom de blir klara. Filen skrivs som .tmp och byts in först när alla
+    sidor är klara, så att en avbruten månad inte ser färdig ut vid nästa körning.
+    """
     filename = f"FB_Comments_{year}_{month:02d}.csv"
+    tmp_file = filename + ".tmp"
     
     logger.info(f"💾 Sparar resultat till {filename}...")
     
+    rows_written = 0
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['Page ID', 'Page Name', 'Comments', 'Replies', 'Total']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        with open(tmp_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
             
-            writer.writeheader()
+            writer.writerow(['Page ID', 'Page Name', 'Comments', 'Replies', 'Total'])
             for row in data:
-                writer.writerow({
-                    'Page ID': row['page_id'],
-                    'Page Name': row['page_name'],
-                    'Comments': row['comments'],
-                    'Replies': row['replies'],
-                    'Total': row['total']
-                })
-        
-        logger.info(f"✅ Sparade {len(data)} sidor till {filename}")
-        return True
+                writer.writerow(_row_values(row))
+                rows_written += 1
+        os.replace(tmp_file, filename)
         
-    except Exception as e:
+    except OSError as e:
         logger.error(f"❌ Kunde inte spara CSV: {e}")
         return False
+    
+    except Exception as e:
+        # Undantag från en sidtråd (executor.map) – det är hämtningen som misslyckats, inte sparningen
+        logger.error(f"❌ Hämtningen för {year}-{month:02d} avbröts efter {rows_written} sidor: {e}")
+        return False
+    
+    finally:
+        # Lämna ingen halvfärdig .tmp-fil efter en månad som inte blev klar
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    
+    logger.info(f"✅ Sparade {rows_written} sidor till {filename}")
+    return True
 
 def get_months_to_process(start_year_month, specific_month=None):
     """Bestäm vilka månader som ska bearbetas"""
@@ -496,13 +653,18 @@ def get_months_to_process(start_year_month, specific_month=None):
         end_year = current_year
         end_month = current_month - 1
     
+    # Befintliga rapporter hämtas med ett os.scandir-pass i stället för en
+    # os.path.exists per månad
+    with os.scandir(".") as entries:
+        existing_files = {entry.name for entry in entries if entry.name.startswith("FB_Comments_")}
+    
     months = []
     year, month = start_year, start_month
     
     while (year < end_year) or (year == end_year and month <= end_month):
         # Kontrollera om filen redan finns
         filename = f"FB_Comments_{year}_{month:02d}.csv"
-        if not os.path.exists(filename):
+        if filename not in existing_files:
             months.append((year, month))
         else:
             logger.info(f"⏭️ Hoppar över {year}-{month:02d} (filen finns redan)")
@@ -539,6 +701,10 @@ def main():
         logger.error("❌ Token-problem. Avbryter.")
         return 1
     
+    # Återanvänd Page Access Tokens från tidigare körningar (laddas före sidlistan
+    # så att färska tokens från me/accounts vinner över cachade)
+    page_cache.update(load_cache())
+    
     # Hämta sidor
     all_pages = get_all_pages()
     if not all_pages:
@@ -622,16 +788,23 @@ def main():
         logger.info(f"📆 Bearbetar månad: {year}-{month:02d}")
         logger.info(f"{'='*80}")
         
-        month_data = []
-        
-        for page_id, page_name in pages:
-            result = process_page_for_month(page_id, page_name, year, month)
-            month_data.append(result)
+        # Sidorna är oberoende av varandra och bearbetas parallellt (BATCH_SIZE trådar);
+        # executor.map behåller sidordningen i resultatet
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, len(pages)))) as executor:
+            month_data = executor.map(
+                lambda page: process_page_for_month(page[0], page[1], year, month),
+                pages
+            )
+            
+            # Spara resultat (strömmas till filen i sidordning)
+            saved = save_to_csv(month_data, year, month)
         
-        # Spara resultat
-        save_to_csv(month_data, year, month)
+        save_cache(page_cache)
         
-        logger.info(f"\n✅ Månad {year}-{month:02d} slutförd!")
+        if saved:
+            logger.info(f"\n✅ Månad {year}-{month:02d} slutförd!")
+        else:
+            logger.warning(f"\n⚠️ Månad {year}-{month:02d} sparades inte och körs om vid nästa körning")
     
     logger.info(f"\n{'='*80}")
     logger.info("🎉 KLART! Alla månader bearbetade.")
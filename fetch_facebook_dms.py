@@ -6,15 +6,23 @@
 #
 # KRÄVER: Token med 'pages_messaging' behörighet
 
+import atexit
 import csv
 import json
 import os
+import re
+import shutil
 import time
 import requests
 import logging
 import argparse
 import sys
+import threading
 import urllib.parse
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from calendar import monthrange
 from config import (
@@ -24,6 +32,18 @@ from config import (
     TOKEN_VALID_DAYS
 )
 
+def _link_latest_log(log_filename, latest_name):
+    """Låt latest_name peka på den datumstämplade loggen (symlänk) i stället för
+    att skriva varje loggrad till två filer. Där symlänkar inte stöds kopieras
+    loggen dit när skriptet avslutas."""
+    try:
+        if os.path.lexists(latest_name):
+            os.remove(latest_name)
+        os.symlink(log_filename, latest_name)
+    except (OSError, NotImplementedError):
+        atexit.register(shutil.copyfile, log_filename, latest_name)
+
+
 # Konfigurera loggning
 def setup_logging():
     """Konfigurera loggning med datumstämplad loggfil"""
@@ -40,10 +60,11 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(log_filename),
-            logging.FileHandler("facebook_dms.log"),
             logging.StreamHandler()
         ]
     )
+    # facebook_dms.log pekar alltid på senaste körningens logg
+    _link_latest_log(log_filename, "facebook_dms.log")
     
     logger = logging.getLogger(__name__)
     logger.info(f"Startar loggning till fil: {log_filename}")
@@ -79,36 +100,98 @@ def _unpack_next_url(next_url):
     return clean_url, params
 
 
+def _iter_pages(url, params):
+    """Iterera över sidorna i ett paginerat Graph API-svar.
+
+    Följer paging.cursors.after med samma url och params så länge det finns,
+    och faller tillbaka på paging.next (t.ex. tidsbaserad paginering med
+    since/until, som saknar cursors).
+    """
+    params = dict(params)
+    while True:
+        data = api_request(url, params)
+        if not data:
+            return
+        yield data
+        
+        paging = data.get("paging", {})
+        if "next" not in paging:
+            return
+        after = paging.get("cursors", {}).get("after")
+        if after:
+            params["after"] = after
+        else:
+            url, params = _unpack_next_url(paging["next"])
+
+
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningar (keep-alive) mellan anrop.
+# Poolen rymmer en anslutning per parallell sidtråd (BATCH_SIZE).
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(BATCH_SIZE, 10)))
+
 # API-anropsräknare
 api_call_count = 0
-start_time = time.time()
+start_time = time.monotonic()
 rate_limit_backoff = 1.0
 consecutive_successes = 0
+# Sidor bearbetas i parallella trådar – skyddar räknare, backoff och sidcache
+_state_lock = threading.Lock()
+
+# Sidcache: {page_id: {"name": ..., "token": ...}}. En Page Access Token är
+# stabil under systemtokenens livstid, så den hämtas en gång per sida och körning
+# (och sparas i CACHE_FILE) i stället för en gång per sida och månad.
+page_cache = {}
+# Tokens som API:et svarat med fel 190 (ogiltig/roterad token) på under körningen
+invalid_tokens = set()
 
 # Hjälpfunktioner för katalogstruktur
+@lru_cache(maxsize=32)
 def get_year_directory(year):
     """Returnera katalognamn för ett givet år"""
     return f"dms{year}"
 
+# Kataloger som redan kontrollerats/skapats under körningen
+_ensured_dirs = set()
+
 def ensure_directory_exists(directory):
-    """Skapa katalog om den inte finns"""
+    """Skapa katalog om den inte finns (kontrolleras bara en gång per körning)"""
+    if directory in _ensured_dirs:
+        return
     if not os.path.exists(directory):
         os.makedirs(directory)
         logger.debug(f"Skapade katalog: {directory}")
+    _ensured_dirs.add(directory)
+
+# FB_DMs_YYYY_MM.csv, eventuellt med sidnamnssuffix (FB_DMs_YYYY_MM_Sidnamn.csv)
+_FNAME_RE = re.compile(r"^FB_DMs_(\d{4})(?:_\d{2})?(?:_.*)?\.csv$")
 
 def extract_year_from_filename(filename):
     """Extrahera år från filnamn (FB_DMs_YYYY_MM.csv)"""
-    try:
-        basename = os.path.basename(filename)
-        parts = basename.replace(".csv", "").split("_")
-        if len(parts) >= 3 and parts[0] == "FB" and parts[1] == "DMs":
-            year_candidate = parts[2]
-            if year_candidate.isdigit() and len(year_candidate) == 4:
-                return int(year_candidate)
-        return None
-    except Exception as e:
-        logger.warning(f"Kunde inte extrahera år från filnamn {filename}: {e}")
-        return None
+    m = _FNAME_RE.match(os.path.basename(filename))
+    return int(m.group(1)) if m else None
+
+# Månadsrapporter som get_months_to_process letar efter: FB_DMs_YYYY_MM.csv
+_REPORT_RE = re.compile(r"^FB_DMs_(\d{4})_(\d{2})\.csv$")
+
+def get_existing_reports():
+    """Hitta befintliga månadsrapporter i dms{YYYY}-katalogerna.
+
+    Returnerar en mängd (år, månad). Ett os.scandir-pass per katalog –
+    DirEntry känner redan till filtypen, så inga extra stat()-anrop behövs.
+    """
+    existing_reports = set()
+    with os.scandir(".") as entries:
+        for entry in entries:
+            year_part = entry.name[3:]
+            if not (entry.name.startswith("dms") and len(year_part) == 4
+                    and year_part.isdigit() and entry.is_dir()):
+                continue
+            with os.scandir(entry.path) as files:
+                for file_entry in files:
+                    m = _REPORT_RE.match(file_entry.name)
+                    if m and m.group(1) == year_part:
+                        existing_reports.add((int(m.group(1)), int(m.group(2))))
+    return existing_reports
 
 def check_token_expiry():
     """Kontrollera om token snart går ut och varna användaren"""
@@ -138,13 +221,15 @@ def api_request(url, params, retry_count=0):
     """
     global api_call_count, start_time, rate_limit_backoff, consecutive_successes
 
-    api_call_count += 1
+    with _state_lock:
+        api_call_count += 1
+        call_number = api_call_count
 
     # Dynamisk rate limiting
-    if api_call_count % 50 == 0:
-        elapsed = time.time() - start_time
-        rate = api_call_count / elapsed * 3600
-        logger.info(f"📊 API-hastighet: {rate:.0f} anrop/timme ({api_call_count} anrop på {elapsed/60:.1f} min)")
+    if call_number % 50 == 0:
+        elapsed = time.monotonic() - start_time
+        rate = call_number / elapsed * 3600
+        logger.info(f"📊 API-hastighet: {rate:.0f} anrop/timme ({call_number} anrop på {elapsed/60:.1f} min)")
 
     # Flytta access_token från query-params till Authorization-header
     safe_params = dict(params)
@@ -153,17 +238,19 @@ def api_request(url, params, retry_count=0):
 
     try:
         time.sleep(0.1 * rate_limit_backoff)
-        response = requests.get(url, params=safe_params, headers=headers, timeout=30)
+        response = _session.get(url, params=safe_params, headers=headers, timeout=30)
 
         if response.status_code == 200:
-            consecutive_successes += 1
-            if consecutive_successes > 10 and rate_limit_backoff > 1.0:
-                rate_limit_backoff = max(1.0, rate_limit_backoff * 0.9)
+            with _state_lock:
+                consecutive_successes += 1
+                if consecutive_successes > 10 and rate_limit_backoff > 1.0:
+                    rate_limit_backoff = max(1.0, rate_limit_backoff * 0.9)
             return response.json()
 
         elif response.status_code == 429 or response.status_code == 17:
-            consecutive_successes = 0
-            rate_limit_backoff = min(5.0, rate_limit_backoff * 1.5)
+            with _state_lock:
+                consecutive_successes = 0
+                rate_limit_backoff = min(5.0, rate_limit_backoff * 1.5)
             logger.warning(f"⚠️ Rate limit träffad. Väntar {RETRY_DELAY * rate_limit_backoff:.1f}s...")
             time.sleep(RETRY_DELAY * rate_limit_backoff)
 
@@ -174,6 +261,14 @@ def api_request(url, params, retry_count=0):
                 return None
 
         else:
+            try:
+                error_code = response.json().get("error", {}).get("code")
+            except ValueError:
+                error_code = None
+            if error_code == 190 and token:
+                # Token ogiltig/roterad – se till att den inte återanvänds från cachen
+                invalid_tokens.add(token)
+                invalidate_page_token(token)
             logger.error(f"❌ HTTP {response.status_code}: {response.text}")
             return None
 
@@ -189,62 +284,104 @@ def api_request(url, params, retry_count=0):
         return None
 
 def load_cache():
-    """Ladda sidnamn från cache"""
+    """Ladda sidcache ({page_id: {"name": ..., "token": ...}}).
+
+    Äldre cachefiler med bara sidnamn ({page_id: namn}) läses in som
+    {"name": namn} utan token.
+    """
     if os.path.exists(CACHE_FILE):
         try:
             with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                cache = json.load(f)
+            return {
+                page_id: entry if isinstance(entry, dict) else {"name": entry}
+                for page_id, entry in cache.items()
+            }
         except Exception as e:
             logger.warning(f"⚠️ Kunde inte ladda cache: {e}")
     return {}
 
 def save_cache(cache):
-    """Spara sidnamn till cache"""
+    """Spara sidcache (namn och Page Access Tokens)"""
+    # Skriv till temporärfil och byt atomärt, så att ett avbrott mitt i
+    # skrivningen inte lämnar en trasig cache
+    tmp_file = CACHE_FILE + ".tmp"
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
+        with _state_lock:
+            snapshot = json.dumps(cache, ensure_ascii=False, indent=2)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        # Cachen innehåller Page Access Tokens – endast läsbar för ägaren
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, CACHE_FILE)
     except Exception as e:
         logger.error(f"❌ Kunde inte spara cache: {e}")
 
+def invalidate_page_token(token):
+    """Ta bort en cachad Page Access Token som API:et svarat med fel 190 på"""
+    with _state_lock:
+        stale = [page_id for page_id, entry in page_cache.items() if entry.get("token") == token]
+        for page_id in stale:
+            del page_cache[page_id]["token"]
+    for page_id in stale:
+        logger.info(f"🔑 Cachad Page Access Token för sida {page_id} är ogiltig och hämtas på nytt")
+
 def get_all_pages():
-    """Hämta alla Facebook-sidor som token har åtkomst till"""
+    """Hämta alla Facebook-sidor som token har åtkomst till (alla pagineringssidor).
+
+    Page Access Token följer med i samma svar och läggs i page_cache, så att
+    sidorna inte behöver ett eget token-anrop var.
+    """
     logger.info("📋 Hämtar lista över Facebook-sidor...")
     
     url = f"https://graph.facebook.com/{API_VERSION}/me/accounts"
-    params = {"access_token": ACCESS_TOKEN, "limit": 100}
+    params = {"access_token": ACCESS_TOKEN, "limit": 100, "fields": "id,name,access_token"}
     
-    data = api_request(url, params)
+    page_ids = []
+    for data in _iter_pages(url, params):
+        if "data" not in data:
+            break
+        for page in data["data"]:
+            page_ids.append((page["id"], page["name"]))
+            if page.get("access_token"):
+                page_cache.setdefault(page["id"], {}).update(name=page["name"], token=page["access_token"])
     
-    if not data or "data" not in data:
+    if not page_ids:
         logger.error("❌ Kunde inte hämta sidor. Kontrollera din token och behörigheter.")
         return []
     
-    pages = data["data"]
-    page_ids = [(page["id"], page["name"]) for page in pages]
     logger.info(f"✅ Hittade {len(page_ids)} sidor")
     
     return page_ids
 
+# Placeholder-sidor heter "Srholder" följt av siffror (t.ex. Srholder12)
+_is_placeholder_name = re.compile(r"Srholder\d+").fullmatch
+
 def filter_placeholder_pages(page_list):
     """Filtrera bort placeholder-sidor (Srholder*)"""
     filtered_pages = []
     filtered_out = []
     
-    for page_id, page_name in page_list:
-        if page_name and page_name.startswith('Srholder') and page_name[8:].isdigit():
-            filtered_out.append((page_id, page_name))
+    for page in page_list:
+        page_name = page[1]
+        if page_name and _is_placeholder_name(page_name):
+            filtered_out.append(page)
         else:
-            filtered_pages.append((page_id, page_name))
+            filtered_pages.append(page)
     
     if filtered_out:
-        placeholder_names = [name for _, name in filtered_out]
-        logger.info(f"🚫 Filtrerade bort {len(filtered_out)} placeholder-sidor: {', '.join(placeholder_names)}")
+        logger.info(f"🚫 Filtrerade bort {len(filtered_out)} placeholder-sidor: {', '.join(name for _, name in filtered_out)}")
     
     logger.info(f"✅ {len(filtered_pages)} sidor kvar efter filtrering")
     return filtered_pages
 
-def get_page_access_token(page_id):
-    """Konvertera systemanvändartoken till Page Access Token"""
+def get_page_access_token(page_id, page_name=None):
+    """Konvertera systemanvändartoken till Page Access Token (cachas per sida)"""
+    with _state_lock:
+        entry = page_cache.setdefault(page_id, {})
+        if entry.get("token"):
+            return entry["token"]
+
     url = f"https://graph.facebook.com/{API_VERSION}/{page_id}"
     params = {
         "fields": "access_token",
@@ -258,6 +395,10 @@ def get_page_access_token(page_id):
         logger.warning(f"⚠️ Kunde inte hämta Page Access Token för sida {page_id}: {error_msg}")
         return None
     
+    with _state_lock:
+        if page_name:
+            entry["name"] = page_name
+        entry["token"] = data["access_token"]
     return data["access_token"]
 
 def count_conversations_for_month(page_id, page_token, year, month):
@@ -287,21 +428,12 @@ def count_conversations_for_month(page_id, page_token, year, month):
     
     total_conversations = 0
     total_messages = 0
-    conversations_in_period = []
     max_iterations = 100  # Säkerhetsgräns för att undvika oändlig loop
     iteration = 0
+    data = {}
     
-    while True:
+    for data in islice(_iter_pages(url, params), max_iterations):
         iteration += 1
-        if iteration > max_iterations:
-            logger.warning(f"    ⚠️ BEGRÄNSNING TRÄFFAD: Stoppade efter {max_iterations} iterationer (~{total_conversations} konversationer)")
-            logger.warning(f"    ⚠️ Sidan kan ha FLER konversationer som INTE räknades!")
-            break
-        
-        data = api_request(url, params)
-        
-        if not data:
-            break
         
         if "data" in data:
             conversations = data["data"]
@@ -319,7 +451,6 @@ def count_conversations_for_month(page_id, page_token, year, month):
                     
                     # Kolla om konversationen uppdaterades under månaden
                     if since_timestamp <= updated_timestamp <= until_timestamp:
-                        conversations_in_period.append(conv)
                         total_conversations += 1
                         
                         # Lägg till message_count om tillgängligt
@@ -329,12 +460,10 @@ def count_conversations_for_month(page_id, page_token, year, month):
                 except Exception as e:
                     logger.debug(f"Kunde inte parse timestamp: {updated_time_str} - {e}")
                     continue
-        
-        # Pagination
-        if "paging" in data and "next" in data["paging"]:
-            url, params = _unpack_next_url(data["paging"]["next"])
-        else:
-            break
+    
+    if iteration == max_iterations and "next" in data.get("paging", {}):
+        logger.warning(f"    ⚠️ BEGRÄNSNING TRÄFFAD: Stoppade efter {max_iterations} iterationer (~{total_conversations} konversationer)")
+        logger.warning(f"    ⚠️ Sidan kan ha FLER konversationer som INTE räknades!")
     
     # Varna om vi nådde max konversationer
     if total_conversations >= 400:
@@ -348,7 +477,7 @@ def process_page_for_month(page_id, page_name, year, month):
     logger.info(f"  📄 Bearbetar: {page_name}")
     
     # Hämta Page Access Token
-    page_token = get_page_access_token(page_id)
+    page_token = get_page_access_token(page_id, page_name)
     if not page_token:
         logger.warning(f"    ⚠️ Kunde inte hämta Page Access Token, hoppar över denna sida")
         return {
@@ -361,6 +490,21 @@ def process_page_for_month(page_id, page_name, year, month):
     # Räkna konversationer och meddelanden
     conversations, messages = count_conversations_for_month(page_id, page_token, year, month)
     
+    if page_token in invalid_tokens:
+        # Cachad token ogiltig (fel 190) – hämta en ny och försök en gång till
+        page_token = get_page_access_token(page_id, page_name)
+        if page_token:
+            conversations, messages = count_conversations_for_month(page_id, page_token, year, month)
+        if not page_token or page_token in invalid_tokens:
+            # Tomma värden (inte 0) – sidan kunde inte räknas och ska inte se ut som en tyst månad
+            logger.error(f"    ❌ Ogiltig Page Access Token för {page_name} även efter förnyelse – sidan markeras som fel")
+            return {
+                "page_id": page_id,
+                "page_name": page_name,
+                "conversations": "",
+                "messages": ""
+            }
+    
     logger.info(f"    ✅ Konversationer: {conversations}, Meddelanden: {messages}")
     
     return {
@@ -370,10 +514,19 @@ def process_page_for_month(page_id, page_name, year, month):
         "messages": messages
     }
 
+# Plockar ut en rads värden i CSV-kolumnordning
+_row_values = itemgetter('page_id', 'page_name', 'conversations', 'messages')
+
 def save_to_csv(data, year, month, page_name=None):
-    """Spara data till CSV-fil i årsspecifik katalog"""
+    """Spara data till CSV-fil i årsspecifik katalog.
+
+    data kan vara vilken iterator som helst (t.ex. executor.map) – raderna skrivs
+    allteftersom de blir klara. Filen skrivs som .tmp och byts in först när alla
+    sidor är klara, så att en avbruten månad inte ser färdig ut vid nästa körning.
+    page_name anges bara när exakt en sida bearbetas.
+    """
     # Skapa filnamn med sidnamn om det finns endast en sida
-    if page_name and len(data) == 1:
+    if page_name:
         # Rensa sidnamn från specialtecken för filnamn
         safe_name = "".join(c for c in page_name if c.isalnum() or c in (' ', '-', '_')).strip()
         safe_name = safe_name.replace(' ', '_')
@@ -390,26 +543,34 @@ def save_to_csv(data, year, month, page_name=None):
     
     logger.info(f"💾 Sparar resultat till {full_path}...")
     
+    tmp_path = full_path + ".tmp"
+    rows_written = 0
     try:
-        with open(full_path, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['Page ID', 'Page Name', 'Conversations', 'Messages']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
             
-            writer.writeheader()
+            writer.writerow(['Page ID', 'Page Name', 'Conversations', 'Messages'])
             for row in data:
-                writer.writerow({
-                    'Page ID': row['page_id'],
-                    'Page Name': row['page_name'],
-                    'Conversations': row['conversations'],
-                    'Messages': row['messages']
-                })
-        
-        logger.info(f"✅ Sparade {len(data)} sidor till {full_path}")
-        return True
+                writer.writerow(_row_values(row))
+                rows_written += 1
+        os.replace(tmp_path, full_path)
         
-    except Exception as e:
+    except OSError as e:
         logger.error(f"❌ Kunde inte spara CSV: {e}")
         return False
+    
+    except Exception as e:
+        # Undantag från en sidtråd (executor.map) – det är hämtningen som misslyckats, inte sparningen
+        logger.error(f"❌ Hämtningen för {year}-{month:02d} avbröts efter {rows_written} sidor: {e}")
+        return False
+    
+    finally:
+        # Lämna ingen halvfärdig .tmp-fil efter en månad som inte blev klar
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    logger.info(f"✅ Sparade {rows_written} sidor till {full_path}")
+    return True
 
 def get_months_to_process(start_year_month, specific_month=None):
     """Bestäm vilka månader som ska bearbetas"""
@@ -443,12 +604,11 @@ def get_months_to_process(start_year_month, specific_month=None):
     
     months = []
     year, month = start_year, start_month
+    existing_reports = get_existing_reports()
     
     while (year < end_year) or (year == end_year and month <= end_month):
         # Kontrollera om filen redan finns i årsspecifik katalog
-        year_dir = get_year_directory(year)
-        filename = os.path.join(year_dir, f"FB_DMs_{year}_{month:02d}.csv")
-        if not os.path.exists(filename):
+        if (year, month) not in existing_reports:
             months.append((year, month))
         else:
             logger.info(f"⏭️ Hoppar över {year}-{month:02d} (filen finns redan)")
@@ -498,6 +658,10 @@ def main():
         logger.error("❌ Token-problem. Avbryter.")
         return 1
     
+    # Återanvänd Page Access Tokens från tidigare körningar (laddas före sidlistan
+    # så att färska tokens från me/accounts vinner över cachade)
+    page_cache.update(load_cache())
+    
     # Hämta sidor
     all_pages = get_all_pages()
     if not all_pages:
@@ -567,16 +731,23 @@ def main():
         logger.info(f"📆 Bearbetar månad: {year}-{month:02d}")
         logger.info(f"{'='*80}")
         
-        month_data = []
-        
-        for page_id, page_name in pages:
-            result = process_page_for_month(page_id, page_name, year, month)
-            month_data.append(result)
+        # Sidorna är oberoende av varandra och bearbetas parallellt (BATCH_SIZE trådar);
+        # executor.map behåller sidordningen i resultatet
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, len(pages)))) as executor:
+            month_data = executor.map(
+                lambda page: process_page_for_month(page[0], page[1], year, month),
+                pages
+            )
+            
+            # Spara resultat (strömmas till filen i sidordning)
+            saved = save_to_csv(month_data, year, month, page_name=pages[0][1] if len(pages) == 1 else None)
         
-        # Spara resultat
-        save_to_csv(month_data, year, month, page_name=pages[0][1] if len(pages) == 1 else None)
+        save_cache(page_cache)
         
-        logger.info(f"\n✅ Månad {year}-{month:02d} slutförd!")
+        if saved:
+            logger.info(f"\n✅ Månad {year}-{month:02d} slutförd!")
+        else:
+            logger.warning(f"\n⚠️ Månad {year}-{month:02d} sparades inte och körs om vid nästa körning")
     
     logger.info(f"\n{'='*80}")
     logger.info("🎉 KLART! Alla månader bearbetade.")
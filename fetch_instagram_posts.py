@@ -17,19 +17,36 @@
 # - Post-nivå data är betydligt mer tillförlitlig än konto-aggregat
 # - Kräver Python ≥3.9 för zoneinfo-stöd
 
+import atexit
 import csv
 import json
 import os
+import queue
 import time
 import requests
 import urllib.parse
 import logging
+import logging.handlers
 import argparse
+import random
+import re
+import shutil
 import sys
-import glob
-import pandas as pd
+import threading
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from calendar import monthrange
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
+
+# orjson (valfritt) tolkar Graph-svar och kontocachen betydligt snabbare än stdlib json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
 
 # KRITISK FIX: Python version check och zoneinfo
 if sys.version_info < (3, 9):
@@ -53,17 +70,59 @@ from config import (
     TOKEN_VALID_DAYS, MAX_REQUESTS_PER_HOUR,
     MONTH_PAUSE_SECONDS
 )
+try:
+    from config import MAX_REQUESTS_PER_SECOND
+except ImportError:  # äldre config.py
+    MAX_REQUESTS_PER_SECOND = 5
 
 # FEATURE TOGGLES - v4.6
 ENABLE_MEDIA_FOLLOWS = True  # Sätt till False om Meta helt avvecklar 'follows' metriken
 
+# Högst så många saknade månader bearbetas samtidigt (en i taget efter rate limits)
+MAX_PARALLEL_MONTHS = 3
+
 # ===================================================================================
 # HÄR BÖRJAR DEL 1 - Grundläggande funktioner och API-hantering (v4.6)
 # ===================================================================================
 
+def _link_latest_log(log_filename, latest_name):
+    """Låt latest_name peka på den datumstämplade loggen (symlänk) i stället för
+    att skriva varje loggrad till två filer. Returnerar False där symlänkar inte
+    stöds – då kopierar setup_logging loggen dit när skriptet avslutas."""
+    try:
+        if os.path.lexists(latest_name):
+            os.remove(latest_name)
+        os.symlink(log_filename, latest_name)
+        return True
+    except (OSError, NotImplementedError):
+        return False
+
+# Loggfilen flushas av en bakgrundstråd med detta intervall (sekunder)
+LOG_FLUSH_INTERVAL = 1.0
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler som inte flushar efter varje post. WARNING och högre flushas
+    direkt (t.ex. rate limit-varningar), övrigt en gång per LOG_FLUSH_INTERVAL.
+    """
+    def emit(self, record):
+        if self.stream is None:
+            return super().emit(record)
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.WARNING:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
 def setup_logging():
     """
     Konfigurera loggning med datumstämplad loggfil och UTF-8 encoding.
+
+    Loggposter läggs på en kö och skrivs av en egen lyssnartråd, så att
+    logganrop i API-trådarna inte väntar på fil- och terminalskrivningar.
     """
     now = datetime.now()
     log_dir = "logs"
@@ -73,15 +132,39 @@ def setup_logging():
     
     log_filename = os.path.join(log_dir, f"instagram_posts_{now.strftime('%Y-%m-%d_%H-%M-%S')}.log")
     
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding="utf-8"),
-            logging.FileHandler("instagram_posts.log", encoding="utf-8"),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler = BufferedFileHandler(log_filename, encoding="utf-8")
+    handlers = [file_handler, logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    # instagram_posts.log pekar alltid på senaste körningens logg
+    latest_linked = _link_latest_log(log_filename, "instagram_posts.log")
+    
+    def flush_log_file():
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            file_handler.flush()
+    
+    threading.Thread(target=flush_log_file, name="log-flush", daemon=True).start()
+    
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    
+    def stop_logging():
+        # Töm kön och filbufferten till disk innan processen avslutas (även vid
+        # Ctrl-C/sys.exit) – först därefter är loggen komplett att kopiera
+        listener.stop()
+        file_handler.flush()
+        if not latest_linked:
+            shutil.copyfile(log_filename, "instagram_posts.log")
+    
+    atexit.register(stop_logging)
+    
+    # Kö-hanteraren formaterar bara meddelandet; tid och nivå läggs på av lyssnarens hanterare
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
     
     logger = logging.getLogger(__name__)
     logger.info(f"Startar Instagram Post Analytics v4.6 - loggning till: {log_filename}")
@@ -120,10 +203,18 @@ def _unpack_next_url(next_url):
 
 # Räknare för API-anrop och rate limit-hantering
 api_call_count = 0
-start_time = time.time()
-last_rate_limit_time = None
+start_time = time.monotonic()
 rate_limit_backoff = 1.0
 consecutive_successes = 0
+# Monotonisk tidpunkt då nästa anrop tidigast får göras. Sätts bara vid rate limit,
+# så att alla trådar (inte bara den som fick felet) pausar; i normalfallet är den
+# redan passerad och graph_get gör bara en jämförelse
+_pause_until = 0.0
+# Sätts vid fel 190 – alla anrop använder samma token, så resten av körningen
+# hoppar över nätverket i stället för att få samma fel igen
+token_revoked = False
+# Saknade månader bearbetas i parallella trådar – skyddar räknare och backoff
+_state_lock = threading.Lock()
 
 # Statistik för 'follows' metrik
 follows_success_count = 0
@@ -146,90 +237,223 @@ def check_token_expiry():
     except Exception as e:
         logger.error(f"Kunde inte tolka TOKEN_LAST_UPDATED: {e}")
 
+ACCOUNT_CACHE_FILE = "instagram_accounts.json"
+
+# Kontocachen läses en gång per körning och skrivs bara om den har ändrats
+_account_cache = None
+_account_cache_dirty = False
+
 def load_account_cache():
-    """Ladda cache med Instagram-kontonamn för att minska API-anrop"""
-    cache_file = "instagram_accounts.json"
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, "r", encoding="utf-8") as f:
-                logger.debug(f"Laddar Instagram-konto-cache från {cache_file}")
-                return json.load(f)
-        except json.JSONDecodeError:
-            logger.warning(f"Kunde inte ladda cache-fil, skapar ny cache")
-    return {}
-
-def save_account_cache(cache):
-    """Spara cache med Instagram-kontonamn för framtida körningar"""
-    cache_file = "instagram_accounts.json"
+    """Ladda cache med Instagram-kontonamn (en gång per körning – senare anrop får samma dict)"""
+    global _account_cache
+    if _account_cache is None:
+        _account_cache = {}
+        if os.path.exists(ACCOUNT_CACHE_FILE):
+            try:
+                with open(ACCOUNT_CACHE_FILE, "rb") as f:
+                    logger.debug("Laddar Instagram-konto-cache från %s", ACCOUNT_CACHE_FILE)
+                    _account_cache = _json_loads(f.read())
+            except json.JSONDecodeError:
+                logger.warning(f"Kunde inte ladda cache-fil, skapar ny cache")
+        # Ändringar sparas även om körningen avbryts eller avslutas i förtid
+        atexit.register(save_account_cache)
+    return _account_cache
+
+def update_account_cache(instagram_id, name):
+    """Lägg in ett kontonamn i cachen; markeras för sparning bara om det ändrats"""
+    global _account_cache_dirty
+    cache = load_account_cache()
+    with _state_lock:
+        if cache.get(instagram_id) != name:
+            cache[instagram_id] = name
+            _account_cache_dirty = True
+
+def save_account_cache():
+    """Spara cache med Instagram-kontonamn för framtida körningar (bara om den ändrats)"""
+    global _account_cache_dirty
+    with _state_lock:
+        if not _account_cache_dirty:
+            return
+        _account_cache_dirty = False
+        cache = dict(_account_cache)
+    # Skriv till temporärfil och byt atomärt, så att ett avbrott mitt i
+    # skrivningen inte lämnar en trasig cache
+    tmp_file = ACCOUNT_CACHE_FILE + ".tmp"
     try:
-        with open(cache_file, "w", encoding="utf-8") as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-            logger.debug(f"Sparade Instagram-konto-cache till {cache_file}")
+        if orjson is not None:
+            data = orjson.dumps(cache, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(cache, ensure_ascii=False, indent=2).encode("utf-8")
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, ACCOUNT_CACHE_FILE)
+        logger.debug("Sparade Instagram-konto-cache till %s", ACCOUNT_CACHE_FILE)
     except Exception as e:
         logger.error(f"Kunde inte spara cache: {e}")
 
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningen (keep-alive) mot graph.facebook.com
+# mellan alla anrop. Poolen rymmer en anslutning per parallell tråd (högst BATCH_SIZE).
+# Inga urllib3-omförsök – 429/5xx hanteras av api_request.
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(BATCH_SIZE, 10), max_retries=0))
+
+# Längsta väntan (sekunder) vid backoff – en orimlig Retry-After kan inte stoppa körningen längre
+MAX_WAIT_SECONDS = 300
+
+def _jitter(seconds):
+    """Slumpa väntetiden (×0.85–1.35, högst MAX_WAIT_SECONDS) så att parallella
+    trådar som träffat samma gräns inte försöker igen exakt samtidigt."""
+    return min(seconds * random.uniform(0.85, 1.35), MAX_WAIT_SECONDS)
+
+def _parse_retry_after(header, default):
+    """
+    Retry-After i sekunder. Headern kan vara ett antal sekunder eller ett
+    HTTP-datum (RFC 7231); default används om den saknas eller inte går att tolka.
+    """
+    if not header:
+        return default
+    try:
+        return max(0, int(header))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(header)
+        return max(0, (retry_at - datetime.now(tz=retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+class TokenBucket:
+    """
+    Högst `rate` anrop/s i snitt, med toppar upp till `capacity` anrop. Trådsäker:
+    acquire() blockerar tills anropet får göras, så parallella trådar sprids ut jämnt
+    i stället för att samtidigt köra in i rate limits och sedan vänta ut dem.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.base_rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self, factor, floor=0.05):
+        """Sänk takten efter en rate limit (dock aldrig under floor anrop/s)."""
+        with self._lock:
+            if self.rate:
+                self.rate = max(self.rate * factor, min(floor, self.rate))
+
+    def speed_up(self, factor):
+        """Öka takten igen efter en lugn period (aldrig över ursprunglig takt)."""
+        with self._lock:
+            if self.rate:
+                self.rate = min(self.rate * factor, self.base_rate)
+
+
+# Alla Graph-anrop (alla trådar) går genom samma hink – se graph_get
+_request_bucket = TokenBucket(MAX_REQUESTS_PER_SECOND, max(BATCH_SIZE, 10))
+
+def pause_requests(seconds):
+    """Pausa alla trådars Graph-anrop i minst `seconds` sekunder (efter rate limit)."""
+    global _pause_until
+    with _state_lock:
+        _pause_until = max(_pause_until, time.monotonic() + seconds)
+
+def graph_get(url, params, timeout=30):
+    """
+    Skriptets enda HTTP-anrop mot Graph API: väntar ut en eventuell paus efter
+    rate limit (pause_requests) och sin tur i _request_bucket, skickar
+    access_token som Authorization-header (aldrig i URL:en) och räknas
+    i api_call_count.
+    Returnerar (response, anropsnummer).
+    """
+    global api_call_count
+    safe_params = dict(params)
+    token = safe_params.pop("access_token", None)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    now = time.monotonic()
+    if now < _pause_until:
+        time.sleep(_pause_until - now)
+    _request_bucket.acquire()
+    with _state_lock:
+        api_call_count += 1
+        call_number = api_call_count
+    return _session.get(url, params=safe_params, headers=headers, timeout=timeout), call_number
+
+def _trip_rate_limit(reason, retry_after=None):
+    """
+    Gemensam hantering av rate limit (HTTP 429 och API-fel #4): öka backoff,
+    sänk takten i _request_bucket, pausa alla trådar och vänta ut pausen.
+    `retry_after` är Retry-After-headern om sådan finns, annars 60 s × backoff.
+    """
+    global rate_limit_backoff, consecutive_successes
+    with _state_lock:
+        rate_limit_backoff = min(rate_limit_backoff * 1.5, 10.0)
+        consecutive_successes = 0
+        backoff = rate_limit_backoff
+    _request_bucket.slow_down(1 / 1.5)
+    wait_time = _jitter(_parse_retry_after(retry_after, 60 * backoff))
+    logger.warning(f"{reason} Väntar {wait_time:.1f}s (backoff: {backoff:.1f}x)")
+    pause_requests(wait_time)
+    time.sleep(wait_time)
+
 def api_request(url, params, retries=MAX_RETRIES):
     """
     Gör API-förfrågan med dynamisk rate limit-hantering för Instagram API v22+.
     
     v4.6: Optimerad för nya API-versioner med förbättrad felhantering
     """
-    global api_call_count, last_rate_limit_time, rate_limit_backoff, consecutive_successes
-    
-    if last_rate_limit_time:
-        time_since_limit = time.time() - last_rate_limit_time
-        if time_since_limit < (60 * rate_limit_backoff):
-            wait_time = (60 * rate_limit_backoff) - time_since_limit
-            logger.info(f"Väntar {wait_time:.1f}s efter tidigare rate limit (backoff: {rate_limit_backoff:.1f}x)")
-            time.sleep(wait_time)
-    
-    # Flytta access_token från query-params till Authorization-header
-    safe_params = dict(params)
-    token = safe_params.pop("access_token", None)
-    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    global rate_limit_backoff, consecutive_successes, token_revoked
+
+    if token_revoked:
+        return None
 
     for attempt in range(retries):
         try:
-            api_call_count += 1
-            response = requests.get(url, params=safe_params, headers=headers, timeout=30)
+            response, call_number = graph_get(url, params)
 
             # Logga rate limit-headers om tillgängliga
             if 'X-App-Usage' in response.headers:
                 usage = response.headers['X-App-Usage']
-                logger.debug(f"API-användning: {usage}")
+                logger.debug("API-användning: %s", usage)
             
             if response.status_code == 429:
-                last_rate_limit_time = time.time()
-                rate_limit_backoff = min(rate_limit_backoff * 1.5, 10.0)
-                consecutive_successes = 0
-                
-                retry_after = int(response.headers.get('Retry-After', 60 * rate_limit_backoff))
-                logger.warning(f"Rate limit nått! Väntar {retry_after}s (backoff: {rate_limit_backoff:.1f}x)")
-                time.sleep(retry_after)
+                _trip_rate_limit("Rate limit nått!", response.headers.get('Retry-After'))
                 continue
                 
             elif response.status_code >= 500:
-                wait_time = min(RETRY_DELAY * (2 ** attempt), 30)
-                logger.warning(f"Serverfel: {response.status_code}. Väntar {wait_time}s... (försök {attempt+1}/{retries})")
+                wait_time = _jitter(min(RETRY_DELAY * (2 ** attempt), 30))
+                logger.warning(f"Serverfel: {response.status_code}. Väntar {wait_time:.1f}s... (försök {attempt+1}/{retries})")
                 time.sleep(wait_time)
                 continue
             
             try:
-                json_data = response.json()
+                json_data = _json_loads(response.content)
                 
                 if response.status_code == 400 and "error" in json_data:
                     error_code = json_data["error"].get("code")
                     error_msg = json_data["error"].get("message", "Okänt fel")
                     
                     if error_code == 4:
-                        last_rate_limit_time = time.time()
-                        rate_limit_backoff = min(rate_limit_backoff * 1.5, 10.0)
-                        wait_time = min(60 * rate_limit_backoff, 300)
-                        logger.warning(f"App rate limit: {error_msg}. Väntar {wait_time}s...")
-                        time.sleep(wait_time)
+                        _trip_rate_limit(f"App rate limit: {error_msg}.")
                         continue
                         
                     elif error_code == 190:
+                        token_revoked = True
                         logger.error(f"Access token ogiltig: {error_msg}")
                         return None
                     
@@ -241,32 +465,34 @@ def api_request(url, params, retries=MAX_RETRIES):
                     logger.error(f"HTTP-fel {response.status_code}: {response.text}")
                     
                     if attempt < retries - 1:
-                        wait_time = RETRY_DELAY * (2 ** attempt)
-                        logger.info(f"Väntar {wait_time} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
+                        wait_time = _jitter(RETRY_DELAY * (2 ** attempt))
+                        logger.info(f"Väntar {wait_time:.1f} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
                         time.sleep(wait_time)
                         continue
                     
                     return json_data
                 
-                consecutive_successes += 1
-                
-                if consecutive_successes >= 50 and rate_limit_backoff > 1.0:
-                    rate_limit_backoff = max(rate_limit_backoff * 0.8, 1.0)
-                    logger.debug(f"50 lyckade anrop, minskar backoff till {rate_limit_backoff:.1f}x")
-                    consecutive_successes = 0
+                with _state_lock:
+                    consecutive_successes += 1
+                    
+                    if consecutive_successes >= 50 and rate_limit_backoff > 1.0:
+                        rate_limit_backoff = max(rate_limit_backoff * 0.8, 1.0)
+                        logger.debug("50 lyckade anrop, minskar backoff till %.1fx", rate_limit_backoff)
+                        consecutive_successes = 0
+                        _request_bucket.speed_up(1.25)
                 
-                if api_call_count % 100 == 0:
-                    elapsed = time.time() - start_time
-                    current_rate = api_call_count / (elapsed / 3600) if elapsed > 0 else 0
-                    logger.info(f"Progress: {api_call_count} API-anrop, {current_rate:.0f}/h, backoff: {rate_limit_backoff:.1f}x")
+                if call_number % 100 == 0:
+                    elapsed = time.monotonic() - start_time
+                    current_rate = call_number / (elapsed / 3600) if elapsed > 0 else 0
+                    logger.info(f"Progress: {call_number} API-anrop, {current_rate:.0f}/h, backoff: {rate_limit_backoff:.1f}x")
                 
                 return json_data
                 
             except json.JSONDecodeError:
                 logger.error(f"Kunde inte tolka JSON-svar: {response.text[:100]}")
                 if attempt < retries - 1:
-                    wait_time = RETRY_DELAY * (2 ** attempt)
-                    logger.info(f"Väntar {wait_time} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
+                    wait_time = _jitter(RETRY_DELAY * (2 ** attempt))
+                    logger.info(f"Väntar {wait_time:.1f} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
                     time.sleep(wait_time)
                     continue
                 return None
@@ -274,8 +500,8 @@ def api_request(url, params, retries=MAX_RETRIES):
         except requests.RequestException as e:
             logger.error(f"Nätverksfel: {e}")
             if attempt < retries - 1:
-                wait_time = RETRY_DELAY * (2 ** attempt)
-                logger.info(f"Väntar {wait_time} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
+                wait_time = _jitter(RETRY_DELAY * (2 ** attempt))
+                logger.info(f"Väntar {wait_time:.1f} sekunder innan nytt försök... (försök {attempt+1}/{retries})")
                 time.sleep(wait_time)
             else:
                 return None
@@ -313,33 +539,41 @@ def get_instagram_accounts_with_access(token):
         "fields": "id,name,instagram_business_account"
     }
     
-    instagram_accounts = []
-    next_url = url
+    linked_accounts = []  # (instagram_id, Facebook-sidans namn)
     
-    while next_url:
-        data = api_request(url if next_url == url else next_url, {} if next_url != url else params)
+    while url:
+        data = api_request(url, params)
         
         if not data or "data" not in data:
             break
             
         pages = data["data"]
-        logger.debug(f"Hittade {len(pages)} Facebook-sidor i denna batch")
+        logger.debug("Hittade %s Facebook-sidor i denna batch", len(pages))
         
         for page in pages:
             instagram_data = page.get("instagram_business_account")
             if instagram_data:
                 instagram_id = instagram_data.get("id")
                 if instagram_id:
-                    ig_name = get_instagram_account_name(instagram_id, token)
-                    if ig_name:
-                        instagram_accounts.append((instagram_id, ig_name, page.get("name", "Okänd Facebook-sida")))
-                        logger.debug(f"Hittade Instagram-konto: {ig_name} (ID: {instagram_id})")
+                    linked_accounts.append((instagram_id, page.get("name", "Okänd Facebook-sida")))
         
+        # next-länken innehåller övriga query-parametrar. Token skickas som header och
+        # finns därför oftast inte i länken – lägg tillbaka den i params.
         next_url = data.get("paging", {}).get("next")
-        if next_url and next_url != url:
-            logger.debug(f"Hämtar nästa sida av Facebook-sidor...")
-        else:
+        if not next_url:
             break
+        logger.debug("Hämtar nästa sida av Facebook-sidor...")
+        url, params = _unpack_next_url(next_url)
+        params.setdefault("access_token", token)
+    
+    # Namnuppslagen är oberoende nätverksanrop – gör dem parallellt (i sidordning)
+    instagram_accounts = []
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, len(linked_accounts)))) as executor:
+        names = executor.map(lambda account: get_instagram_account_name(account[0], token), linked_accounts)
+        for (instagram_id, page_name), ig_name in zip(linked_accounts, names):
+            if ig_name:
+                instagram_accounts.append((instagram_id, ig_name, page_name))
+                logger.debug("Hittade Instagram-konto: %s (ID: %s)", ig_name, instagram_id)
     
     if not instagram_accounts:
         logger.warning("Inga Instagram Business/Creator-konton hittades.")
@@ -351,9 +585,12 @@ def get_instagram_accounts_with_access(token):
     logger.info(f"Hittade {len(instagram_accounts)} Instagram-konton att analysera")
     return instagram_accounts
 
-def get_instagram_account_name(instagram_id, token):
+@lru_cache(maxsize=4096)
+def _lookup_instagram_account_name(instagram_id, token):
     """
-    Hämta Instagram-kontonamn från ID.
+    Hämta Instagram-kontonamn via API:t, högst en gång per konto och körning.
+
+    Misslyckade anrop kastar LookupError så att de inte cachas och kan göras om.
     """
     url = f"https://graph.facebook.com/{API_VERSION}/{instagram_id}"
     params = {"fields": "name,username", "access_token": token}
@@ -362,10 +599,29 @@ def get_instagram_account_name(instagram_id, token):
     
     if not data or "error" in data:
         error_msg = data.get("error", {}).get("message", "Okänt fel") if data else "Fel vid API-anrop"
-        logger.warning(f"Kunde inte hämta namn för Instagram-konto {instagram_id}: {error_msg}")
+        raise LookupError(error_msg)
+    
+    return data.get("username") or data.get("name", f"IG_{instagram_id}")
+
+def get_instagram_account_name(instagram_id, token):
+    """
+    Hämta Instagram-kontonamn från ID.
+
+    Namnet hämtas från API:t första gången kontot efterfrågas (så att namnbyten
+    fångas upp) och återanvänds sedan ur minnet. Kontocachen på disk används
+    som reserv om anropet misslyckas.
+    """
+    try:
+        name = _lookup_instagram_account_name(instagram_id, token)
+    except LookupError as e:
+        cached_name = load_account_cache().get(instagram_id)
+        if cached_name:
+            logger.warning(f"Kunde inte hämta namn för Instagram-konto {instagram_id}: {e} – använder cachat namn {cached_name}")
+            return cached_name
+        logger.warning(f"Kunde inte hämta namn för Instagram-konto {instagram_id}: {e}")
         return None
     
-    name = data.get("username") or data.get("name", f"IG_{instagram_id}")
+    update_account_cache(instagram_id, name)
     return name
 
 # ===================================================================================
@@ -381,7 +637,17 @@ def get_instagram_account_name(instagram_id, token):
 VIEWS_FAMILY = ["views", "video_views", "plays"]  # prioritetsordning
 BASE_METRICS = ["reach", "comments", "likes", "shares", "saved"]
 
-def get_optimal_metrics_for_media(media_product_type: str, media_type: str) -> list:
+# Metriklistorna är fasta per mediatyp – byggs (och kommasepareras för API:et) en
+# gång här i stället för per post. Tupler så att ingen anropare kan ändra dem.
+METRICS_MINIMAL = tuple(BASE_METRICS)
+METRICS_WITH_VIEWS = METRICS_MINIMAL + ("views",)
+METRICS_WITH_VIDEO_VIEWS = METRICS_MINIMAL + ("views", "video_views")
+METRIC_PARAMS = {
+    metrics: ",".join(metrics)
+    for metrics in (METRICS_MINIMAL, METRICS_WITH_VIEWS, METRICS_WITH_VIDEO_VIEWS)
+}
+
+def get_optimal_metrics_for_media(media_product_type: str, media_type: str) -> tuple:
     """
     Optimal metriklista per mediatyp för första försöket.
     Separerad strategi för att undvika metrik-konflikter.
@@ -391,36 +657,52 @@ def get_optimal_metrics_for_media(media_product_type: str, media_type: str) -> l
     
     if pt == "REELS":
         # ENDAST views för Reels - undvik konflikter med plays/video_views
-        return BASE_METRICS + ["views"]
+        return METRICS_WITH_VIEWS
     
     if pt == "FEED":
         if mt == "VIDEO":
             # Feed-video: views + video_views som fallback
-            return BASE_METRICS + ["views", "video_views"]
+            return METRICS_WITH_VIDEO_VIEWS
         else:
             # Feed-bild/karusell: endast views
-            return BASE_METRICS + ["views"]
+            return METRICS_WITH_VIEWS
     
-    return BASE_METRICS.copy()
+    return METRICS_MINIMAL
 
-def get_fallback_metrics_for_media(media_product_type: str, media_type: str) -> list:
+def get_fallback_metrics_for_media(media_product_type: str, media_type: str) -> tuple:
     """
     Fallback-metriker vid 400/#100 fel - endast basmetriker + views
     """
     pt = (media_product_type or "FEED").upper()
     
     if pt == "REELS":
-        return BASE_METRICS + ["views"]
+        return METRICS_WITH_VIEWS
     elif pt == "FEED":
-        return BASE_METRICS + ["views"]
+        return METRICS_WITH_VIEWS
     
-    return BASE_METRICS.copy()
+    return METRICS_MINIMAL
 
-def get_minimal_metrics() -> list:
+def get_minimal_metrics() -> tuple:
     """
     Minimal metriklista vid upprepade fel - endast basmetriker
     """
-    return BASE_METRICS.copy()
+    return METRICS_MINIMAL
+
+def _media_insights_call(media_id: str, metrics: tuple, access_token: str, api_version: str):
+    """Ett insights-anrop för en post. Returnerar (HTTP-status, tolkad JSON)."""
+    global token_revoked
+    if token_revoked:
+        return 401, {"error": {"code": 190, "message": "Access token ogiltig (fel 190 tidigare i körningen)"}}
+    url = f"https://graph.facebook.com/{api_version}/{media_id}/insights"
+    params = {"metric": METRIC_PARAMS.get(metrics) or ",".join(metrics), "access_token": access_token}
+    r, _ = graph_get(url, params, timeout=60)
+    try:
+        data = _json_loads(r.content)
+    except Exception:
+        data = {"error": {"message": f"Non-JSON response (status={r.status_code})"}}
+    if isinstance(data, dict) and data.get("error", {}).get("code") == 190:
+        token_revoked = True
+    return r.status_code, data
 
 def safe_media_insights_v46(media_id: str, media_product_type: str, media_type: str, access_token: str, api_version: str):
     """
@@ -431,78 +713,86 @@ def safe_media_insights_v46(media_id: str, media_product_type: str, media_type:
     2) Vid 400/#100: försök fallback med endast views + basmetriker  
     3) Vid fortsatt fel: minimal lista utan views
     """
-    import requests
-    
-    def _call_api(metric_list: list):
-        url = f"https://graph.facebook.com/{api_version}/{media_id}/insights"
-        params = {"metric": ",".join(metric_list), "access_token": access_token}
-        r = requests.get(url, params=params, timeout=60)
-        try:
-            data = r.json()
-        except Exception:
-            data = {"error": {"message": f"Non-JSON response (status={r.status_code})"}}
-        return r.status_code, data
-
     # STEG 1: Optimal metriklista
     optimal_metrics = get_optimal_metrics_for_media(media_product_type, media_type)
-    status, data = _call_api(optimal_metrics)
+    status, data = _media_insights_call(media_id, optimal_metrics, access_token, api_version)
     
     if status == 200 and isinstance(data, dict) and "data" in data:
-        logger.debug(f"    ✓ Optimal metriklista lyckades: {', '.join(optimal_metrics)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("    ✓ Optimal metriklista lyckades: %s", ", ".join(optimal_metrics))
         return data
 
     # STEG 2: Fallback vid 400/#100
     if status == 400 and isinstance(data, dict):
         err = data.get("error", {})
         if err.get("code") == 100:
-            logger.debug(f"    ⚠ #100 med optimal lista, försöker fallback...")
+            logger.debug("    ⚠ #100 med optimal lista, försöker fallback...")
             
             fallback_metrics = get_fallback_metrics_for_media(media_product_type, media_type)
-            status2, data2 = _call_api(fallback_metrics)
+            status2, data2 = _media_insights_call(media_id, fallback_metrics, access_token, api_version)
             
             if status2 == 200 and isinstance(data2, dict) and "data" in data2:
-                logger.debug(f"    ✓ Fallback lyckades: {', '.join(fallback_metrics)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("    ✓ Fallback lyckades: %s", ", ".join(fallback_metrics))
                 return data2
             
             # STEG 3: Minimal lista utan views
-            logger.debug(f"    ⚠ Fallback misslyckades, försöker minimal lista...")
+            logger.debug("    ⚠ Fallback misslyckades, försöker minimal lista...")
             minimal_metrics = get_minimal_metrics()
-            status3, data3 = _call_api(minimal_metrics)
+            status3, data3 = _media_insights_call(media_id, minimal_metrics, access_token, api_version)
             
             if status3 == 200 and isinstance(data3, dict) and "data" in data3:
-                logger.debug(f"    ✓ Minimal lista lyckades: {', '.join(minimal_metrics)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("    ✓ Minimal lista lyckades: %s", ", ".join(minimal_metrics))
                 return data3
 
     # Returnera ursprungligt fel för loggning
     logger.warning(f"    ✗ Alla fallback-strategier misslyckades för {media_id}")
     return data
 
-def extract_views_from_insights_v46(insights_json: dict) -> tuple[int, str]:
+# Prioritetsordning för Views-källor: views > video_views > plays
+VIEWS_PRIORITY = ("views", "video_views", "plays")
+
+def pick_views_value(view_values: dict) -> tuple[int, str]:
     """
-    v4.6: Extrahera Views med prioritet och källa-spårning
+    v4.6: Välj Views med prioritet och källa-spårning ur {metriknamn: värde}.
+    Värdena samlas in i samma pass som övriga insights-metriker.
     Returnerar (value, source_metric)
     """
-    if not isinstance(insights_json, dict):
-        return 0, ""
-    
-    values = {}
-    for m in insights_json.get("data", []):
-        name = (m.get("name") or "").lower()
-        vals = m.get("values", [])
-        if vals:
-            try:
-                values[name] = int(vals[0].get("value", 0) or 0)
-            except (TypeError, ValueError):
-                values[name] = 0
-    
-    # Prioritetsordning: views > video_views > plays
-    for key in ["views", "video_views", "plays"]:
-        v = values.get(key, 0)
-        if isinstance(v, int) and v > 0:
+    for key in VIEWS_PRIORITY:
+        try:
+            v = int(view_values.get(key, 0) or 0)
+        except (TypeError, ValueError):
+            continue
+        if v > 0:
             return v, key
     
     return 0, ""
 
+@lru_cache(maxsize=None)
+def period_bounds(since_date, until_date):
+    """
+    Tolka periodens datumsträngar (YYYY-MM-DD) en gång per period.
+
+    Returnerar (start_sweden, next_day_sweden, since_epoch, until_epoch) för
+    halvöppet intervall [start, nästa dag efter until). Cachas eftersom samma
+    period används för alla konton under en månad.
+    """
+    sweden_tz = ZoneInfo("Europe/Stockholm")
+    
+    # Startdatum: 00:00 svensk tid första dagen
+    start_sweden = datetime.strptime(since_date, "%Y-%m-%d").replace(tzinfo=sweden_tz)
+    
+    # Slutdatum: HALVÖPPET INTERVALL - 00:00 första dagen NÄSTA månad
+    end_date_obj = datetime.strptime(until_date, "%Y-%m-%d")
+    next_day_sweden = (end_date_obj + timedelta(days=1)).replace(tzinfo=sweden_tz)
+    
+    # Epoch-sekunder (UTC) för entydiga API-anrop
+    since_epoch = int(start_sweden.astimezone(ZoneInfo("UTC")).timestamp())
+    until_epoch = int(next_day_sweden.astimezone(ZoneInfo("UTC")).timestamp())
+    
+    return start_sweden, next_day_sweden, since_epoch, until_epoch
+
 def get_instagram_posts_for_period(instagram_id, since_date, until_date, account_name=None):
     """
     Hämta alla Instagram-posts för en specifik tidsperiod med robust datumfiltrering.
@@ -513,27 +803,12 @@ def get_instagram_posts_for_period(instagram_id, since_date, until_date, account
     logger.info(f"Hämtar posts för {display_name} från {since_date} till {until_date} (v4.6)")
     
     try:
-        # Halvöppet intervall [start, end) med zoneinfo
-        sweden_tz = ZoneInfo("Europe/Stockholm")
-        
-        # Startdatum: 00:00 svensk tid första dagen
-        start_sweden = datetime.strptime(since_date, "%Y-%m-%d").replace(tzinfo=sweden_tz)
-        
-        # Slutdatum: HALVÖPPET INTERVALL - 00:00 första dagen NÄSTA månad
-        end_date_obj = datetime.strptime(until_date, "%Y-%m-%d")
-        next_day_sweden = (end_date_obj + timedelta(days=1)).replace(tzinfo=sweden_tz)
+        # Halvöppet intervall [start, end) med zoneinfo – tolkas en gång per period
+        start_sweden, next_day_sweden, since_epoch, until_epoch = period_bounds(since_date, until_date)
         
-        # Konvertera till UTC för API-anrop
-        start_utc = start_sweden.astimezone(ZoneInfo("UTC"))
-        end_utc = next_day_sweden.astimezone(ZoneInfo("UTC"))
-        
-        # Epoch-sekunder för entydiga API-anrop
-        since_epoch = int(start_utc.timestamp())
-        until_epoch = int(end_utc.timestamp())
-        
-        logger.debug(f"  Tidszonkonvertering (halvöppet intervall):")
-        logger.debug(f"    Sverige: {since_date} 00:00 → {until_date} 24:00 (halvöppet)")  
-        logger.debug(f"    UTC epoch: {since_epoch} → {until_epoch}")
+        logger.debug("  Tidszonkonvertering (halvöppet intervall):")
+        logger.debug("    Sverige: %s 00:00 → %s 24:00 (halvöppet)", since_date, until_date)
+        logger.debug("    UTC epoch: %s → %s", since_epoch, until_epoch)
         
         # PRIMÄRT: Försök server-side filtrering först
         posts = attempt_server_side_filtering(instagram_id, since_epoch, until_epoch, display_name, start_sweden, next_day_sweden)
@@ -552,12 +827,10 @@ def get_instagram_posts_for_period(instagram_id, since_date, until_date, account
                 logger.info(f"  ✓ Kvalitetskontroll: Posts spänner {min_date} → {max_date}")
                 
                 # Analys per mediatyp för diagnostik
-                type_counts = {}
-                for p in posts:
-                    media_type = p.get("media_type", "UNKNOWN")
-                    product_type = p.get("media_product_type", "FEED")
-                    key = f"{product_type}/{media_type}"
-                    type_counts[key] = type_counts.get(key, 0) + 1
+                type_counts = Counter(
+                    f"{p.get('media_product_type', 'FEED')}/{p.get('media_type', 'UNKNOWN')}"
+                    for p in posts
+                )
                 
                 logger.info(f"  Post-fördelning: {dict(type_counts)}")
         
@@ -588,11 +861,11 @@ def attempt_server_side_filtering(instagram_id, since_epoch, until_epoch, displa
         posts_in_period = 0
         posts_outside_period = 0
         
-        logger.debug(f"  Försöker server-side filtrering...")
+        logger.debug("  Försöker server-side filtrering...")
         
         while url and page_num < 100:
             page_num += 1
-            logger.debug(f"    Sida {page_num} för {display_name}...")
+            logger.debug("    Sida %s för %s...", page_num, display_name)
             
             data = api_request(url, params)
             
@@ -617,6 +890,7 @@ def attempt_server_side_filtering(instagram_id, since_epoch, until_epoch, displa
                 next_pg = paging.get("next")
                 if next_pg:
                     url, params = _unpack_next_url(next_pg)
+                    params.setdefault("access_token", ACCESS_TOKEN)
                 else:
                     url = None
 
@@ -695,7 +969,9 @@ def fetch_with_client_filter(instagram_id, start_sweden, next_day_sweden, displa
                         
                         # Halvöppet intervall [start_sweden, next_day_sweden)
                         if start_sweden <= post_sweden < next_day_sweden:
-                            processed_post = process_post_with_timezone(post, display_name, start_sweden, next_day_sweden)
+                            # Redan tolkad tidsstämpel skickas med – ingen ny strptime
+                            processed_post = process_post_with_timezone(post, display_name, start_sweden, next_day_sweden,
+                                                                        post_sweden=post_sweden)
                             if processed_post:
                                 posts.append(processed_post)
                                 page_hits += 1
@@ -704,7 +980,7 @@ def fetch_with_client_filter(instagram_id, start_sweden, next_day_sweden, displa
                             oldest_post_before_period = True
                             
                     except Exception as e:
-                        logger.debug(f"      Fel vid tidskonvertering: {e}")
+                        logger.debug("      Fel vid tidskonvertering: %s", e)
                         continue
             
             if page_hits == 0:
@@ -717,6 +993,7 @@ def fetch_with_client_filter(instagram_id, start_sweden, next_day_sweden, displa
             next_pg = paging.get("next")
             if next_pg:
                 url, params = _unpack_next_url(next_pg)
+                params.setdefault("access_token", ACCESS_TOKEN)
             else:
                 url = None
 
@@ -726,25 +1003,28 @@ def fetch_with_client_filter(instagram_id, start_sweden, next_day_sweden, displa
     logger.info(f"  ✓ Client-side resultat: {len(posts)} posts, {page_num} sidor")
     return posts
 
-def process_post_with_timezone(post, display_name, start_sweden=None, next_day_sweden=None):
+def process_post_with_timezone(post, display_name, start_sweden=None, next_day_sweden=None, post_sweden=None):
     """
-    Bearbeta en post med korrekt tidszonhantering och halvöppet intervall
+    Bearbeta en post med korrekt tidszonhantering och halvöppet intervall.
+
+    post_sweden kan skickas med om anroparen redan tolkat postens tidsstämpel.
     """
     
     try:
-        post_timestamp = post.get("timestamp", "")
-        if not post_timestamp:
-            return None
-        
-        # Parserera UTC timestamp
-        post_utc = datetime.strptime(post_timestamp, "%Y-%m-%dT%H:%M:%S%z")
-        if post_utc.tzinfo is None:
-            post_utc = post_utc.replace(tzinfo=ZoneInfo("UTC"))
+        if post_sweden is None:
+            post_timestamp = post.get("timestamp", "")
+            if not post_timestamp:
+                return None
+            
+            # Parserera UTC timestamp
+            post_utc = datetime.strptime(post_timestamp, "%Y-%m-%dT%H:%M:%S%z")
+            if post_utc.tzinfo is None:
+                post_utc = post_utc.replace(tzinfo=ZoneInfo("UTC"))
+            
+            # Konvertera till svensk tid
+            post_sweden = post_utc.astimezone(ZoneInfo("Europe/Stockholm"))
         
-        # Konvertera till svensk tid
-        sweden_tz = ZoneInfo("Europe/Stockholm")
-        post_sweden = post_utc.astimezone(sweden_tz)
-        post_date = post_sweden.strftime("%Y-%m-%d")
+        post_date = post_sweden.date().isoformat()
         
         # Kontrollera halvöppet intervall om parametrar givna
         if start_sweden and next_day_sweden:
@@ -759,14 +1039,14 @@ def process_post_with_timezone(post, display_name, start_sweden=None, next_day_s
             post["account_name"] = display_name
             
             media_type = post.get("media_type", "UNKNOWN")
-            logger.debug(f"      [+] {post_date} {media_type}/{media_product_type}")
+            logger.debug("      [+] %s %s/%s", post_date, media_type, media_product_type)
             return post
         else:
-            logger.debug(f"      [-] Filtrerad post-typ: {media_product_type}")
+            logger.debug("      [-] Filtrerad post-typ: %s", media_product_type)
             return None
             
     except Exception as e:
-        logger.debug(f"      Fel vid post-bearbetning: {e}")
+        logger.debug("      Fel vid post-bearbetning: %s", e)
         return None
 
 def get_post_insights(post_id, media_type, media_product_type, account_name=None):
@@ -781,7 +1061,7 @@ def get_post_insights(post_id, media_type, media_product_type, account_name=None
     global follows_success_count, follows_fallback_count
     
     display_name = account_name if account_name else "Unknown"
-    logger.debug(f"Hämtar insights för post {post_id} ({media_type}/{media_product_type}) - {display_name}")
+    logger.debug("Hämtar insights för post %s (%s/%s) - %s", post_id, media_type, media_product_type, display_name)
     
     # Skapa resultatstruktur med standardvärden
     result = {
@@ -802,35 +1082,39 @@ def get_post_insights(post_id, media_type, media_product_type, account_name=None
         data = safe_media_insights_v46(post_id, media_product_type, media_type, ACCESS_TOKEN, API_VERSION)
         
         if data and "data" in data:
-            # Parserera insights-data
+            # Parserera insights-data (Views-kandidaterna plockas i samma pass)
+            view_values = {}
             for metric_data in data["data"]:
                 metric_name = metric_data.get("name", "")
                 values = metric_data.get("values", [])
                 
                 if values and len(values) > 0:
                     metric_value = values[0].get("value", 0)
+                    if metric_name.lower() in VIEWS_PRIORITY:
+                        view_values[metric_name.lower()] = metric_value
                     if metric_name in result:
                         result[metric_name] = metric_value
                         if metric_value > 0:
-                            logger.debug(f"    {metric_name}: {metric_value}")
+                            logger.debug("    %s: %s", metric_name, metric_value)
             
             # v4.6: Extrahera Views med källa-spårning
-            views_value, views_source = extract_views_from_insights_v46(data)
+            views_value, views_source = pick_views_value(view_values)
             result["views"] = views_value
             result["views_source"] = views_source
             
             # Logga Views-källa för diagnostik
             if views_value > 0:
-                logger.debug(f"    Views: {views_value} (från '{views_source}')")
+                logger.debug("    Views: %s (från '%s')", views_value, views_source)
             elif media_product_type == "REELS":
                 logger.warning(f"    REELS utan Views-data: {post_id} - kontrollera API-version")
             
             # Hantera follows för FEED (uteslut för REELS)
             include_follows = ENABLE_MEDIA_FOLLOWS and (media_product_type or "").upper() == "FEED"
             if include_follows and result.get("follows", 0) >= 0:
-                follows_success_count += 1
+                with _state_lock:
+                    follows_success_count += 1
             
-            logger.debug(f"    Slutresultat för {post_id}: reach={result['reach']}, likes={result['likes']}, views={result['views']}")
+            logger.debug("    Slutresultat för %s: reach=%s, likes=%s, views=%s", post_id, result['reach'], result['likes'], result['views'])
                         
         elif data and "error" in data:
             error_msg = data["error"].get("message", "Okänt fel")
@@ -842,7 +1126,7 @@ def get_post_insights(post_id, media_type, media_product_type, account_name=None
         else:
             result["status"] = "NO_DATA"
             result["error_message"] = "Inget insights-data returnerat"
-            logger.debug(f"    Inget insights-data för {post_id}")
+            logger.debug("    Inget insights-data för %s", post_id)
             
     except Exception as e:
         result["status"] = "EXCEPTION"
@@ -863,7 +1147,7 @@ def process_posts_with_insights(posts, account_name=None, instagram_account_id=N
     error_count = 0
     
     # v4.6: Utökad Views-statistik
-    views_stats = {"views": 0, "video_views": 0, "plays": 0, "none": 0}
+    views_stats = Counter({"views": 0, "video_views": 0, "plays": 0, "none": 0})
     reels_with_views = 0
     feed_with_views = 0
     
@@ -878,7 +1162,7 @@ def process_posts_with_insights(posts, account_name=None, instagram_account_id=N
             if (i + 1) % 10 == 0 or i == 0:
                 logger.info(f"  Bearbetar post {i+1}/{len(posts)}: {post_id} ({post_date})")
             else:
-                logger.debug(f"  Bearbetar post {i+1}/{len(posts)}: {post_id} ({post_date})")
+                logger.debug("  Bearbetar post %s/%s: %s (%s)", i+1, len(posts), post_id, post_date)
             
             # Hämta insights med v4.6 förbättrad strategi
             insights = get_post_insights(post_id, media_type, media_product_type, display_name)
@@ -914,7 +1198,7 @@ def process_posts_with_insights(posts, account_name=None, instagram_account_id=N
             # Samla Views-statistik för diagnostik
             views_source = insights.get("views_source", "")
             if views_source:
-                views_stats[views_source] = views_stats.get(views_source, 0) + 1
+                views_stats[views_source] += 1
                 
                 if media_product_type == "REELS":
                     reels_with_views += 1
@@ -953,6 +1237,9 @@ def safe_int_value(value, default=0):
     """
     Säkerställer att ett värde är ett heltal
     """
+    # Vanligaste fallet: API:et har redan gett ett heltal
+    if type(value) is int:
+        return value
     if isinstance(value, (int, float)):
         return int(value)
     elif isinstance(value, str) and value.strip().isdigit():
@@ -967,35 +1254,56 @@ def safe_int_value(value, default=0):
 # HÄR BÖRJAR DEL 3 - CSV-hantering, huvudkörning och kommandoradsargument (v4.6)
 # ===================================================================================
 
+# Kolumner i IG_Posts_YYYY_MM.csv
+POST_CSV_FIELDS = [
+    "Account", "Instagram_ID", "Post_ID", "Post_Date", "Post_URL", 
+    "Media_Type", "Media_Product_Type", "Caption_Preview",
+    "Reach", "Comments", "Likes", "Follows", "Shares", "Saved", 
+    "Views", "Views_Source", "Status", "Error_Message"
+]
+
+# Post_ID:n som redan finns i varje månads-CSV (fylls vid första append per fil)
+_existing_post_ids = {}
+
 def ensure_csv_with_headers(filename):
-    """Skapa CSV med headers inklusive ny Views_Source kolumn för v4.6"""
+    """Skapa CSV med headers inklusive ny Views_Source kolumn för v4.6.
+
+    Returnerar True om filen skapades nu (och alltså saknar datarader).
+    """
     if not os.path.exists(filename):
-        fieldnames = [
-            "Account", "Instagram_ID", "Post_ID", "Post_Date", "Post_URL", 
-            "Media_Type", "Media_Product_Type", "Caption_Preview",
-            "Reach", "Comments", "Likes", "Follows", "Shares", "Saved", 
-            "Views", "Views_Source", "Status", "Error_Message"
-        ]
         with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer = csv.DictWriter(f, fieldnames=POST_CSV_FIELDS)
             writer.writeheader()
-        logger.debug(f"Skapade CSV med v4.6 headers: {filename}")
+        logger.debug("Skapade CSV med v4.6 headers: %s", filename)
+        return True
+    return False
 
 def append_posts_to_csv(filename, posts_data):
     """Spara posts till CSV med v4.6 förbättringar"""
     if not posts_data:
         return 0
     
+    # Importeras först här så att körningar utan nya posts (t.ex. när alla
+    # månader redan finns) slipper ladda pandas
+    import pandas as pd
+    
     try:
-        ensure_csv_with_headers(filename)
+        created = ensure_csv_with_headers(filename)
 
         # Hoppa över posts som redan finns i filen (annars ger t.ex.
-        # --update-all dubbletter eftersom vi öppnar i append-läge)
-        existing_ids = set()
-        with open(filename, "r", newline="", encoding="utf-8") as f:
-            for row in csv.DictReader(f):
-                if row.get("Post_ID"):
-                    existing_ids.add(row["Post_ID"])
+        # --update-all dubbletter eftersom vi öppnar i append-läge).
+        # Post_ID:n hålls i minnet per fil så att CSV:n bara läses en gång
+        # per körning i stället för en gång per konto.
+        existing_ids = _existing_post_ids.get(filename)
+        if created or existing_ids is None:
+            if created:
+                # En nyss skapad fil har inga rader att jämföra mot
+                existing_ids = set()
+            else:
+                # Läs bara Post_ID-kolumnen (vektoriserat) i stället för rad-för-rad via DictReader
+                existing = pd.read_csv(filename, usecols=["Post_ID"], dtype=str, encoding="utf-8")
+                existing_ids = set(existing["Post_ID"].dropna())
+            _existing_post_ids[filename] = existing_ids
 
         new_posts = [p for p in posts_data if p.get("Post_ID") not in existing_ids]
         skipped = len(posts_data) - len(new_posts)
@@ -1007,16 +1315,13 @@ def append_posts_to_csv(filename, posts_data):
         sorted_posts = sorted(new_posts,
                              key=lambda x: (x.get("Account", ""), x.get("Post_Date", "")))
         
-        fieldnames = [
-            "Account", "Instagram_ID", "Post_ID", "Post_Date", "Post_URL", 
-            "Media_Type", "Media_Product_Type", "Caption_Preview",
-            "Reach", "Comments", "Likes", "Follows", "Shares", "Saved", 
-            "Views", "Views_Source", "Status", "Error_Message"
-        ]
-        
-        with open(filename, "a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writerows(sorted_posts)
+        # Skriv alla rader i ett svep med pandas C-skrivare; radslut som csv-modulen
+        # använde för headern så att filen inte får blandade radslut
+        pd.DataFrame(sorted_posts, columns=POST_CSV_FIELDS).to_csv(
+            filename, mode="a", header=False, index=False,
+            encoding="utf-8", lineterminator="\r\n"
+        )
+        existing_ids.update(p.get("Post_ID") for p in sorted_posts)
         
         logger.info(f"Sparade {len(sorted_posts)} posts → {filename}")
         return len(sorted_posts)
@@ -1059,6 +1364,42 @@ def process_account_posts_for_month(instagram_id, account_name, year, month):
         logger.error(f"Fel vid bearbetning av @{account_name}: {e}")
         return 0, 1, 0
 
+# Kolumner som summeras för OK-posts i show_posts_summary
+SUMMARY_TOTAL_FIELDS = ("Reach", "Comments", "Likes", "Shares", "Saved", "Follows", "Views")
+
+def _summarize_posts(posts_data):
+    """Samla totaler och fördelningar för summeringen i ett enda pass över posts_data"""
+    totals = dict.fromkeys(SUMMARY_TOTAL_FIELDS, 0)
+    ok_count = 0
+    views_sources = Counter()
+    type_counts = Counter()
+    status_counts = Counter()
+    error_details = Counter()
+    
+    for post in posts_data:
+        status = post.get("Status", "UNKNOWN")
+        status_counts[status] += 1
+        type_counts[f"{post.get('Media_Type', 'UNKNOWN')}/{post.get('Media_Product_Type', 'FEED')}"] += 1
+        
+        if status == "OK":
+            ok_count += 1
+            for field in SUMMARY_TOTAL_FIELDS:
+                totals[field] += safe_int_value(post.get(field, 0))
+            source = post.get("Views_Source", "none")
+            if source:
+                views_sources[source] += 1
+        else:
+            error_details[post.get("Error_Message", "Okänt fel")] += 1
+    
+    return {
+        "totals": totals,
+        "ok_count": ok_count,
+        "views_sources": views_sources,
+        "type_counts": type_counts,
+        "status_counts": status_counts,
+        "error_details": error_details,
+    }
+
 def show_posts_summary(posts_data, account_name, year, month):
     """Visa summering av posts med v4.6 Views-diagnostik"""
     try:
@@ -1066,57 +1407,35 @@ def show_posts_summary(posts_data, account_name, year, month):
             return
             
         display_name = account_name if account_name else "Unknown"
-        ok_posts = [p for p in posts_data if p.get("Status") == "OK"]
+        summary = _summarize_posts(posts_data)
+        ok_count = summary["ok_count"]
         
-        if ok_posts:
-            total_comments = sum(safe_int_value(p.get("Comments", 0)) for p in ok_posts)
-            total_likes = sum(safe_int_value(p.get("Likes", 0)) for p in ok_posts)
-            total_shares = sum(safe_int_value(p.get("Shares", 0)) for p in ok_posts)
-            total_saved = sum(safe_int_value(p.get("Saved", 0)) for p in ok_posts)
-            total_follows = sum(safe_int_value(p.get("Follows", 0)) for p in ok_posts)
-            total_views = sum(safe_int_value(p.get("Views", 0)) for p in ok_posts)
-            
-            avg_reach = sum(safe_int_value(p.get("Reach", 0)) for p in ok_posts) / len(ok_posts)
+        if ok_count:
+            totals = summary["totals"]
+            avg_reach = totals["Reach"] / ok_count
             
             logger.info(f"Summering för @{display_name} - {year}-{month:02d}:")
-            logger.info(f"  - Totaler över {len(ok_posts)} posts:")
-            logger.info(f"    • Comments: {total_comments:,}")
-            logger.info(f"    • Likes: {total_likes:,}")
-            logger.info(f"    • Views: {total_views:,}")
-            logger.info(f"    • Shares: {total_shares:,}")
-            logger.info(f"    • Saved: {total_saved:,}")
-            logger.info(f"    • Follows: {total_follows:,}")
+            logger.info(f"  - Totaler över {ok_count} posts:")
+            logger.info(f"    • Comments: {totals['Comments']:,}")
+            logger.info(f"    • Likes: {totals['Likes']:,}")
+            logger.info(f"    • Views: {totals['Views']:,}")
+            logger.info(f"    • Shares: {totals['Shares']:,}")
+            logger.info(f"    • Saved: {totals['Saved']:,}")
+            logger.info(f"    • Follows: {totals['Follows']:,}")
             logger.info(f"  - Genomsnitt per post:")
             logger.info(f"    • Reach: {avg_reach:.0f}")
-            logger.info(f"    • Views per post: {total_views / len(ok_posts):.0f}")
+            logger.info(f"    • Views per post: {totals['Views'] / ok_count:.0f}")
         
         # v4.6: Views-källor analys
-        views_sources = {}
-        for post in ok_posts:
-            source = post.get("Views_Source", "none")
-            if source:
-                views_sources[source] = views_sources.get(source, 0) + 1
-        
+        views_sources = summary["views_sources"]
         if views_sources:
             logger.info(f"  - Views-källor (v4.6):")
             for source, count in sorted(views_sources.items()):
-                percentage = (count / len(ok_posts)) * 100
+                percentage = (count / ok_count) * 100
                 logger.info(f"    • {source}: {count} posts ({percentage:.1f}%)")
         
         # Post-typ analys
-        type_counts = {}
-        reels_count = 0
-        feed_count = 0
-        
-        for post in posts_data:
-            post_type = f"{post.get('Media_Type', 'UNKNOWN')}/{post.get('Media_Product_Type', 'FEED')}"
-            type_counts[post_type] = type_counts.get(post_type, 0) + 1
-            
-            if post.get('Media_Product_Type') == 'REELS':
-                reels_count += 1
-            elif post.get('Media_Product_Type') == 'FEED':
-                feed_count += 1
-        
+        type_counts = summary["type_counts"]
         if type_counts:
             logger.info(f"  - Post-typer:")
             for post_type, count in sorted(type_counts.items()):
@@ -1124,18 +1443,8 @@ def show_posts_summary(posts_data, account_name, year, month):
                 logger.info(f"    • {post_type}: {count} posts ({percentage:.1f}%)")
         
         # Status-översikt
-        status_counts = {}
-        error_details = {}
-        
-        for post in posts_data:
-            status = post.get("Status", "UNKNOWN")
-            status_counts[status] = status_counts.get(status, 0) + 1
-            
-            if status != "OK":
-                error_msg = post.get("Error_Message", "Okänt fel")
-                if error_msg not in error_details:
-                    error_details[error_msg] = 0
-                error_details[error_msg] += 1
+        status_counts = summary["status_counts"]
+        error_details = summary["error_details"]
         
         if len(status_counts) > 1 or "OK" not in status_counts:
             logger.info(f"  - Status-översikt:")
@@ -1150,51 +1459,40 @@ def show_posts_summary(posts_data, account_name, year, month):
     except Exception as e:
         logger.error(f"Fel vid summering av posts: {e}")
 
+# Månadsrapporter som get_existing_post_reports letar efter: IG_Posts_YYYY_MM.csv
+_REPORT_RE = re.compile(r"^IG_Posts_(\d{4})_(\d{2})\.csv$")
+
 def get_existing_post_reports():
-    """Hitta befintliga post-rapporter"""
+    """Hitta befintliga post-rapporter (ett os.scandir-pass, matchar på entry.name).
+
+    Returnerar en mängd (år, månad) som heltal.
+    """
     existing_reports = set()
     
-    for filename in glob.glob("IG_Posts_*.csv"):
-        try:
-            parts = filename.replace(".csv", "").split("_")
-            if len(parts) == 4 and parts[0] == "IG" and parts[1] == "Posts":
-                year = parts[2]
-                month = parts[3]
-                
-                if year.isdigit() and month.isdigit():
-                    if len(year) == 4 and len(month) == 2:
-                        existing_reports.add(f"{year}-{month}")
-                        logger.debug(f"Hittade befintlig rapport för {year}-{month}: {filename}")
-                        
-        except Exception as e:
-            logger.warning(f"Kunde inte tolka filnamn {filename}: {e}")
+    with os.scandir(".") as entries:
+        for entry in entries:
+            m = _REPORT_RE.match(entry.name)
+            if m and entry.is_file():
+                year, month = int(m.group(1)), int(m.group(2))
+                existing_reports.add((year, month))
+                logger.debug("Hittade befintlig rapport för %s-%02d: %s", year, month, entry.name)
             
     return existing_reports
 
 def get_missing_months_for_posts(existing_reports, start_year_month):
     """Hitta månader som saknar rapporter"""
-    missing_months = []
-    
     start_year, start_month = map(int, start_year_month.split("-"))
-    
     now = datetime.now()
-    current_year = now.year
-    current_month = now.month
-    
-    year = start_year
-    month = start_month
     
-    while (year < current_year) or (year == current_year and month < current_month):
-        month_str = f"{year}-{month:02d}"
-        if month_str not in existing_reports:
-            missing_months.append((year, month))
-        
-        month += 1
-        if month > 12:
-            month = 1
-            year += 1
+    # Räkna månader som index (år * 12 + månad - 1) så att intervallet blir ett
+    # range och jämförelsen en ren mängdoperation utan strängbyggen per månad
+    first_index = start_year * 12 + start_month - 1
+    current_index = now.year * 12 + now.month - 1
+    existing_indices = {year * 12 + month - 1 for year, month in existing_reports}
     
-    return missing_months
+    return [(index // 12, index % 12 + 1)
+            for index in range(first_index, current_index)
+            if index not in existing_indices]
 
 def process_all_accounts_for_month(account_list, year, month, update_existing=False):
     """Bearbeta alla konton för en månad"""
@@ -1207,6 +1505,7 @@ def process_all_accounts_for_month(account_list, year, month, update_existing=Fa
     
     if not update_existing and os.path.exists(output_file):
         os.remove(output_file)
+        _existing_post_ids.pop(output_file, None)
         logger.info(f"Tog bort befintlig {output_file} för fresh start")
     
     for i, (instagram_id, account_name, facebook_page) in enumerate(account_list):
@@ -1297,7 +1596,7 @@ def main():
         logger.error("Token kunde inte valideras. Avbryter.")
         return
     
-    cache = load_account_cache()
+    load_account_cache()
     account_list = get_instagram_accounts_with_access(ACCESS_TOKEN)
     
     if not account_list:
@@ -1309,13 +1608,13 @@ def main():
             year, month = map(int, args.month.split("-"))
             logger.info(f"Kör endast för specifik månad: {year}-{month:02d}")
             
-            start_time_month = time.time()
+            start_time_month = time.monotonic()
             success, errors, posts = process_all_accounts_for_month(
                 account_list, year, month, args.update_all
             )
-            elapsed_time_month = time.time() - start_time_month
+            elapsed_time_month = time.monotonic() - start_time_month
             
-            save_account_cache(cache)
+            save_account_cache()
             show_follows_summary()
             logger.info(f"Klart för {year}-{month:02d}: {success} lyckade posts, {errors} fel i {elapsed_time_month:.1f} sekunder")
             return
@@ -1325,7 +1624,7 @@ def main():
             return
     
     existing_reports = get_existing_post_reports()
-    logger.info(f"Hittade {len(existing_reports)} befintliga rapporter: {', '.join(sorted(existing_reports)) if existing_reports else 'Inga'}")
+    logger.info(f"Hittade {len(existing_reports)} befintliga rapporter: {', '.join(f'{y}-{m:02d}' for y, m in sorted(existing_reports)) if existing_reports else 'Inga'}")
     
     missing_months = get_missing_months_for_posts(existing_reports, start_year_month)
     
@@ -1340,38 +1639,53 @@ def main():
     total_errors_all = 0
     total_posts_all = 0
     
-    for i, (year, month) in enumerate(missing_months):
-        logger.info(f"Bearbetar månad {i+1}/{len(missing_months)}: {year}-{month:02d}")
-        
-        try:
-            month_start_time = time.time()
-            success, errors, posts = process_all_accounts_for_month(
-                account_list, year, month, args.update_all
-            )
-            month_elapsed = time.time() - month_start_time
-            
-            total_success_all += success
-            total_errors_all += errors  
-            total_posts_all += posts
-            
-            logger.info(f"  Månad {year}-{month:02d} slutförd på {month_elapsed:.1f} sekunder")
+    def process_month(year, month):
+        month_start_time = time.monotonic()
+        result = process_all_accounts_for_month(
+            account_list, year, month, args.update_all
+        )
+        logger.info(f"  Månad {year}-{month:02d} slutförd på {time.monotonic() - month_start_time:.1f} sekunder")
+        return result
+    
+    # Månaderna skriver till separata filer och väntar mest på nätverket, så de
+    # kan bearbetas parallellt. Backoff kontrolleras före varje ny månad: har vi
+    # träffat rate limits körs resten en i taget med paus emellan.
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_MONTHS) as executor:
+        futures = {}
+        running = set()
+        for i, (year, month) in enumerate(missing_months):
+            if running and rate_limit_backoff > 1.5:
+                # Rate limits: vänta in pågående månader och pausa innan nästa startas
+                wait(running)
+                running = set()
+                pause_time = min(MONTH_PAUSE_SECONDS, 60)
+                logger.info(f"Pausar i {pause_time} sekunder mellan månader (pga rate limits)...")
+                time.sleep(pause_time)
+            elif len(running) >= MAX_PARALLEL_MONTHS:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
             
-            save_account_cache(cache)
-            
-            if i < len(missing_months) - 1:
-                if rate_limit_backoff > 1.5:
-                    pause_time = min(MONTH_PAUSE_SECONDS, 60)
-                    logger.info(f"Pausar i {pause_time} sekunder mellan månader (pga rate limits)...")
-                    time.sleep(pause_time)
-                else:
-                    logger.info("Fortsätter direkt till nästa månad...")
-                    
-        except Exception as e:
-            logger.error(f"Fel vid bearbetning av månad {year}-{month:02d}: {e}")
-            total_errors_all += 1
-            continue
+            logger.info(f"Bearbetar månad {i+1}/{len(missing_months)}: {year}-{month:02d}")
+            future = executor.submit(process_month, year, month)
+            futures[future] = (year, month)
+            running.add(future)
+        
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                success, errors, posts = future.result()
+                
+                total_success_all += success
+                total_errors_all += errors  
+                total_posts_all += posts
+                
+            except Exception as e:
+                logger.error(f"Fel vid bearbetning av månad {year}-{month:02d}: {e}")
+                total_errors_all += 1
+    
+    # Kontocachen ändras inte av månadskörningarna – spara en gång när alla är klara
+    save_account_cache()
     
-    elapsed_time = time.time() - start_time
+    elapsed_time = time.monotonic() - start_time
     avg_rate = api_call_count / (elapsed_time / 3600) if elapsed_time > 0 else 0
     
     logger.info("===================================================================")
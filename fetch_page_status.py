@@ -15,13 +15,25 @@ import time
 import argparse
 import logging
 import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import itemgetter
 
 import requests
 
+# orjson (valfritt) tolkar stora sidlistor betydligt snabbare än stdlib json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 from config import (
     ACCESS_TOKEN, TOKEN_LAST_UPDATED, API_VERSION,
     MAX_RETRIES, RETRY_DELAY, TOKEN_VALID_DAYS, MAX_REQUESTS_PER_HOUR,
+    CACHE_FILE, BATCH_SIZE,
 )
 
 # Konfigurera loggning
@@ -56,14 +68,28 @@ FIELDNAMES = [
     "is_srholder",
     "error_message",
 ]
+# Plockar ut en rads värden i kolumnordning (build_row/build_error_row fyller alla fält)
+_row_values = itemgetter(*FIELDNAMES)
+
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningar (keep-alive) mellan anrop.
+# Poolen rymmer en anslutning per parallell tokenhämtning (BATCH_SIZE).
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(BATCH_SIZE, 10)))
 
 # Räknare för rate limit-hantering
 api_call_count = 0
-start_time = time.time()
+start_time = time.monotonic()
+# Skyddar api_call_count när tokens förhämtas parallellt
+_state_lock = threading.Lock()
 
 # Den API-version som faktiskt används (kan ändras till fallback under körning)
 effective_api_version = API_VERSION
 
+# Sidcache delad med kommentars-/DM-skripten: {page_id: {"name": ..., "token": ...}}.
+# En Page Access Token är stabil under systemtokenens livstid och behöver därför
+# inte hämtas om vid varje körning; den tas bort ur cachen om API:et svarar med fel 190.
+page_cache = {}
+
 
 def check_token_expiry():
     """Kontrollera om token snart går ut och varna användaren."""
@@ -89,9 +115,10 @@ def api_request(url, params, retries=MAX_RETRIES):
     """
     global api_call_count
 
-    current_time = time.time()
+    current_time = time.monotonic()
     elapsed_hours = (current_time - start_time) / 3600
-    rate = api_call_count / elapsed_hours if elapsed_hours > 0 else 0
+    with _state_lock:
+        rate = api_call_count / elapsed_hours if elapsed_hours > 0 else 0
 
     if rate > MAX_REQUESTS_PER_HOUR * 0.9:
         wait_time = 3600 / MAX_REQUESTS_PER_HOUR
@@ -100,8 +127,9 @@ def api_request(url, params, retries=MAX_RETRIES):
 
     for attempt in range(retries):
         try:
-            api_call_count += 1
-            response = requests.get(url, params=params, timeout=30)
+            with _state_lock:
+                api_call_count += 1
+            response = _session.get(url, params=params, timeout=30)
 
             if response.status_code == 429:
                 retry_after = int(response.headers.get('Retry-After', RETRY_DELAY))
@@ -199,10 +227,14 @@ def check_required_scope(token):
 
 
 def get_page_ids_with_access(token):
-    """Hämta alla sidor som token har åtkomst till (Srholder INKLUDERAS)."""
+    """Hämta alla sidor som token har åtkomst till (Srholder INKLUDERAS).
+
+    Page Access Token följer med i samma svar och läggs i page_cache, så att
+    sidorna inte behöver ett eget token-anrop var.
+    """
     logger.info("Hämtar tillgängliga sidor...")
     url = f"https://graph.facebook.com/{effective_api_version}/me/accounts"
-    params = {"access_token": token, "limit": 100, "fields": "id,name"}
+    params = {"access_token": token, "limit": 100, "fields": "id,name,access_token"}
 
     pages = []
     next_url = url
@@ -218,13 +250,54 @@ def get_page_ids_with_access(token):
     if not pages:
         logger.warning("Inga sidor hittades. Token kanske saknar 'pages_show_list'-behörighet.")
 
-    page_list = [(page["id"], page.get("name", f"Page {page['id']}")) for page in pages]
+    page_list = []
+    for page in pages:
+        page_id = page["id"]
+        page_name = page.get("name", f"Page {page_id}")
+        page_list.append((page_id, page_name))
+        if page.get("access_token"):
+            page_cache.setdefault(page_id, {}).update(name=page_name, token=page["access_token"])
     logger.info(f"✅ Hittade {len(page_list)} sidor (Srholder inkluderade).")
     return page_list
 
 
-def get_page_access_token(page_id, system_token):
-    """Konvertera systemtoken till en Page Access Token för en specifik sida."""
+def load_cache():
+    """Ladda sidcache ({page_id: {"name": ..., "token": ...}}).
+
+    Äldre cachefiler med bara sidnamn ({page_id: namn}) läses in som
+    {"name": namn} utan token.
+    """
+    if os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            return {
+                page_id: entry if isinstance(entry, dict) else {"name": entry}
+                for page_id, entry in cache.items()
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte ladda cache: {e}")
+    return {}
+
+
+def save_cache(cache):
+    """Spara sidcache atomärt (innehåller Page Access Tokens – endast läsbar för ägaren)."""
+    tmp_file = CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, CACHE_FILE)
+    except Exception as e:
+        logger.error(f"❌ Kunde inte spara cache: {e}")
+
+
+def get_page_access_token(page_id, system_token, page_name=None):
+    """Konvertera systemtoken till en Page Access Token för en specifik sida (cachas per sida)."""
+    entry = page_cache.setdefault(page_id, {})
+    if entry.get("token"):
+        return entry["token"]
+
     logger.debug(f"Hämtar Page Access Token för sida {page_id}...")
     url = f"https://graph.facebook.com/{effective_api_version}/{page_id}"
     params = {"fields": "access_token", "access_token": system_token}
@@ -235,9 +308,27 @@ def get_page_access_token(page_id, system_token):
         logger.warning(f"⚠️ Kunde inte hämta Page Access Token för sida {page_id}: {error_msg}")
         return None
 
+    if page_name:
+        entry["name"] = page_name
+    entry["token"] = data["access_token"]
     return data["access_token"]
 
 
+def prefetch_page_tokens(page_list, system_token):
+    """Hämta Page Access Tokens som saknas i cachen parallellt innan huvudloopen.
+
+    Huvudloopen hämtar sedan tokens ur cachen i stället för ett anrop per sida i tur
+    och ordning. Sidor som misslyckas här får ett nytt försök i huvudloopen.
+    """
+    missing = [(page_id, page_name) for page_id, page_name in page_list
+               if not page_cache.get(page_id, {}).get("token")]
+    if not missing:
+        return
+    logger.info(f"🔑 Förhämtar Page Access Tokens för {len(missing)} sidor...")
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, len(missing)))) as executor:
+        list(executor.map(lambda page: get_page_access_token(page[0], system_token, page[1]), missing))
+
+
 def is_version_error(error_msg):
     """Avgör om felet beror på för gammal API-version (felaktig endpoint-väg)."""
     if not error_msg:
@@ -263,6 +354,17 @@ def fetch_page_status(page_id, page_token):
 
     data = _call(effective_api_version)
 
+    if data and data.get("error", {}).get("code") == 190:
+        # Cachad Page Access Token ogiltig – hämta en ny och försök en gång till
+        entry = page_cache.get(page_id, {})
+        if entry.get("token") == page_token:
+            logger.info(f"🔑 Cachad Page Access Token för sida {page_id} är ogiltig och hämtas på nytt")
+            del entry["token"]
+            page_token = get_page_access_token(page_id, ACCESS_TOKEN)
+            if not page_token:
+                return None, "kunde inte hämta page access token"
+            data = _call(effective_api_version)
+
     if data and "error" in data:
         error_msg = data["error"].get("message", "Okänt fel")
         # Versionsfallback: om endpointen inte känns igen, prova en nyare version.
@@ -352,23 +454,50 @@ def build_error_row(run_date, page_id, page_name, error_message):
     }
 
 
-def append_row(output_file, row):
-    """Skriv en rad till CSV i append-läge. Skriv header endast om filen är ny/tom."""
+def open_output_csv(output_file):
+    """Öppna output-CSV i append-läge en gång per körning. Skriv header endast om filen är ny/tom."""
     write_header = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
-    with open(output_file, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        if write_header:
-            writer.writeheader()
-        writer.writerow(row)
+    f = open(output_file, "a", newline="", encoding="utf-8")
+    writer = csv.writer(f)
+    if write_header:
+        writer.writerow(FIELDNAMES)
+    return f, writer
+
+
+def append_row(f, writer, row):
+    """Skriv en rad och flusha direkt så att redan hämtade sidor finns kvar vid avbrott."""
+    writer.writerow(_row_values(row))
+    f.flush()
+
+
+def load_completed_page_ids(output_file):
+    """Sidor som redan har en lyckad rad i dagens output-fil.
+
+    Gör att en omkörning samma dag bara hämtar sidor som saknas eller gav fel,
+    i stället för att hämta om (och dubblera) alla rader.
+    """
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, "r", newline="", encoding="utf-8") as f:
+        # csv.reader + kolumnindex i stället för DictReader: ingen dict per rad
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return set()
+        id_col, status_col = header.index("page_id"), header.index("status")
+        return {row[id_col] for row in reader if len(row) > status_col and row[status_col] != "error"}
 
 
 def load_pages_json(path):
-    """Ladda en valfri JSON-fil [{"id":..., "name":...}, ...] för att begränsa sidor."""
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    """Ladda en valfri JSON-fil [{"id":..., "name":...}, ...] för att begränsa sidor.
+
+    "page_id" accepteras som alternativ nyckel (t.ex. export från fetch_page_status).
+    """
+    with open(path, "rb") as f:
+        data = _json_loads(f.read())
     pages = []
     for entry in data:
-        pid = entry.get("id")
+        pid = entry.get("id") or entry.get("page_id")
         if not pid:
             continue
         pages.append((str(pid), entry.get("name", f"Page {pid}")))
@@ -402,6 +531,9 @@ def main():
     # Mjuk scope-kontroll: varna men avbryt inte
     check_required_scope(ACCESS_TOKEN)
 
+    # Ladda cachen före sidlistan så att färska tokens från me/accounts vinner
+    page_cache.update(load_cache())
+
     # Hämta sidor (Srholder inkluderade)
     if args.pages_json:
         logger.info(f"Läser sidlista från {args.pages_json}...")
@@ -426,45 +558,62 @@ def main():
     output_file = os.path.join(output_dir, f"pagestatus_{now.strftime('%Y%m%d')}.csv")
     logger.info(f"Skriver till: {output_file}")
 
+    completed = load_completed_page_ids(output_file)
+    if completed:
+        logger.info(f"⏭️ {len(completed)} sidor har redan status för {run_date} och hoppas över")
+
+    # Tokens från me/accounts ligger redan i cachen; hämtning behövs bara för sidor
+    # som saknas där (t.ex. från --pages-json)
+    prefetch_page_tokens([page for page in page_list if page[0] not in completed], ACCESS_TOKEN)
+
     total = len(page_list)
-    counts = {"ok": 0, "warning": 0, "restricted": 0, "suspended": 0, "error": 0}
+    counts = Counter()
+    skipped = 0
 
-    for i, (page_id, page_name) in enumerate(page_list, start=1):
-        try:
-            page_token = get_page_access_token(page_id, ACCESS_TOKEN)
-            if not page_token:
-                row = build_error_row(run_date, page_id, page_name, "kunde inte hämta page access token")
-                append_row(output_file, row)
-                counts["error"] += 1
-                logger.info(f"[{i}/{total}] {page_name}: error")
+    f, writer = open_output_csv(output_file)
+    try:
+        for i, (page_id, page_name) in enumerate(page_list, start=1):
+            if page_id in completed:
+                skipped += 1
                 continue
+            try:
+                page_token = get_page_access_token(page_id, ACCESS_TOKEN, page_name)
+                if not page_token:
+                    row = build_error_row(run_date, page_id, page_name, "kunde inte hämta page access token")
+                    append_row(f, writer, row)
+                    counts["error"] += 1
+                    logger.info(f"[{i}/{total}] {page_name}: error")
+                    continue
 
-            data, error_message = fetch_page_status(page_id, page_token)
-            if data is None:
-                row = build_error_row(run_date, page_id, page_name, error_message)
-                append_row(output_file, row)
-                counts["error"] += 1
-                logger.info(f"[{i}/{total}] {page_name}: error ({error_message})")
-                continue
+                data, error_message = fetch_page_status(page_id, page_token)
+                if data is None:
+                    row = build_error_row(run_date, page_id, page_name, error_message)
+                    append_row(f, writer, row)
+                    counts["error"] += 1
+                    logger.info(f"[{i}/{total}] {page_name}: error ({error_message})")
+                    continue
 
-            row = build_row(run_date, page_id, page_name, data)
-            append_row(output_file, row)
-            status = row["status"]
-            counts[status] = counts.get(status, 0) + 1
-            logger.info(f"[{i}/{total}] {page_name}: {status}")
+                row = build_row(run_date, page_id, page_name, data)
+                append_row(f, writer, row)
+                status = row["status"]
+                counts[status] += 1
+                logger.info(f"[{i}/{total}] {page_name}: {status}")
 
-        except Exception as e:
-            logger.error(f"Fel vid bearbetning av sida {page_id}: {e}")
-            row = build_error_row(run_date, page_id, page_name, f"oväntat fel: {e}")
-            append_row(output_file, row)
-            counts["error"] += 1
-            logger.info(f"[{i}/{total}] {page_name}: error")
+            except Exception as e:
+                logger.error(f"Fel vid bearbetning av sida {page_id}: {e}")
+                row = build_error_row(run_date, page_id, page_name, f"oväntat fel: {e}")
+                append_row(f, writer, row)
+                counts["error"] += 1
+                logger.info(f"[{i}/{total}] {page_name}: error")
+    finally:
+        f.close()
+        save_cache(page_cache)
 
     logger.info(
-        f"Sammanfattning: {total} sidor körda — "
-        f"ok: {counts.get('ok', 0)}, warning: {counts.get('warning', 0)}, "
-        f"restricted: {counts.get('restricted', 0)}, suspended: {counts.get('suspended', 0)}, "
-        f"error: {counts.get('error', 0)}"
+        f"Sammanfattning: {sum(counts.values())} sidor körda, {skipped} redan klara (hoppades över) — "
+        f"ok: {counts['ok']}, warning: {counts['warning']}, "
+        f"restricted: {counts['restricted']}, suspended: {counts['suspended']}, "
+        f"error: {counts['error']}"
     )
     logger.info(f"Sparad till: {output_file}")
 
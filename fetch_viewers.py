@@ -33,18 +33,33 @@ VIKTIG SKILLNAD mot gamla skripten (avsiktlig, enligt uppdrag):
 
 import argparse
 import csv
+import gzip
+import hashlib
+import json
 import logging
 import os
+import random
 import re
 import sys
+import threading
 import time
 import traceback
 from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from urllib.parse import urlencode
 
 import requests
 
+# orjson (valfritt) tolkar stora batch-svar betydligt snabbare än stdlib json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # ---------------------------------------------------------------------------
 # Config (återanvänds från befintliga skript)
 # ---------------------------------------------------------------------------
@@ -61,9 +76,15 @@ MAX_RETRIES = getattr(config, "MAX_RETRIES", 3)
 RETRY_DELAY = getattr(config, "RETRY_DELAY", 5)
 TOKEN_LAST_UPDATED = getattr(config, "TOKEN_LAST_UPDATED", None)
 TOKEN_VALID_DAYS = getattr(config, "TOKEN_VALID_DAYS", 60)
+BATCH_SIZE = getattr(config, "BATCH_SIZE", 10)   # antal sidor som hämtas samtidigt
+# Jämn anropstakt mot Graph (token bucket); 0/None = ingen proaktiv begränsning
+MAX_REQUESTS_PER_SECOND = getattr(config, "MAX_REQUESTS_PER_SECOND", 5)
 # OUTPUT_ROOT finns inte i nuvarande config → default = aktuell katalog (som gamla skripten,
 # vilka skriver reach{YYYY}/, IGReach{YYYY}/, weekly_reports/ relativt CWD).
 OUTPUT_ROOT = getattr(config, "OUTPUT_ROOT", ".")
+# Skriv .csv.gz i stället för .csv (bra vid långa backfills mot nätverkslagring).
+# compresslevel=1: nästan samma storleksvinst som högre nivåer till en bråkdel av CPU:n.
+COMPRESS_CSV = getattr(config, "COMPRESS_CSV", False)
 
 # ---------------------------------------------------------------------------
 # FAS 0-RESULTAT LÅSES HÄR. Konstanterna nedan är BÄSTA GISSNING utifrån Metas
@@ -105,6 +126,27 @@ PROBE_BACKSTEPS_MONTHS = [0, 1, 3, 6, 12, 18, 24]
 _PLACEHOLDER_RE = re.compile(r"^[Ss][Rr]holder\w*$")
 
 GRAPH_BASE_TMPL = "https://graph.facebook.com/{ver}"
+# Graph API tar max 50 delanrop per batch-request
+FB_BATCH_LIMIT = 50
+# Graph-felkoder för rate limit (app, användare, sida/BUC, API-specifik gräns)
+RATE_LIMIT_CODES = {4, 17, 32, 613}
+
+# Diskcache för insights-svar (samma katalog och nyckelschema som diagnostics.py).
+# Avslutade perioder ändras inte, så omkörningar av samma månad/vecka behöver inte
+# fråga API:et igen. Perioder som slutat nyligen cachas bara kort.
+RESPONSE_CACHE_DIR = ".fb_api_cache"
+RESPONSE_CACHE_TTL = 3600          # sekunder för perioder som slutat inom HISTORICAL_AFTER_DAYS
+HISTORICAL_AFTER_DAYS = 8
+use_response_cache = True
+
+# Negativ cache för vilande FB-sidor: reach per ISO-vecka för de senaste veckorna.
+# Sidor med reach 0 alla NO_ACTIVITY_WEEKS föregående veckor hämtas inte igen, utom
+# var NO_ACTIVITY_RECHECK:e vecka så att en sida som vaknar till liv upptäcks.
+STATUS_HISTORY_FILE = os.path.join("logs", "status_history.json")
+STATUS_HISTORY_WEEKS = 8
+NO_ACTIVITY_WEEKS = 4
+NO_ACTIVITY_RECHECK = 4
+skip_inactive = True
 
 # ---------------------------------------------------------------------------
 # Logging (svenska, spegla gamla skriptens stil)
@@ -132,6 +174,18 @@ def setup_logging(debug=False):
 _rate_limit_backoff = 1.0
 _last_rate_limit_time = None
 _consecutive_successes = 0
+# Sidor hämtas i parallella trådar – skyddar backoff-tillståndet ovan
+_state_lock = threading.Lock()
+
+# Upp till fyra körningar (FB/IG × månad/vecka) går parallellt, se main()
+MAX_PARALLEL_RUNS = 4
+
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningar (keep-alive) mellan anrop.
+# Poolen rymmer en anslutning per parallell tråd (BATCH_SIZE per körning). Inga
+# urllib3-omförsök – 429/5xx hanteras av backoff-logiken nedan.
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(
+    pool_maxsize=max(BATCH_SIZE, 10) * MAX_PARALLEL_RUNS, max_retries=0))
 
 
 def _unpack_next_url(next_url):
@@ -143,6 +197,112 @@ def _unpack_next_url(next_url):
     return base, qs
 
 
+def _backoff(attempt, cap=30.0):
+    """Full jitter: slumpad väntan i [0, min(cap, RETRY_DELAY * 2^attempt)].
+
+    Parallella trådar som får fel samtidigt försöker då inte igen i takt."""
+    return random.uniform(0, min(cap, RETRY_DELAY * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Högst `rate` anrop/s i snitt, med toppar upp till `capacity` anrop. Trådsäker:
+    acquire() blockerar tills anropet får göras, så parallella trådar sprids ut jämnt
+    i stället för att samtidigt köra in i 429 och sedan vänta ut Retry-After.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.base_rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._slowed_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Ta n tokens (ett batch-anrop kostar ett per delanrop). Är n större än
+        capacity räcker en full hink; skulden betalas av genom att senare anrop väntar."""
+        if not self.rate:
+            return
+        need = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= need:
+                    self._tokens -= n
+                    return
+                wait = (need - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self, factor=0.5, floor=0.5, window=60.0):
+        """Sänk takten efter en rate limit (dock aldrig under floor anrop/s eller över
+        nuvarande takt). Högst en gång per `window` sekunder, så att parallella trådar
+        som träffas av samma rate limit inte halverar takten var för sig."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate and now >= self._slowed_until:
+                self.rate = max(self.rate * factor, min(floor, self.rate))
+                self._slowed_until = now + window
+
+    def speed_up(self, factor=1.25):
+        """Öka takten igen efter en lugn period (aldrig över ursprunglig takt)."""
+        with self._lock:
+            if self.rate:
+                self.rate = min(self.rate * factor, self.base_rate)
+
+
+_request_bucket = TokenBucket(MAX_REQUESTS_PER_SECOND, max(BATCH_SIZE, 10))
+
+# Graph rapporterar förbrukad andel av kvoten i X-App-Usage / X-Business-Use-Case-Usage.
+# Över gränsen pausar vi en stund i stället för att köra vidare tills det blir 429.
+USAGE_THROTTLE_PERCENT = 90
+USAGE_THROTTLE_SECONDS = 30
+
+
+def _usage_percent(headers):
+    """Högsta rapporterade kvotandel (call_count/total_cputime/total_time) i svarets headers."""
+    usages = []
+    app_usage = headers.get("X-App-Usage")
+    if app_usage:
+        try:
+            usages.append(_json_loads(app_usage))
+        except ValueError:
+            pass
+    buc_usage = headers.get("X-Business-Use-Case-Usage")
+    if buc_usage:
+        try:
+            for entries in _json_loads(buc_usage).values():
+                usages.extend(entries)
+        except (ValueError, AttributeError):
+            pass
+    percent = 0
+    for usage in usages:
+        if isinstance(usage, dict):
+            for key in ("call_count", "total_cputime", "total_time"):
+                value = usage.get(key)
+                if isinstance(value, (int, float)):
+                    percent = max(percent, value)
+    return percent
+
+
+def _register_rate_limit(retry_after=None):
+    """Registrera en rate limit (429 eller Graph-kod 4/17/32/613): höj backoff så att
+    alla trådar väntar före nästa anrop och sänk takten i _request_bucket.
+    Returnerar väntetiden i sekunder (Retry-After om den finns, annars 60 s × backoff)."""
+    global _rate_limit_backoff, _last_rate_limit_time, _consecutive_successes
+    with _state_lock:
+        _last_rate_limit_time = time.monotonic()
+        _rate_limit_backoff = min(_rate_limit_backoff * 1.5, 10.0)
+        _consecutive_successes = 0
+        backoff = _rate_limit_backoff
+    wait_s = min(float(retry_after), 120.0) if retry_after else min(60 * backoff, 300)
+    _request_bucket.slow_down(window=wait_s)
+    return wait_s
+
+
 class ApiError(Exception):
     def __init__(self, message, code=None, subcode=None):
         super().__init__(message)
@@ -151,13 +311,90 @@ class ApiError(Exception):
         self.subcode = subcode
 
 
+def _response_cache_path(url, params):
+    """Cachefil för ett anrop – token ingår inte i nyckeln, svaret beror inte på den."""
+    items = sorted((key, str(value)) for key, value in params.items() if key != "access_token")
+    key = hashlib.sha1(f"{url}|{items}".encode("utf-8")).hexdigest()
+    return os.path.join(RESPONSE_CACHE_DIR, key + ".json")
+
+
+@lru_cache(maxsize=None)
+def _parse_until(until):
+    """Tolka en periods until-värde en gång per körning (samma värde för alla sidor).
+    until är YYYY-MM-DD (FB) eller Unix-epoch (IG). None om det inte går att tolka."""
+    try:
+        if str(until).isdigit():
+            return datetime.fromtimestamp(int(until))
+        return datetime.strptime(str(until), "%Y-%m-%d")
+    except (ValueError, OSError):
+        return None
+
+
+def _is_historical(until):
+    """True om perioden slutade för mer än HISTORICAL_AFTER_DAYS dagar sedan."""
+    until_dt = _parse_until(until)
+    if until_dt is None:
+        return False
+    return datetime.now() - until_dt > timedelta(days=HISTORICAL_AFTER_DAYS)
+
+
+def _cache_get(url, params):
+    """Cachat svar för ett periodanrop, eller None."""
+    if not use_response_cache or "until" not in params:
+        return None
+    path = _response_cache_path(url, params)
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except OSError:
+        return None
+    if not (_is_historical(params["until"]) or age < RESPONSE_CACHE_TTL):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_put(url, params, data):
+    """Spara ett lyckat periodsvar med data (skrivs atomärt). Felsvar och tomma svar
+    cachas aldrig – en metric som saknar data nu kan få det senare."""
+    if not use_response_cache or "until" not in params or "error" in data or not data.get("data"):
+        return
+    path = _response_cache_path(url, params)
+    try:
+        os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.debug(f"Kunde inte skriva diskcache: {e}")
+
+
 def api_get(url, params, token=None):
     """
     GET mot Graph API med Bearer-header och reaktiv backoff.
     Returnerar JSON-dict. Kastar ApiError vid Graph-fel (så anropare kan logga per sida
-    och gå vidare). token default = ACCESS_TOKEN.
+    och gå vidare). token default = ACCESS_TOKEN. Svar för perioder (med 'until')
+    hämtas från/sparas i diskcachen.
     """
-    global _rate_limit_backoff, _last_rate_limit_time, _consecutive_successes
+    cached = _cache_get(url, params)
+    if cached is not None:
+        return cached
+    data = _api_call("GET", url, params, token)
+    _cache_put(url, params, data)
+    return data
+
+
+def api_post(url, data, token=None, cost=1):
+    """POST mot Graph API (batch-anrop) med samma auth och backoff som api_get.
+    cost = antal delanrop; så många tokens tas ur _request_bucket."""
+    return _api_call("POST", url, data, token, cost)
+
+
+def _api_call(method, url, params, token=None, cost=1):
+    global _rate_limit_backoff, _consecutive_successes
     token = token or ACCESS_TOKEN
     safe = dict(params)
     safe.pop("access_token", None)
@@ -166,38 +403,49 @@ def api_get(url, params, token=None):
     last_err = None
     for attempt in range(MAX_RETRIES):
         # Proaktiv väntan om vi nyligen rate-limitades.
-        if _last_rate_limit_time is not None:
-            elapsed = time.time() - _last_rate_limit_time
-            wait = 60 * _rate_limit_backoff - elapsed
+        with _state_lock:
+            limit_time, backoff = _last_rate_limit_time, _rate_limit_backoff
+        if limit_time is not None:
+            elapsed = time.monotonic() - limit_time
+            wait = 60 * backoff - elapsed
             if wait > 0:
-                logger.debug(f"Väntar {wait:.1f}s (backoff {_rate_limit_backoff:.1f}x) före anrop")
+                logger.debug(f"Väntar {wait:.1f}s (backoff {backoff:.1f}x) före anrop")
                 time.sleep(wait)
+        _request_bucket.acquire(cost)
         try:
-            resp = requests.get(url, params=safe, headers=headers, timeout=30)
+            if method == "POST":
+                resp = _session.post(url, data=safe, headers=headers, timeout=60)
+            else:
+                resp = _session.get(url, params=safe, headers=headers, timeout=30)
         except requests.RequestException as e:
             last_err = str(e)
-            time.sleep(RETRY_DELAY * (2 ** attempt))
+            time.sleep(_backoff(attempt))
             continue
 
+        usage = _usage_percent(resp.headers)
+        if usage >= USAGE_THROTTLE_PERCENT:
+            logger.warning(f"API-användning {usage:.0f}% av kvoten – pausar {USAGE_THROTTLE_SECONDS}s")
+            time.sleep(USAGE_THROTTLE_SECONDS + random.uniform(0, 1.0))
+
         if resp.status_code == 200:
-            _consecutive_successes += 1
-            if _consecutive_successes >= 50:
-                _rate_limit_backoff = max(_rate_limit_backoff * 0.8, 1.0)
-                _consecutive_successes = 0
-            return resp.json()
+            with _state_lock:
+                _consecutive_successes += 1
+                recovered = _consecutive_successes >= 50
+                if recovered:
+                    _rate_limit_backoff = max(_rate_limit_backoff * 0.8, 1.0)
+                    _consecutive_successes = 0
+            if recovered:
+                _request_bucket.speed_up()
+            return _json_loads(resp.content)
 
         if resp.status_code == 429:
-            _last_rate_limit_time = time.time()
-            _rate_limit_backoff = min(_rate_limit_backoff * 1.5, 10.0)
-            _consecutive_successes = 0
-            ra = resp.headers.get("Retry-After")
-            wait_s = min(float(ra), 120.0) if ra else 60 * _rate_limit_backoff
+            wait_s = _register_rate_limit(resp.headers.get("Retry-After"))
             logger.warning(f"Rate limit (429)! Väntar {wait_s:.0f}s")
-            time.sleep(wait_s)
+            time.sleep(wait_s + random.uniform(0, 1.0))
             continue
 
         if 500 <= resp.status_code < 600:
-            time.sleep(min(RETRY_DELAY * (2 ** attempt), 30))
+            time.sleep(_backoff(attempt))
             continue
 
         # 4xx med Graph-fel
@@ -209,11 +457,9 @@ def api_get(url, params, token=None):
         subcode = err.get("error_subcode")
         msg = err.get("message", resp.text[:200])
         if code == 4:  # app-level rate limit
-            _last_rate_limit_time = time.time()
-            _rate_limit_backoff = min(_rate_limit_backoff * 1.5, 10.0)
-            wait_s = min(60 * _rate_limit_backoff, 300)
+            wait_s = _register_rate_limit()
             logger.warning(f"App rate limit (code 4)! Väntar {wait_s:.0f}s")
-            time.sleep(wait_s)
+            time.sleep(wait_s + random.uniform(0, 1.0))
             continue
         if code == 190:  # token invalid — meningslöst att försöka igen
             raise ApiError(f"Token ogiltig: {msg}", code, subcode)
@@ -244,8 +490,11 @@ def check_token_expiry():
 # ---------------------------------------------------------------------------
 # Sid- och kontolistning
 # ---------------------------------------------------------------------------
+# __slots__ i stället för dataclass(slots=True), som kräver Python 3.10: ingen
+# __dict__ per instans för sid-/kontolistorna som hålls genom hela körningen
 @dataclass
 class FbPage:
+    __slots__ = ("page_id", "name", "token")
     page_id: str
     name: str
     token: str
@@ -253,6 +502,7 @@ class FbPage:
 
 @dataclass
 class IgAccount:
+    __slots__ = ("ig_id", "ig_username", "ig_name", "fb_page_name")
     ig_id: str
     ig_username: str
     ig_name: str
@@ -289,10 +539,13 @@ def list_ig_accounts(api_version):
     """
     Lista IG-konton via me/accounts → instagram_business_account.
     Srholder-sidor behålls som brygga (spegla gamla IG-skriptet: inget Srholder-filter här).
+    Användarnamn och namn hämtas som nästlade fält i samma sidanrop i stället för
+    ett extra anrop per konto.
     """
     base = GRAPH_BASE_TMPL.format(ver=api_version)
     url = f"{base}/me/accounts"
-    params = {"limit": 100, "fields": "id,name,instagram_business_account", "access_token": ACCESS_TOKEN}
+    params = {"limit": 100, "fields": "id,name,instagram_business_account{id,username,name}",
+              "access_token": ACCESS_TOKEN}
     accounts = []
     while True:
         data = api_get(url, params)
@@ -300,15 +553,7 @@ def list_ig_accounts(api_version):
             ig = p.get("instagram_business_account")
             if not ig:
                 continue
-            ig_id = ig["id"]
-            username, ig_name = "", ""
-            try:
-                info = api_get(f"{base}/{ig_id}", {"fields": "username,name", "access_token": ACCESS_TOKEN})
-                username = info.get("username", "")
-                ig_name = info.get("name", "")
-            except ApiError as e:
-                logger.warning(f"Kunde inte hämta IG-info för {ig_id}: {e}")
-            accounts.append(IgAccount(ig_id, username, ig_name, p.get("name", "")))
+            accounts.append(IgAccount(ig["id"], ig.get("username", ""), ig.get("name", ""), p.get("name", "")))
         nxt = data.get("paging", {}).get("next")
         if not nxt:
             break
@@ -320,6 +565,7 @@ def list_ig_accounts(api_version):
 # ---------------------------------------------------------------------------
 # Datum-logik
 # ---------------------------------------------------------------------------
+@lru_cache(maxsize=None)
 def month_bounds_calendar(year, month):
     """Riktiga kalendermånadsgränser (FB). Returnerar (since_str, until_str, p_start, p_end)."""
     last = monthrange(year, month)[1]
@@ -328,6 +574,7 @@ def month_bounds_calendar(year, month):
     return start, end, start, end
 
 
+@lru_cache(maxsize=None)
 def month_bounds_ig_30day(year, month):
     """
     IG: hårt 30-dagarsfönster (until = since + 30*86400) för att hålla sig under IG-gränsen.
@@ -337,11 +584,12 @@ def month_bounds_ig_30day(year, month):
     first = datetime(year, month, 1, tzinfo=timezone.utc)
     since_ts = int(first.timestamp())
     until_ts = since_ts + (30 * 86400)
-    p_start = first.strftime("%Y-%m-%d")
-    p_end = datetime.fromtimestamp(until_ts - 86400, tz=timezone.utc).strftime("%Y-%m-%d")
+    p_start = first.date().isoformat()
+    p_end = datetime.fromtimestamp(until_ts - 86400, tz=timezone.utc).date().isoformat()
     return since_ts, until_ts, p_start, p_end
 
 
+@lru_cache(maxsize=None)
 def iso_week_bounds(iso_year, iso_week):
     """ISO-vecka mån–sön. Returnerar (monday_date, sunday_date)."""
     monday = date.fromisocalendar(iso_year, iso_week, 1)
@@ -388,20 +636,31 @@ def months_from_start(start_ym):
 # CSV — append-per-sida (skriv+flush varje rad direkt)
 # ---------------------------------------------------------------------------
 class AppendCsv:
-    """Öppnar en CSV, skriver header direkt, och flushar efter varje rad. Krasch-säkert."""
+    """Öppnar en CSV, skriver header direkt, och flushar efter varje rad. Krasch-säkert.
+
+    Med COMPRESS_CSV skrivs path + ".gz"; flush per rad ger en gzip-synkpunkt så att
+    alla skrivna rader går att packa upp (t.ex. med zcat) även efter en krasch.
+    """
 
     def __init__(self, path, fieldnames):
+        if COMPRESS_CSV:
+            path += ".gz"
         self.path = path
         self.fieldnames = fieldnames
         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-        self._f = open(path, "w", newline="", encoding="utf-8-sig")
-        self._w = csv.DictWriter(self._f, fieldnames=fieldnames, extrasaction="ignore")
-        self._w.writeheader()
+        if COMPRESS_CSV:
+            self._f = gzip.open(path, "wt", compresslevel=1, newline="", encoding="utf-8-sig")
+        else:
+            self._f = open(path, "w", newline="", encoding="utf-8-sig")
+        # Vanlig csv.writer: raden byggs direkt i kolumnordning (saknade fält blir
+        # tomma, okända ignoreras) utan DictWriters kontroller per rad
+        self._w = csv.writer(self._f)
+        self._w.writerow(fieldnames)
         self._f.flush()
         self.count = 0
 
     def write(self, row):
-        self._w.writerow(row)
+        self._w.writerow([row.get(name, "") for name in self.fieldnames])
         self._f.flush()
         os.fsync(self._f.fileno())
         self.count += 1
@@ -433,9 +692,14 @@ def fetch_fb_page_metric(api_version, page, metric, period, since, until, token=
         data = api_get(url, params, token=token or page.token)
     except ApiError as e:
         return None, str(e)
+    return _sum_fb_insight_values(data), None
+
+
+def _sum_fb_insight_values(data):
+    """Summera värdena i ett FB insights-svar. None = tomt (giltigt anrop, ingen data)."""
     entries = data.get("data", [])
     if not entries:
-        return None, None  # tomt (giltigt anrop, ingen data)
+        return None
     total = 0
     got = False
     for values in entries[0].get("values", []):
@@ -443,7 +707,89 @@ def fetch_fb_page_metric(api_version, page, metric, period, since, until, token=
         if isinstance(v, (int, float)):
             total += int(v)
             got = True
-    return (total if got else None), None
+    return total if got else None
+
+
+def _graph_batch(api_version, calls):
+    """
+    Kör upp till FB_BATCH_LIMIT GET-anrop [(sökväg, query, token|None), ...] i ett enda
+    HTTP-anrop (Graph batch). Returnerar [(svar|None, fel|None), ...] i samma ordning.
+
+    Varje delanrop bär sin egen token i batch-bodyn (POST, aldrig i en loggad URL);
+    själva batchen autentiseras med Bearer-headern som vanligt. Delanrop med 'until'
+    läses från/sparas i diskcachen med samma nyckel som ett enskilt api_get.
+
+    Delanrop som stoppas av rate limit (HTTP 429, kod 4/17/32/613) höjer den delade
+    backoffen och skickas om – bara de – upp till MAX_RETRIES gånger.
+    """
+    base = GRAPH_BASE_TMPL.format(ver=api_version)
+    results = [None] * len(calls)
+    pending = []
+    for i, (path, query, token) in enumerate(calls):
+        cached = _cache_get(f"{base}/{path}", query)
+        if cached is not None:
+            results[i] = (cached, None)
+            continue
+        pending.append(i)
+
+    for attempt in range(MAX_RETRIES):
+        if not pending:
+            break
+        batch = []
+        for i in pending:
+            path, query, token = calls[i]
+            sub_query = dict(query)
+            if token and token != ACCESS_TOKEN:
+                sub_query["access_token"] = token
+            batch.append({"method": "GET", "relative_url": f"{path}?{urlencode(sub_query)}"})
+
+        # Meta räknar varje delanrop mot app- och BUC-kvoten – batchen kostar len(batch) tokens
+        responses = api_post(f"{base}/", {"batch": json.dumps(batch), "include_headers": "false"},
+                             cost=len(batch))
+        if not isinstance(responses, list):
+            raise ApiError("Oväntat svar på batch-anrop")
+
+        throttled = []
+        for i, response in zip(pending, responses):
+            if not response:
+                # Graph returnerar null för delanrop som inte hann köras klart
+                results[i] = (None, "ingen respons i batch")
+                continue
+            try:
+                body = _json_loads(response.get("body") or "{}")
+            except ValueError:
+                body = {}
+            if response.get("code") != 200:
+                err = body.get("error", {})
+                results[i] = (None, f"HTTP {response.get('code')} kod {err.get('code')}/"
+                                    f"{err.get('error_subcode')}: {err.get('message', '')[:200]}")
+                if response.get("code") == 429 or err.get("code") in RATE_LIMIT_CODES:
+                    throttled.append(i)
+                continue
+            path, query, _ = calls[i]
+            _cache_put(f"{base}/{path}", query, body)
+            results[i] = (body, None)
+        for i in pending[len(responses):]:
+            results[i] = (None, "ingen respons i batch")
+
+        if throttled:
+            # Nästa api_post väntar ut backoffen (proaktiv väntan i _api_call)
+            wait_s = _register_rate_limit()
+            if attempt < MAX_RETRIES - 1:
+                logger.warning(f"Rate limit i batch ({len(throttled)} av {len(pending)} delanrop) – "
+                               f"försöker igen om ca {wait_s:.0f}s")
+        pending = throttled
+    return results
+
+
+def fetch_fb_page_metrics_batch(api_version, pages, metric, period, since, until):
+    """
+    Samma insights-anrop som fetch_fb_page_metric, men för upp till FB_BATCH_LIMIT sidor
+    i ett enda HTTP-anrop. Returnerar [(värde|None, fel|None), ...] i samma ordning som pages.
+    """
+    query = {"metric": metric, "period": period, "since": since, "until": until}
+    responses = _graph_batch(api_version, [(f"{page.page_id}/insights", query, page.token) for page in pages])
+    return [(_sum_fb_insight_values(body) if body is not None else None, err) for body, err in responses]
 
 
 def fetch_ig_metric(api_version, ig_id, metric, since_ts, until_ts):
@@ -462,22 +808,49 @@ def fetch_ig_metric(api_version, ig_id, metric, since_ts, until_ts):
         data = api_get(url, params)
     except ApiError as e:
         return None, str(e)
+    return _ig_total_value(data), None
+
+
+def _ig_total_value(data):
+    """Värdet ur ett IG insights-svar med metric_type=total_value. None = ingen data."""
     entries = data.get("data", [])
     if not entries:
-        return None, None
+        return None
     try:
-        return int(entries[0]["total_value"]["value"]), None
+        return int(entries[0]["total_value"]["value"])
     except (KeyError, TypeError, ValueError):
-        return None, None
+        return None
 
 
-def fetch_ig_followers(api_version, ig_id):
-    base = GRAPH_BASE_TMPL.format(ver=api_version)
-    try:
-        data = api_get(f"{base}/{ig_id}", {"fields": "followers_count", "access_token": ACCESS_TOKEN})
-        return data.get("followers_count", "")
-    except ApiError:
-        return ""
+def fetch_ig_metrics_batch(api_version, accounts, since_ts, until_ts, with_followers=False):
+    """
+    Reach + views (och ev. followers) för flera IG-konton i ett Graph batch-anrop.
+    Returnerar [(reach, fel_r, views, fel_v, followers), ...] i samma ordning som accounts.
+    """
+    calls = []
+    for acc in accounts:
+        for metric in (IG_VIEWERS_METRIC, IG_SECONDARY_METRIC):
+            calls.append((f"{acc.ig_id}/insights", {
+                "metric": metric, "period": IG_PERIOD, "metric_type": IG_METRIC_TYPE,
+                "since": since_ts, "until": until_ts,
+            }, None))
+        if with_followers:
+            calls.append((acc.ig_id, {"fields": "followers_count"}, None))
+
+    responses = iter(_graph_batch(api_version, calls))
+    results = []
+    for _ in accounts:
+        (reach_body, err_r), (views_body, err_v) = next(responses), next(responses)
+        followers = ""
+        if with_followers:
+            followers_body, _ = next(responses)
+            followers = (followers_body or {}).get("followers_count", "")
+        results.append((
+            _ig_total_value(reach_body) if reach_body is not None else None, err_r,
+            _ig_total_value(views_body) if views_body is not None else None, err_v,
+            followers,
+        ))
+    return results
 
 
 # ---------------------------------------------------------------------------
@@ -680,6 +1053,53 @@ def _safe_write(writer, row):
         logger.error(f"Kunde inte skriva rad: {e}")
 
 
+def _fetch_concurrently(fetch, items):
+    """
+    Kör fetch(item) i BATCH_SIZE parallella trådar (anropen är rent nätverksbundna) och
+    ge (item, resultat, undantag) i ursprunglig ordning — så att varje rad fortfarande
+    skrivs och flushas för sig, direkt när den är klar.
+    """
+    def call(item):
+        try:
+            return fetch(item), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SIZE, len(items)))) as executor:
+        for item, (result, exc) in zip(items, executor.map(call, items)):
+            yield item, result, exc
+
+
+def _fetch_fb_viewers(api_version, pages, period, since, until):
+    """
+    Viewers för alla FB-sidor: FB_BATCH_LIMIT sidor per batch-anrop, batcherna parallellt.
+    Ger (sida, (värde, fel), undantag) i sidordning, precis som _fetch_concurrently.
+    """
+    chunks = [pages[i:i + FB_BATCH_LIMIT] for i in range(0, len(pages), FB_BATCH_LIMIT)]
+    results = _fetch_concurrently(
+        lambda chunk: fetch_fb_page_metrics_batch(api_version, chunk, FB_VIEWERS_METRIC, period, since, until),
+        chunks)
+    for chunk, chunk_results, exc in results:
+        for page, result in zip(chunk, chunk_results or [None] * len(chunk)):
+            yield page, result, exc
+
+
+def _fetch_ig_viewers(api_version, accounts, since_ts, until_ts, with_followers=False):
+    """
+    Reach + views (och ev. followers) för alla IG-konton: så många konton per batch-anrop
+    som ryms inom FB_BATCH_LIMIT delanrop, batcherna parallellt.
+    Ger (konto, (reach, fel_r, views, fel_v, followers), undantag) i kontoordning.
+    """
+    per_batch = FB_BATCH_LIMIT // (3 if with_followers else 2)
+    chunks = [accounts[i:i + per_batch] for i in range(0, len(accounts), per_batch)]
+    results = _fetch_concurrently(
+        lambda chunk: fetch_ig_metrics_batch(api_version, chunk, since_ts, until_ts, with_followers),
+        chunks)
+    for chunk, chunk_results, exc in results:
+        for acc, result in zip(chunk, chunk_results or [None] * len(chunk)):
+            yield acc, result, exc
+
+
 def _log_run_summary(label, path, ok, skipped):
     """Slutsummering per körning: antal lyckade + skippade med orsak."""
     logger.info(f"[{label}] Sparad till {path}. {ok} ok, {len(skipped)} skippade/fel.")
@@ -707,8 +1127,9 @@ def out_dir(platform, granularity, year, month=None):
     return os.path.join(OUTPUT_ROOT, plat, "week", f"{year}_{month:02d}")
 
 
-def run_fb_month(api_version, year, month):
-    pages = list_fb_pages(api_version)
+def run_fb_month(api_version, year, month, pages=None):
+    if pages is None:
+        pages = list_fb_pages(api_version)
     since, until, p_start, p_end = month_bounds_calendar(year, month)
     src = viewers_source_tag(FB_VIEWERS_METRIC, api_version)
     path = os.path.join(out_dir("facebook", "month", year), f"FB_{year}_{month:02d}.csv")
@@ -716,10 +1137,13 @@ def run_fb_month(api_version, year, month):
     total = 0
     ok = 0
     skipped = []
-    logger.info(f"[FB månad] {year}-{month:02d}: {len(pages)} sidor → {path}")
-    for i, page in enumerate(pages, 1):
+    logger.info(f"[FB månad] {year}-{month:02d}: {len(pages)} sidor → {writer.path}")
+    results = _fetch_fb_viewers(api_version, pages, FB_MONTH_PERIOD, since, until)
+    for i, (page, result, exc) in enumerate(results, 1):
         try:
-            val, err = fetch_fb_page_metric(api_version, page, FB_VIEWERS_METRIC, FB_MONTH_PERIOD, since, until)
+            if exc is not None:
+                raise exc
+            val, err = result
             status = "OK" if err is None else "API_ERROR"
             if val is not None:
                 total += val
@@ -733,40 +1157,107 @@ def run_fb_month(api_version, year, month):
                 skipped.append((page.name, err))
             else:
                 ok += 1
-            logger.info(f"  [{i}/{len(pages)}] {page.name}: {val if val is not None else '—'}")
+            logger.info(f"  [FB månad {i}/{len(pages)}] {page.name}: {val if val is not None else '—'}")
         except Exception as e:
             skipped.append((page.name, f"exception: {e}"))
-            logger.warning(f"  [{i}/{len(pages)}] Hoppar över {page.name}: {e}")
+            logger.warning(f"  [FB månad {i}/{len(pages)}] Hoppar över {page.name}: {e}")
             _safe_write(writer, {
                 "Page": page.name, "Page ID": page.page_id,
                 "Period_start": p_start, "Period_end": p_end,
                 "Views_Source": src, "Status": "SKIPPED", "Comment": str(e)[:200],
             })
     writer.close()
-    _log_run_summary("FB månad", path, ok, skipped)
+    _log_run_summary("FB månad", writer.path, ok, skipped)
     logger.info(f"[FB månad] Total viewers: {total:,}")
 
 
-def run_fb_week(api_version, iso_year, iso_week):
-    pages = list_fb_pages(api_version)
+def _week_key(monday):
+    iso = monday.isocalendar()
+    return f"{iso[0]}-W{iso[1]:02d}"
+
+
+def _load_status_history():
+    """{page_id: {"YYYY-Www": reach}} från STATUS_HISTORY_FILE, eller tom dict."""
+    try:
+        with open(STATUS_HISTORY_FILE, "rb") as f:
+            history = _json_loads(f.read())
+        return history if isinstance(history, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_status_history(history):
+    """Spara historiken atomärt; behåll bara de STATUS_HISTORY_WEEKS senaste veckorna per sida."""
+    for page_id, weeks in history.items():
+        history[page_id] = dict(sorted(weeks.items())[-STATUS_HISTORY_WEEKS:])
+    try:
+        os.makedirs(os.path.dirname(STATUS_HISTORY_FILE), exist_ok=True)
+        tmp_path = STATUS_HISTORY_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False)
+        os.replace(tmp_path, STATUS_HISTORY_FILE)
+    except OSError as e:
+        logger.warning(f"Kunde inte spara {STATUS_HISTORY_FILE}: {e}")
+
+
+def _dormant_page_ids(history, pages, monday):
+    """Sidor med reach 0 alla NO_ACTIVITY_WEEKS veckor före veckan som börjar monday."""
+    previous = [_week_key(monday - timedelta(weeks=k)) for k in range(1, NO_ACTIVITY_WEEKS + 1)]
+    dormant = set()
+    for page in pages:
+        weeks = history.get(page.page_id) or {}
+        if all(weeks.get(key) == 0 for key in previous):
+            dormant.add(page.page_id)
+    return dormant
+
+
+def run_fb_week(api_version, iso_year, iso_week, pages=None):
+    if pages is None:
+        pages = list_fb_pages(api_version)
     monday, sunday = iso_week_bounds(iso_year, iso_week)
+    p_start, p_end = monday.isoformat(), sunday.isoformat()
     src = viewers_source_tag(FB_VIEWERS_METRIC, api_version)
     path = os.path.join(out_dir("facebook", "week", monday.year, monday.month),
                         f"week_{iso_week:02d}.csv")
     writer = AppendCsv(path, FB_WEEK_FIELDS)
     ok = 0
     skipped = []
-    logger.info(f"[FB vecka] {iso_year}-W{iso_week:02d} ({monday}–{sunday}): {len(pages)} sidor → {path}")
+    history = _load_status_history()
+    week_key = _week_key(monday)
+    dormant = set()
+    if skip_inactive and iso_week % NO_ACTIVITY_RECHECK != 0:
+        dormant = _dormant_page_ids(history, pages, monday)
+    logger.info(f"[FB vecka] {iso_year}-W{iso_week:02d} ({monday}–{sunday}): {len(pages)} sidor → {writer.path}")
+    if dormant:
+        logger.info(f"[FB vecka] {len(dormant)} sidor har haft reach 0 de senaste {NO_ACTIVITY_WEEKS} "
+                    f"veckorna och hämtas inte (--no-skip hämtar alla)")
+    results = _fetch_fb_viewers(api_version, [p for p in pages if p.page_id not in dormant],
+                                FB_WEEK_PERIOD, p_start, p_end)
     for i, page in enumerate(pages, 1):
+        if page.page_id in dormant:
+            _safe_write(writer, {
+                "page_id": page.page_id, "page_name": page.name,
+                "year": iso_year, "week": iso_week,
+                "start_date": p_start, "end_date": p_end,
+                "Period_start": p_start, "Period_end": p_end,
+                "reach": "", "Views_Source": src, "status": "NO_ACTIVITY",
+                "comment": f"ej hämtad: reach 0 de senaste {NO_ACTIVITY_WEEKS} veckorna",
+            })
+            # Räknas som 0 så att sviten håller tills nästa kontrollvecka
+            history[page.page_id][week_key] = 0
+            logger.info(f"  [FB vecka {i}/{len(pages)}] {page.name}: vilande, hoppar över")
+            continue
+        _, result, exc = next(results)
         try:
-            val, err = fetch_fb_page_metric(api_version, page, FB_VIEWERS_METRIC, FB_WEEK_PERIOD,
-                                            monday.isoformat(), sunday.isoformat())
+            if exc is not None:
+                raise exc
+            val, err = result
             status = "OK" if err is None else "ERROR"
             writer.write({
                 "page_id": page.page_id, "page_name": page.name,
                 "year": iso_year, "week": iso_week,
-                "start_date": monday.isoformat(), "end_date": sunday.isoformat(),
-                "Period_start": monday.isoformat(), "Period_end": sunday.isoformat(),
+                "start_date": p_start, "end_date": p_end,
+                "Period_start": p_start, "Period_end": p_end,
                 "reach": val if val is not None else "",
                 "Views_Source": src, "status": status, "comment": err or "",
             })
@@ -774,23 +1265,27 @@ def run_fb_week(api_version, iso_year, iso_week):
                 skipped.append((page.name, err))
             else:
                 ok += 1
-            logger.info(f"  [{i}/{len(pages)}] {page.name}: {val if val is not None else '—'}")
+                if val is not None:
+                    history.setdefault(page.page_id, {})[week_key] = val
+            logger.info(f"  [FB vecka {i}/{len(pages)}] {page.name}: {val if val is not None else '—'}")
         except Exception as e:
             skipped.append((page.name, f"exception: {e}"))
-            logger.warning(f"  [{i}/{len(pages)}] Hoppar över {page.name}: {e}")
+            logger.warning(f"  [FB vecka {i}/{len(pages)}] Hoppar över {page.name}: {e}")
             _safe_write(writer, {
                 "page_id": page.page_id, "page_name": page.name,
                 "year": iso_year, "week": iso_week,
-                "start_date": monday.isoformat(), "end_date": sunday.isoformat(),
-                "Period_start": monday.isoformat(), "Period_end": sunday.isoformat(),
+                "start_date": p_start, "end_date": p_end,
+                "Period_start": p_start, "Period_end": p_end,
                 "reach": "", "Views_Source": src, "status": "SKIPPED", "comment": str(e)[:200],
             })
     writer.close()
-    _log_run_summary("FB vecka", path, ok, skipped)
+    _save_status_history(history)
+    _log_run_summary("FB vecka", writer.path, ok, skipped)
 
 
-def run_ig_month(api_version, year, month):
-    accounts = list_ig_accounts(api_version)
+def run_ig_month(api_version, year, month, accounts=None):
+    if accounts is None:
+        accounts = list_ig_accounts(api_version)
     since_ts, until_ts, p_start, p_end = month_bounds_ig_30day(year, month)
     src = viewers_source_tag(IG_VIEWERS_METRIC, api_version)
     path = os.path.join(out_dir("instagram", "month", year), f"IG_{year}_{month:02d}.csv")
@@ -798,12 +1293,13 @@ def run_ig_month(api_version, year, month):
     total_r = total_v = 0
     ok = 0
     skipped = []
-    logger.info(f"[IG månad] {year}-{month:02d}: {len(accounts)} konton → {path}")
-    for i, acc in enumerate(accounts, 1):
+    logger.info(f"[IG månad] {year}-{month:02d}: {len(accounts)} konton → {writer.path}")
+    results = _fetch_ig_viewers(api_version, accounts, since_ts, until_ts, with_followers=True)
+    for i, (acc, result, exc) in enumerate(results, 1):
         try:
-            reach, err_r = fetch_ig_metric(api_version, acc.ig_id, IG_VIEWERS_METRIC, since_ts, until_ts)
-            views, err_v = fetch_ig_metric(api_version, acc.ig_id, IG_SECONDARY_METRIC, since_ts, until_ts)
-            followers = fetch_ig_followers(api_version, acc.ig_id)
+            if exc is not None:
+                raise exc
+            reach, err_r, views, err_v, followers = result
             errs = [e for e in (err_r, err_v) if e]
             status = "OK" if not errs else "API_ERROR"
             if reach:
@@ -820,25 +1316,27 @@ def run_ig_month(api_version, year, month):
                 skipped.append((acc.ig_username, "; ".join(errs[:2])))
             else:
                 ok += 1
-            logger.info(f"  [{i}/{len(accounts)}] @{acc.ig_username}: reach={reach}, views={views}")
+            logger.info(f"  [IG månad {i}/{len(accounts)}] @{acc.ig_username}: reach={reach}, views={views}")
         except Exception as e:
             skipped.append((acc.ig_username, f"exception: {e}"))
-            logger.warning(f"  [{i}/{len(accounts)}] Hoppar över @{acc.ig_username}: {e}")
+            logger.warning(f"  [IG månad {i}/{len(accounts)}] Hoppar över @{acc.ig_username}: {e}")
             _safe_write(writer, {
                 "ig_username": acc.ig_username, "ig_name": acc.ig_name, "fb_page_name": acc.fb_page_name,
                 "Period_start": p_start, "Period_end": p_end,
                 "Views_Source": src, "Status": "SKIPPED", "Comment": str(e)[:200],
             })
     writer.close()
-    _log_run_summary("IG månad", path, ok, skipped)
+    _log_run_summary("IG månad", writer.path, ok, skipped)
     logger.info(f"[IG månad] reach={total_r:,}, views={total_v:,}")
     logger.info("OBS: IG reach = enbart organisk; viewers ≠ gammal FB-reach (definitionsbrott).")
 
 
-def run_ig_week(api_version, iso_year, iso_week):
+def run_ig_week(api_version, iso_year, iso_week, accounts=None):
     """Net-new: ingen IG-vecka fanns tidigare. 30-dagarsgränsen gäller inte veckofönster."""
-    accounts = list_ig_accounts(api_version)
+    if accounts is None:
+        accounts = list_ig_accounts(api_version)
     monday, sunday = iso_week_bounds(iso_year, iso_week)
+    p_start, p_end = monday.isoformat(), sunday.isoformat()
     since_ts = int(datetime(monday.year, monday.month, monday.day, tzinfo=timezone.utc).timestamp())
     until_ts = since_ts + (7 * 86400)
     src = viewers_source_tag(IG_VIEWERS_METRIC, api_version)
@@ -847,17 +1345,19 @@ def run_ig_week(api_version, iso_year, iso_week):
     writer = AppendCsv(path, IG_WEEK_FIELDS)
     ok = 0
     skipped = []
-    logger.info(f"[IG vecka] {iso_year}-W{iso_week:02d} ({monday}–{sunday}): {len(accounts)} konton → {path}")
-    for i, acc in enumerate(accounts, 1):
+    logger.info(f"[IG vecka] {iso_year}-W{iso_week:02d} ({monday}–{sunday}): {len(accounts)} konton → {writer.path}")
+    results = _fetch_ig_viewers(api_version, accounts, since_ts, until_ts)
+    for i, (acc, result, exc) in enumerate(results, 1):
         try:
-            reach, err_r = fetch_ig_metric(api_version, acc.ig_id, IG_VIEWERS_METRIC, since_ts, until_ts)
-            views, err_v = fetch_ig_metric(api_version, acc.ig_id, IG_SECONDARY_METRIC, since_ts, until_ts)
+            if exc is not None:
+                raise exc
+            reach, err_r, views, err_v, _ = result
             errs = [e for e in (err_r, err_v) if e]
             writer.write({
                 "ig_username": acc.ig_username, "ig_name": acc.ig_name, "fb_page_name": acc.fb_page_name,
                 "year": iso_year, "week": iso_week,
                 "Reach": reach if reach is not None else "", "Views": views if views is not None else "",
-                "Period_start": monday.isoformat(), "Period_end": sunday.isoformat(),
+                "Period_start": p_start, "Period_end": p_end,
                 "Views_Source": src, "Status": "OK" if not errs else "API_ERROR",
                 "Comment": "; ".join(errs[:3]),
             })
@@ -865,18 +1365,18 @@ def run_ig_week(api_version, iso_year, iso_week):
                 skipped.append((acc.ig_username, "; ".join(errs[:2])))
             else:
                 ok += 1
-            logger.info(f"  [{i}/{len(accounts)}] @{acc.ig_username}: reach={reach}, views={views}")
+            logger.info(f"  [IG vecka {i}/{len(accounts)}] @{acc.ig_username}: reach={reach}, views={views}")
         except Exception as e:
             skipped.append((acc.ig_username, f"exception: {e}"))
-            logger.warning(f"  [{i}/{len(accounts)}] Hoppar över @{acc.ig_username}: {e}")
+            logger.warning(f"  [IG vecka {i}/{len(accounts)}] Hoppar över @{acc.ig_username}: {e}")
             _safe_write(writer, {
                 "ig_username": acc.ig_username, "ig_name": acc.ig_name, "fb_page_name": acc.fb_page_name,
                 "year": iso_year, "week": iso_week,
-                "Period_start": monday.isoformat(), "Period_end": sunday.isoformat(),
+                "Period_start": p_start, "Period_end": p_end,
                 "Views_Source": src, "Status": "SKIPPED", "Comment": str(e)[:200],
             })
     writer.close()
-    _log_run_summary("IG vecka", path, ok, skipped)
+    _log_run_summary("IG vecka", writer.path, ok, skipped)
 
 
 # ---------------------------------------------------------------------------
@@ -908,14 +1408,23 @@ def build_parser():
     p.add_argument("--output-dir", dest="output_dir",
                    help="Override av output-rot (default = config.OUTPUT_ROOT eller aktuell katalog). "
                         "Använd för torrkörning mot temp-mapp.")
+    p.add_argument("--gzip", action="store_true",
+                   help="Skriv komprimerade .csv.gz (default = config.COMPRESS_CSV eller av).")
+    p.add_argument("--no-cache", dest="no_cache", action="store_true",
+                   help=f"Hämta allt från API:et i stället för diskcachen ({RESPONSE_CACHE_DIR}/).")
+    p.add_argument("--no-skip", dest="no_skip", action="store_true",
+                   help=f"Hämta även FB-sidor med reach 0 de senaste {NO_ACTIVITY_WEEKS} veckorna (--week).")
     p.add_argument("--debug", action="store_true", help="Debug-loggning.")
     return p
 
 
 def main():
-    global OUTPUT_ROOT
+    global OUTPUT_ROOT, COMPRESS_CSV, use_response_cache, skip_inactive
     args = build_parser().parse_args()
     setup_logging(args.debug)
+    # Probe ska testa vad API:et svarar just nu – aldrig läsa eller fylla diskcachen
+    use_response_cache = not (args.no_cache or args.probe)
+    skip_inactive = not args.no_skip
 
     # §1C — fail-fast på saknad obligatorisk config innan någon data hämtas.
     if not ACCESS_TOKEN:
@@ -924,6 +1433,8 @@ def main():
 
     if args.output_dir:
         OUTPUT_ROOT = args.output_dir
+    if args.gzip:
+        COMPRESS_CSV = True
 
     api_version = _api_version(args.api_version)
     logger.info(f"Config: API_VERSION={api_version} (config.py={CONFIG_API_VERSION}), "
@@ -961,12 +1472,18 @@ def main():
         iy, iw = args.iso_week.split("-W")
         iso = (int(iy), int(iw))
 
+    # Sid-/kontolistorna hämtas (och Srholder-filtreras) en gång och delas
+    # mellan månads- och veckokörningarna.
+    pages = list_fb_pages(api_version) if args.facebook else None
+    accounts = list_ig_accounts(api_version) if args.instagram else None
+
+    runs = []
     if args.month:
         y, m = ym if ym else last_complete_month()
         if args.facebook:
-            run_fb_month(api_version, y, m)
+            runs.append((run_fb_month, y, m, pages))
         if args.instagram:
-            run_ig_month(api_version, y, m)
+            runs.append((run_ig_month, y, m, accounts))
 
     if args.week:
         if iso:
@@ -974,9 +1491,17 @@ def main():
         else:
             iy, iw, _, _ = last_complete_iso_week()
         if args.facebook:
-            run_fb_week(api_version, iy, iw)
+            runs.append((run_fb_week, iy, iw, pages))
         if args.instagram:
-            run_ig_week(api_version, iy, iw)
+            runs.append((run_ig_week, iy, iw, accounts))
+
+    # Körningarna är oberoende (egna CSV-filer) och har var för sig bara några få
+    # batch-anrop i luften – kör dem parallellt så att poolen hålls full.
+    # TokenBucket och usage-throttlingen begränsar den totala anropstakten.
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_PARALLEL_RUNS, len(runs)))) as executor:
+        futures = [executor.submit(run, api_version, *run_args) for run, *run_args in runs]
+        for future in futures:
+            future.result()
 
     logger.info("Klar.")
 
@@ -7,6 +7,7 @@
 # åtkomst (ersätter tidigare instagram-permission-checker.py).
 
 import os
+import re
 import csv
 import datetime
 import argparse
@@ -14,6 +15,9 @@ import requests
 import time
 from config import ACCESS_TOKEN, API_VERSION
 
+# Delad HTTP-session: återanvänder TCP/TLS-anslutningen (keep-alive) mellan anrop
+_session = requests.Session()
+
 # Exportera till logs-katalogen för konsistens
 EXPORT_PATH = "logs"
 os.makedirs(EXPORT_PATH, exist_ok=True)
@@ -44,7 +48,7 @@ def api_request(url, params, retries=3):
     """Gör API-anrop med retry-logik"""
     for attempt in range(retries):
         try:
-            response = requests.get(url, params=params, timeout=30)
+            response = _session.get(url, params=params, timeout=30)
             if response.status_code == 200:
                 return response.json()
             elif response.status_code in [500, 502, 503, 504]:
@@ -78,7 +82,7 @@ def debug_token(token, extra_required=frozenset()):
     }
 
     try:
-        response = requests.get(url, params=params, timeout=30)
+        response = _session.get(url, params=params, timeout=30)
         response.raise_for_status()
         data = response.json().get("data", {})
     except Exception as e:
@@ -187,17 +191,17 @@ def get_page_ids_with_access(token):
     print(f"\nHittade totalt {len(pages)} sidor")
     return pages
 
-def test_page_token_access(pages, token):
-    """Testa om Page Access Tokens kan hämtas för varje sida"""
+def test_page_token_access(real_pages, placeholder_pages, token):
+    """Testa om Page Access Tokens kan hämtas för varje sida.
+
+    Tar emot sidorna redan uppdelade av filter_placeholder_pages, så att
+    placeholder-sidorna inte behöver klassificeras en gång till här.
+    """
     print("\n" + "="*80)
     print("TESTAR PAGE ACCESS TOKEN-HÄMTNING")
     print("="*80)
     print("\nDetta krävs för att skripten ska fungera korrekt...")
 
-    # Filtrera bort placeholder-sidor INNAN vi testar
-    real_pages = [p for p in pages
-                  if not (p['name'].startswith('Srholder') and len(p['name']) > 8 and p['name'][8:].isdigit())]
-
     if not real_pages:
         print("\nVARNING: Inga riktiga sidor att testa (endast placeholders)")
         return False
@@ -232,9 +236,8 @@ def test_page_token_access(pages, token):
             page["page_token_ok"] = True
 
     # Markera alla placeholder-sidor också
-    for page in pages:
-        if page not in real_pages:
-            page["page_token_ok"] = True  # Spelar ingen roll, de filtreras ändå bort
+    for page in placeholder_pages:
+        page["page_token_ok"] = True  # Spelar ingen roll, de filtreras ändå bort
 
     print(f"\nResultat: {success_count}/{len(test_pages)} lyckades")
 
@@ -244,14 +247,17 @@ def test_page_token_access(pages, token):
 
     return success_count > 0
 
+# Placeholder-sidor heter "Srholder" följt av siffror (t.ex. Srholder12)
+_is_placeholder_name = re.compile(r"Srholder\d+").fullmatch
+
 def filter_placeholder_pages(pages):
     """Filtrera bort Srholder-sidor"""
     real_pages = []
     placeholder_pages = []
 
     for page in pages:
-        name = page.get("name", "")
-        if name.startswith("Srholder") and name[8:].isdigit():
+        name = page.get("name") or ""
+        if _is_placeholder_name(name):
             placeholder_pages.append(page)
         else:
             real_pages.append(page)
@@ -379,9 +385,10 @@ def save_full_report(scopes, pages, placeholder_pages, instagram_accounts=None):
         # Sektion 2: Riktiga sidor
         writer.writerow(["FACEBOOK-SIDOR (RIKTIGA)"])
         writer.writerow(["Page ID", "Page Name", "Page Token OK"])
-        for page in pages:
-            token_status = "Ja" if page.get("page_token_ok") else "Ej testad"
-            writer.writerow([page["id"], page["name"], token_status])
+        writer.writerows(
+            [page["id"], page["name"], "Ja" if page.get("page_token_ok") else "Ej testad"]
+            for page in pages
+        )
 
         writer.writerow([])
 
@@ -389,21 +396,19 @@ def save_full_report(scopes, pages, placeholder_pages, instagram_accounts=None):
         if placeholder_pages:
             writer.writerow(["PLACEHOLDER-SIDOR (filtreras bort av skript)"])
             writer.writerow(["Page ID", "Page Name"])
-            for page in placeholder_pages:
-                writer.writerow([page["id"], page["name"]])
+            writer.writerows([page["id"], page["name"]] for page in placeholder_pages)
             writer.writerow([])
 
         # Sektion 4: Instagram-konton
         if instagram_accounts is not None:
             writer.writerow(["INSTAGRAM-KONTON"])
             writer.writerow(["Instagram ID", "Användarnamn", "Facebook-sida", "Insights OK"])
-            for account in instagram_accounts:
-                writer.writerow([
-                    account["instagram_id"],
-                    account["instagram_username"],
-                    account["page_name"],
-                    "Ja" if account["insights_ok"] else f"Nej ({account['insights_msg']})"
-                ])
+            writer.writerows([
+                account["instagram_id"],
+                account["instagram_username"],
+                account["page_name"],
+                "Ja" if account["insights_ok"] else f"Nej ({account['insights_msg']})"
+            ] for account in instagram_accounts)
 
     print(f"\nFullständig rapport sparad till: {filepath}")
 
@@ -457,15 +462,15 @@ def main():
         print("Token kanske inte är kopplad till några sidor eller saknar 'pages_show_list'.")
         return
 
-    # Steg 3: Testa Page Access Tokens
-    token_test_ok = test_page_token_access(pages, ACCESS_TOKEN)
+    # Steg 3: Filtrera placeholder-sidor (en gång, används av alla följande steg)
+    real_pages, placeholder_pages = filter_placeholder_pages(pages)
+
+    # Steg 4: Testa Page Access Tokens
+    token_test_ok = test_page_token_access(real_pages, placeholder_pages, ACCESS_TOKEN)
     if not token_test_ok:
         print("\nVARNING: Kunde inte hämta Page Access Tokens!")
         print("Skripten kan misslyckas när de försöker hämta data.")
 
-    # Steg 4: Filtrera placeholder-sidor
-    real_pages, placeholder_pages = filter_placeholder_pages(pages)
-
     # Steg 5 (valfritt): Instagram-konton och insights
     instagram_accounts = None
     if args.instagram: